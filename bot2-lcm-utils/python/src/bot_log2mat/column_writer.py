@@ -0,0 +1,378 @@
+#!/usr/bin/python
+#
+#Writes the messages of each channel of a log as typed columns, one .npy file
+#per field of the LCM type, so that the fields can be loaded by name and
+#memory-mapped with numpy.load(fname, mmap_mode="r").
+#
+#The columns of a channel are written to <dirname>/<channel>/<field>.npy,
+#where the names of nested fields are dotted, e.g. "pose.pos".  Arrays whose
+#length is the same in every message are stored as 2D columns.  Variable
+#length arrays, strings and arrays of LCM types are stored ragged: the values
+#of all the messages are concatenated, and <dirname>/<channel>/offsets/
+#<field>.npy holds nrows + 1 offsets, such that the values of row i are
+#values[offsets[i]:offsets[i + 1]].  The fields of the elements of an array of
+#LCM types have one row per element.
+#
+#The dtype of a numeric column is the wire type of the field, e.g. int8 for
+#an int8_t and float32 for a float, which is found by decoding the first
+#messages of a channel with compiled_flatten.decode_typed.  Without the
+#encoded messages, or if the module of an LCM type isn't found, integers are
+#widened to int64 and floating point numbers to float64.
+
+import os
+import sys
+import types
+import numpy
+
+from stream_writer import make_npy_header, safe_channel_name, \
+        DEFAULT_CHUNK_SIZE
+from compiled_flatten import decode_typed
+
+OFFSETS_DIRNAME = "offsets"
+
+class NpyColumnWriter:
+    """Appends values of a single dtype to a 1D .npy file, chunk_size values
+    at a time."""
+    def __init__(self, fname, dtype, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.fname = fname
+        self.dtype = numpy.dtype(dtype)
+        self.chunk_size = chunk_size
+        self.size = 0
+        self._buf = []
+        dirname = os.path.dirname(fname)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        self._file = open(fname, "wb")
+        self._file.write(make_npy_header(0, None, self.dtype.str))
+
+    def append(self, value):
+        self._buf.append(value)
+        if len(self._buf) >= self.chunk_size:
+            self._flush()
+
+    def extend(self, values):
+        self._buf.extend(values)
+        if len(self._buf) >= self.chunk_size:
+            self._flush()
+
+    def write_bytes(self, data):
+        """Appends the bytes of a string to a uint8 column."""
+        self._flush()
+        self._file.write(data)
+        self.size += len(data)
+
+    def _flush(self):
+        if self._buf:
+            numpy.asarray(self._buf, self.dtype).tofile(self._file)
+            self.size += len(self._buf)
+            self._buf = []
+
+    def close(self, nrows=None, ncols=None):
+        """Finishes the file, as a 2D array of nrows rows of ncols columns if
+        they are given."""
+        self._flush()
+        if nrows is None:
+            nrows = self.size
+        self._file.seek(0)
+        self._file.write(make_npy_header(nrows, ncols, self.dtype.str))
+        self._file.close()
+
+def _scalar_dtype(value):
+    dtype = getattr(value, "lcm_dtype", None)
+    if dtype is not None:
+        return dtype
+    if type(value) is types.BooleanType:
+        return "|b1"
+    if type(value) in (types.IntType, types.LongType):
+        return "<i8"
+    if type(value) is types.FloatType:
+        return "<f8"
+    return None
+
+class _Column:
+    def __init__(self, dirname, path, chunk_size):
+        self.dirname = dirname
+        self.path = path
+        self.chunk_size = chunk_size
+
+    def _writer(self, dtype, offsets=False):
+        if offsets:
+            fname = os.path.join(self.dirname, OFFSETS_DIRNAME,
+                    self.path + ".npy")
+        else:
+            fname = os.path.join(self.dirname, self.path + ".npy")
+        return NpyColumnWriter(fname, dtype, self.chunk_size)
+
+class _ScalarColumn(_Column):
+    def __init__(self, dirname, path, chunk_size, dtype):
+        _Column.__init__(self, dirname, path, chunk_size)
+        self.values = self._writer(dtype)
+
+    def add(self, value):
+        self.values.append(value)
+
+    def is_typed(self):
+        return True
+
+    def close(self):
+        self.values.close()
+
+class _RaggedColumn(_Column):
+    """Keeps the offsets of a column that holds a variable number of values
+    per row."""
+    def __init__(self, dirname, path, chunk_size):
+        _Column.__init__(self, dirname, path, chunk_size)
+        self.offsets = self._writer("<i8", True)
+        self.offsets.append(0)
+        self.nrows = 0
+        self.total = 0
+        self.min_length = None
+        self.max_length = 0
+
+    def _add_length(self, n):
+        self.nrows += 1
+        self.total += n
+        self.offsets.append(self.total)
+        if self.min_length is None or n < self.min_length:
+            self.min_length = n
+        if n > self.max_length:
+            self.max_length = n
+
+    def _remove_offsets(self):
+        self.offsets.close()
+        os.remove(self.offsets.fname)
+
+class _BytesColumn(_RaggedColumn):
+    """Stores strings and byte arrays as uint8 values."""
+    def __init__(self, dirname, path, chunk_size):
+        _RaggedColumn.__init__(self, dirname, path, chunk_size)
+        self.values = self._writer("|u1")
+
+    def add(self, value):
+        self.values.write_bytes(value)
+        self._add_length(len(value))
+
+    def is_typed(self):
+        return True
+
+    def close(self):
+        self.offsets.close()
+        self.values.close()
+
+class _ArrayColumn(_RaggedColumn):
+    """Stores arrays.  What the elements are is only known once a non-empty
+    array has been seen."""
+    def __init__(self, dirname, path, chunk_size):
+        _RaggedColumn.__init__(self, dirname, path, chunk_size)
+        self.values = None
+        self.nested = False
+        self.elements = None
+
+    def _set_element_type(self, value):
+        elem = value[0]
+        if type(elem) in (types.ListType, types.TupleType):
+            arr = numpy.asarray(value)
+            if arr.dtype.kind in "bif":
+                # multi-dimensional numeric arrays are stored flattened
+                self.nested = True
+                first = elem
+                while type(first) in (types.ListType, types.TupleType) and \
+                        len(first):
+                    first = first[0]
+                dtype = getattr(first, "lcm_dtype", None) or arr.dtype.str
+                self.values = self._writer(dtype)
+                return
+        dtype = _scalar_dtype(elem)
+        if dtype is not None:
+            self.values = self._writer(dtype)
+        else:
+            # the fields of LCM type elements are named after the array, the
+            # elements of other arrays get their own offsets
+            path = self.path
+            if not hasattr(elem, "__slots__"):
+                path += "[]"
+            self.elements = _make_column(self.dirname, path, self.chunk_size,
+                    elem)
+            if self.elements is None:
+                sys.stderr.write("ignoring field %s\n" % self.path)
+                self.elements = _IgnoredColumn()
+
+    def add(self, value):
+        if self.values is None and self.elements is None:
+            if not len(value):
+                self._add_length(0)
+                return
+            self._set_element_type(value)
+        if self.values is not None:
+            if self.nested:
+                value = numpy.asarray(value).ravel()
+                self.values.extend(value.tolist())
+            else:
+                self.values.extend(value)
+            self._add_length(len(value))
+        else:
+            for elem in value:
+                self.elements.add(elem)
+            self._add_length(len(value))
+
+    def is_typed(self):
+        """Returns False while no non-empty array has been seen."""
+        if self.elements is not None:
+            return self.elements.is_typed()
+        return self.values is not None
+
+    def close(self):
+        if self.elements is not None:
+            self.offsets.close()
+            self.elements.close()
+            return
+        if self.values is None:
+            self.values = self._writer("<f8")
+        if self.min_length == self.max_length:
+            # the same length in every row, so store the rows as a 2D array
+            self._remove_offsets()
+            self.values.close(self.nrows, self.max_length)
+        else:
+            self.offsets.close()
+            self.values.close()
+
+class _StructColumn(_Column):
+    """Stores the fields of an LCM type as separate columns."""
+    def __init__(self, dirname, path, chunk_size, msg):
+        _Column.__init__(self, dirname, path, chunk_size)
+        self.columns = []
+        for fieldname in msg.__slots__:
+            if path:
+                fieldpath = path + "." + fieldname
+            else:
+                fieldpath = fieldname
+            column = _make_column(dirname, fieldpath, chunk_size,
+                    getattr(msg, fieldname))
+            if column is None:
+                sys.stderr.write("ignoring field %s\n" % fieldpath)
+                continue
+            self.columns.append((fieldname, column))
+
+    def add(self, msg):
+        for fieldname, column in self.columns:
+            column.add(getattr(msg, fieldname))
+
+    def is_typed(self):
+        for fieldname, column in self.columns:
+            if not column.is_typed():
+                return False
+        return True
+
+    def close(self):
+        for fieldname, column in self.columns:
+            column.close()
+
+class _IgnoredColumn:
+    def add(self, value):
+        pass
+
+    def is_typed(self):
+        return True
+
+    def close(self):
+        pass
+
+def _make_column(dirname, path, chunk_size, value):
+    dtype = _scalar_dtype(value)
+    if dtype is not None:
+        return _ScalarColumn(dirname, path, chunk_size, dtype)
+    if type(value) in types.StringTypes:
+        return _BytesColumn(dirname, path, chunk_size)
+    if type(value) in (types.ListType, types.TupleType):
+        return _ArrayColumn(dirname, path, chunk_size)
+    if hasattr(value, "__slots__"):
+        return _StructColumn(dirname, path, chunk_size, value)
+    return None
+
+class ChannelColumnWriter:
+    """Writes the messages of one channel to a directory of columns, plus
+    the log timestamp of each message in the log_timestamp column.
+
+    data is msg encoded, if it is known, which gives the columns the dtypes
+    of the fields' wire types.
+    """
+    def __init__(self, dirname, msg, chunk_size=DEFAULT_CHUNK_SIZE,
+            data=None):
+        self.dirname = dirname
+        self.lcmtype = type(msg)
+        self.nrows = 0
+        self._timestamps = NpyColumnWriter(os.path.join(dirname,
+            "log_timestamp.npy"), "<i8", chunk_size)
+        if data is not None:
+            msg = decode_typed(self.lcmtype, data, msg)
+        self._root = _StructColumn(dirname, "", chunk_size, msg)
+        self._typed = self._root.is_typed()
+
+    def append(self, msg, timestamp, data=None):
+        # the type of the elements of arrays that have always been empty is
+        # only found once they aren't
+        if not self._typed and data is not None:
+            msg = decode_typed(self.lcmtype, data, msg)
+            self._root.add(msg)
+            self._typed = self._root.is_typed()
+        else:
+            self._root.add(msg)
+        self._timestamps.append(timestamp)
+        self.nrows += 1
+
+    def close(self):
+        self._root.close()
+        self._timestamps.close()
+        offsets_dirname = os.path.join(self.dirname, OFFSETS_DIRNAME)
+        if os.path.isdir(offsets_dirname) and not os.listdir(offsets_dirname):
+            os.rmdir(offsets_dirname)
+
+class ColumnLogWriter:
+    """Writes each channel to <dirname>/<channel>/ through a
+    ChannelColumnWriter."""
+    def __init__(self, dirname, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.dirname = dirname
+        self.chunk_size = chunk_size
+        self.writers = {}
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+
+    def append(self, channel, msg, timestamp, data=None):
+        """Appends a decoded message, and data, the encoded message if it is
+        known.  Returns False if a message of a different LCM type was seen
+        on the channel before."""
+        writer = self.writers.get(channel)
+        if writer is None:
+            writer = ChannelColumnWriter(os.path.join(self.dirname,
+                safe_channel_name(channel)), msg, self.chunk_size, data)
+            self.writers[channel] = writer
+        elif type(msg) is not writer.lcmtype:
+            return False
+        writer.append(msg, timestamp, data)
+        return True
+
+    def close(self):
+        """Finishes all the channels, and returns a dictionary mapping
+        channels to their (directory, number of rows)."""
+        result = {}
+        for channel, writer in self.writers.items():
+            writer.close()
+            result[channel] = (writer.dirname, writer.nrows)
+        return result
+
+def load_channel_columns(dirname, mmap_mode="r"):
+    """Loads the columns written by a ChannelColumnWriter.
+
+    Returns a dictionary mapping field names to arrays, and a dictionary
+    mapping the names of ragged fields to their offsets.  The arrays are
+    memory-mapped unless mmap_mode is None.
+    """
+    def load_dir(d):
+        result = {}
+        if os.path.isdir(d):
+            for fname in os.listdir(d):
+                if fname.endswith(".npy"):
+                    result[fname[:-4]] = numpy.load(os.path.join(d, fname),
+                            mmap_mode=mmap_mode)
+        return result
+    return load_dir(dirname), load_dir(os.path.join(dirname, OFFSETS_DIRNAME))
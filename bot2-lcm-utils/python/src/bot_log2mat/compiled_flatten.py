@@ -0,0 +1,204 @@
+#!/usr/bin/python
+#
+#Compiles flatteners for fixed-size LCM types that unpack the flattened row
+#straight from the encoded message with a single struct.Struct, without
+#decoding it into an LCM object first.
+#
+#The wire layout of a type is recovered by tracing its generated _decode_one
+#method: the struct formats it unpacks and the bytes it reads are recorded
+#while it decodes a sample message.  The same tracing gives decode_typed the
+#wire type of each number in a message.
+
+import re
+import struct
+import sys
+
+class _TracingBuffer:
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+        self.reads = []
+
+    def read(self, n):
+        result = self.data[self.pos:self.pos + n]
+        self.pos += n
+        self.reads.append(result)
+        return result
+
+class _TracingStruct:
+    """Stands in for the struct module in generated LCM type modules, and
+    records every unpack call."""
+    def __init__(self):
+        self.unpacks = []
+
+    def unpack(self, fmt, data):
+        self.unpacks.append((fmt, data))
+        return struct.unpack(fmt, data)
+
+    def __getattr__(self, name):
+        return getattr(struct, name)
+
+# struct format characters -> numpy dtypes
+_FORMAT_DTYPES = {
+        "b" : "|i1", "B" : "|u1", "?" : "|b1",
+        "h" : "<i2", "H" : "<u2",
+        "i" : "<i4", "I" : "<u4", "l" : "<i4", "L" : "<u4",
+        "q" : "<i8", "Q" : "<u8",
+        "f" : "<f4", "d" : "<f8",
+        }
+_format_regex = re.compile(r"(\d*)([a-zA-Z?])")
+
+def _make_typed_class(base, dtype):
+    return type("%s_%s" % (base.__name__, dtype[1:]), (base,),
+            { "lcm_dtype" : dtype })
+
+_TYPED_CLASSES = {}
+for _dtype in set(_FORMAT_DTYPES.values()):
+    if _dtype[1] == "f":
+        _TYPED_CLASSES[_dtype] = _make_typed_class(float, _dtype)
+    elif _dtype[1] != "b":
+        _TYPED_CLASSES[_dtype] = _make_typed_class(long, _dtype)
+
+class _TypingStruct:
+    """Stands in for the struct module in generated LCM type modules, and
+    returns numbers that remember the wire type they were unpacked from in
+    their lcm_dtype attribute."""
+    def unpack(self, fmt, data):
+        values = struct.unpack(fmt, data)
+        result = []
+        for count, code in _format_regex.findall(fmt):
+            if code in "xX":
+                continue
+            if code in "sp":
+                count = 1
+            elif count:
+                count = int(count)
+            else:
+                count = 1
+            klass = _TYPED_CLASSES.get(_FORMAT_DTYPES.get(code))
+            for value in values[len(result):len(result) + count]:
+                if klass is not None:
+                    value = klass(value)
+                result.append(value)
+        return tuple(result)
+
+    def __getattr__(self, name):
+        return getattr(struct, name)
+
+def _find_type_modules(msg, modules):
+    mod = sys.modules.get(msg.__class__.__module__)
+    if mod is not None and getattr(mod, "struct", None) is struct:
+        modules.add(mod)
+    for fieldname in msg.__slots__:
+        value = getattr(msg, fieldname)
+        if hasattr(value, "_decode_one"):
+            _find_type_modules(value, modules)
+        elif type(value) in (list, tuple):
+            for item in value:
+                if hasattr(item, "_decode_one"):
+                    _find_type_modules(item, modules)
+    return modules
+
+def _trace_layout(lcmtype, payload, modules):
+    """Decodes payload with lcmtype._decode_one, and returns the struct
+    format that describes the bytes it read, or None if it failed."""
+    tracer = _TracingStruct()
+    for mod in modules:
+        mod.struct = tracer
+    try:
+        buf = _TracingBuffer(payload)
+        try:
+            lcmtype._decode_one(buf)
+        except Exception:
+            return None
+    finally:
+        for mod in modules:
+            mod.struct = struct
+    if buf.pos != len(payload):
+        return None
+
+    layout = [ ">" ]
+    unpacks = tracer.unpacks
+    i = 0
+    for data in buf.reads:
+        if i < len(unpacks) and unpacks[i][1] is data:
+            fmt = unpacks[i][0]
+            if fmt[:1] in "<>!=@":
+                fmt = fmt[1:]
+            layout.append(fmt)
+            i += 1
+        elif data:
+            # read but not unpacked, e.g. a byte array
+            layout.append("%dx" % len(data))
+    if i != len(unpacks):
+        return None
+    return "".join(layout)
+
+def decode_typed(lcmtype, data, msg):
+    """Decodes data, an encoded message of lcmtype, again, such that its
+    integer and floating point fields hold numbers with an lcm_dtype
+    attribute, the numpy dtype of their wire type, e.g. "|i1" for an int8_t.
+
+    msg is data decoded as usual, which tells which modules the types of the
+    message are in.  Booleans are decoded as bool, and the fields of LCM
+    types whose module isn't found as usual.
+    """
+    modules = _find_type_modules(msg, set())
+    typer = _TypingStruct()
+    for mod in modules:
+        mod.struct = typer
+    try:
+        return lcmtype.decode(data)
+    finally:
+        for mod in modules:
+            mod.struct = struct
+
+def _same_value(a, b):
+    return a == b or (a != a and b != b)
+
+def compile_flattener(lcmtype, data, msg, flattener):
+    """Compiles a flattener for lcmtype from a sample message.
+
+    data is the encoded sample message, and msg the sample decoded, and
+    flattener the generic flattener for it.  Returns a function that takes
+    an encoded message of the same size as data and returns the same row as
+    flattener would for the decoded message, or None if lcmtype is not a
+    fixed-size type.
+    """
+    payload = data[8:]
+    modules = _find_type_modules(msg, set())
+    layout = _trace_layout(lcmtype, payload, modules)
+    if layout is None:
+        return None
+
+    # array lengths and strings make the layout depend on the message
+    # contents, so check that it stays the same for very different contents
+    for fill in ("\x00", "\x01"):
+        if _trace_layout(lcmtype, fill * len(payload), modules) != layout:
+            return None
+
+    st = struct.Struct(layout)
+    if st.size != len(payload):
+        return None
+    expected = flattener(msg)
+    row = st.unpack_from(data, 8)
+    if len(row) != len(expected):
+        return None
+    for a, b in zip(row, expected):
+        if not _same_value(a, b):
+            return None
+
+    unpack_from = st.unpack_from
+    bool_columns = [ i for i, value in enumerate(expected) \
+            if type(value) is bool ]
+    if bool_columns:
+        def compiled(data):
+            row = list(unpack_from(data, 8))
+            for i in bool_columns:
+                row[i] = bool(row[i])
+            return row
+    else:
+        def compiled(data):
+            return list(unpack_from(data, 8))
+    compiled.size = len(data)
+    return compiled
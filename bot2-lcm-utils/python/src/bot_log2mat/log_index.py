@@ -0,0 +1,276 @@
+#!/usr/bin/python
+#
+#Indexes the events of an LCM log by channel, so that tools that only need a
+#few channels can seek straight to their events instead of reading the whole
+#log.  The index is kept in a sidecar file next to the log, and rebuilt when
+#the log changes.
+#
+#The sidecar file is a numpy .npz file of plain arrays, which is loaded without
+#unpickling, since logs and their index files are often passed around.
+
+import os
+import sys
+import numpy
+
+from log_split import LCM_SYNC_WORD, MAX_CHANNEL_LENGTH, event_header, \
+        find_event_start
+
+INDEX_SUFFIX = ".idx"
+# version 1 indexes stopped at the first corrupt event header, and version 2
+# indexes were pickled
+INDEX_VERSION = 3
+
+# one entry per event: where its header starts, its timestamp, and the size
+# of its message data
+index_dtype = numpy.dtype([ ("offset", "<i8"), ("timestamp", "<i8"),
+    ("size", "<u4") ])
+
+# how much of the log is read at a time when scanning it.  After skipping
+# over a large message, only a small block is read, in case the next message
+# is large too.
+SCAN_BLOCK_SIZE = 1 << 20
+SKIP_BLOCK_SIZE = 4096
+
+def index_filename(log_fname):
+    return log_fname + INDEX_SUFFIX
+
+def scan_log(fname, offset=0):
+    """Reads the event headers of the log fname, starting at offset.
+
+    Yields (offset, timestamp, channel, data size) for each complete event.
+    Only the headers and channel names are read, so events with large
+    messages are skipped over rather than read.  Like lcm's EventLog, the
+    scan skips over corrupt data to the next valid event header.
+    """
+    file_size = os.path.getsize(fname)
+    f = open(fname, "rb")
+    hsize = event_header.size
+    unpack_from = event_header.unpack_from
+    block = ""
+    block_start = offset
+    try:
+        while offset + hsize <= file_size:
+            pos = offset - block_start
+            if pos < 0 or pos + hsize > len(block):
+                if 0 <= pos <= len(block):
+                    blocksize = SCAN_BLOCK_SIZE
+                else:
+                    blocksize = SKIP_BLOCK_SIZE
+                f.seek(offset)
+                block = f.read(blocksize)
+                block_start = offset
+                pos = 0
+            sync, eventnum, timestamp, channellen, datalen = \
+                    unpack_from(block, pos)
+            if sync != LCM_SYNC_WORD or channellen > MAX_CHANNEL_LENGTH:
+                sys.stderr.write("warning: bad event header at offset %d of %s,"
+                        " skipping to the next event\n" % (offset, fname))
+                offset = find_event_start(f, offset + 1, file_size)
+                block = ""
+                continue
+            end = offset + hsize + channellen + datalen
+            if end > file_size:
+                # truncated, e.g. the log is still being written
+                return
+            if pos + hsize + channellen > len(block):
+                f.seek(offset + hsize)
+                channel = f.read(channellen)
+                block = ""
+            else:
+                channel = block[pos + hsize:pos + hsize + channellen]
+            yield offset, timestamp, channel, datalen
+            offset = end
+    finally:
+        f.close()
+
+class LogIndex:
+    """Maps each channel of a log to an array of index_dtype entries, one per
+    event on the channel, in log order.
+
+    log_size and log_mtime are those of the log when it was indexed, and
+    are used to tell when the index is out of date.
+    """
+    def __init__(self, log_size, log_mtime, channels):
+        self.log_size = log_size
+        self.log_mtime = log_mtime
+        self.channels = channels
+
+    def is_current(self, log_fname):
+        st = os.stat(log_fname)
+        return st.st_size == self.log_size and st.st_mtime == self.log_mtime
+
+    def select(self, channels, start_utime=None, end_utime=None,
+            decimate=None):
+        """Returns the offsets of the events on the given channels in log
+        order, and for each event the position of its channel in
+        channels.
+
+        If start_utime or end_utime are given, only the events with
+        timestamps from start_utime up to but not including end_utime are
+        selected, which assumes that timestamps increase through the log.
+        If decimate is given, it is called with the name and the array of
+        timestamps of each channel's selected events, and returns the
+        indices of the events to keep, or None to keep them all.
+        """
+        offsets = []
+        channel_ids = []
+        for i, chan in enumerate(channels):
+            entries = self.channels.get(chan)
+            if entries is None:
+                continue
+            timestamps = entries["timestamp"]
+            first = 0
+            last = len(entries)
+            if start_utime is not None:
+                first = numpy.searchsorted(timestamps, start_utime, "left")
+            if end_utime is not None:
+                last = numpy.searchsorted(timestamps, end_utime, "left")
+            entries = entries[first:last]
+            if decimate is not None:
+                keep = decimate(chan, entries["timestamp"])
+                if keep is not None:
+                    entries = entries[keep]
+            offsets.append(entries["offset"])
+            channel_ids.append(numpy.repeat(numpy.int32(i), len(entries)))
+        if not offsets:
+            return numpy.zeros(0, "<i8"), numpy.zeros(0, "<i4")
+        offsets = numpy.concatenate(offsets)
+        channel_ids = numpy.concatenate(channel_ids)
+        order = numpy.argsort(offsets, kind="mergesort")
+        return offsets[order], channel_ids[order]
+
+    def save(self, fname):
+        """Writes the index to fname, replacing it atomically.
+
+        The entries of all the channels are stored concatenated, along with
+        the number of entries of each channel and the channel names, which
+        are stored as their lengths and their concatenated bytes.
+        """
+        names = sorted(self.channels)
+        counts = [ len(self.channels[name]) for name in names ]
+        if names:
+            entries = numpy.concatenate([ self.channels[name] \
+                    for name in names ])
+        else:
+            entries = numpy.zeros(0, index_dtype)
+        tmp_fname = "%s.%d.tmp" % (fname, os.getpid())
+        f = open(tmp_fname, "wb")
+        try:
+            try:
+                numpy.savez(f,
+                        version=numpy.array([ INDEX_VERSION ], "<i8"),
+                        log_size=numpy.array([ self.log_size ], "<i8"),
+                        log_mtime=numpy.array([ self.log_mtime ], "<f8"),
+                        name_lengths=numpy.array([ len(name) \
+                                for name in names ], "<i8"),
+                        names=numpy.frombuffer("".join(names), "|u1"),
+                        counts=numpy.array(counts, "<i8"),
+                        entries=entries)
+            finally:
+                f.close()
+            os.rename(tmp_fname, fname)
+        except:
+            if os.path.exists(tmp_fname):
+                os.remove(tmp_fname)
+            raise
+
+def load_log_index(fname):
+    """Loads an index saved with LogIndex.save, or returns None if it can't
+    be read."""
+    try:
+        f = open(fname, "rb")
+    except IOError:
+        return None
+    try:
+        try:
+            npz = numpy.load(f, allow_pickle=False)
+            if npz["version"][0] != INDEX_VERSION:
+                return None
+            log_size = int(npz["log_size"][0])
+            log_mtime = float(npz["log_mtime"][0])
+            name_lengths = npz["name_lengths"]
+            names = npz["names"].tostring()
+            counts = npz["counts"]
+            entries = npz["entries"]
+        except Exception:
+            return None
+    finally:
+        f.close()
+    if entries.dtype != index_dtype or len(counts) != len(name_lengths) or \
+            counts.sum() != len(entries) or \
+            name_lengths.sum() != len(names):
+        return None
+    channels = {}
+    name_start = 0
+    entry_start = 0
+    for name_length, count in zip(name_lengths, counts):
+        name = names[name_start:name_start + name_length]
+        channels[name] = entries[entry_start:entry_start + count]
+        name_start += name_length
+        entry_start += count
+    return LogIndex(log_size, log_mtime, channels)
+
+def build_log_index(log_fname):
+    """Scans the log log_fname and returns its LogIndex."""
+    st = os.stat(log_fname)
+    # entries are collected in lists, and moved to arrays every so often to
+    # keep the memory used per event low
+    pending = {}
+    arrays = {}
+    for offset, timestamp, channel, datalen in scan_log(log_fname):
+        entries = pending.get(channel)
+        if entries is None:
+            entries = pending[channel] = []
+            arrays[channel] = []
+        entries.append((offset, timestamp, datalen))
+        if len(entries) == 65536:
+            arrays[channel].append(numpy.array(entries, dtype=index_dtype))
+            del entries[:]
+    channels = {}
+    for channel, entries in pending.items():
+        arrs = arrays[channel]
+        if entries:
+            arrs.append(numpy.array(entries, dtype=index_dtype))
+        channels[channel] = numpy.concatenate(arrs)
+    return LogIndex(st.st_size, st.st_mtime, channels)
+
+def get_log_index(log_fname, save=True):
+    """Returns the LogIndex of the log log_fname.
+
+    The index is loaded from the sidecar file next to the log if it is up to
+    date, otherwise the log is scanned and, if save is true, the sidecar
+    file is written, if the log's directory is writable.
+    """
+    idx_fname = index_filename(log_fname)
+    index = load_log_index(idx_fname)
+    if index is not None and index.is_current(log_fname):
+        return index
+    index = build_log_index(log_fname)
+    if save:
+        try:
+            index.save(idx_fname)
+        except (IOError, OSError), err:
+            sys.stderr.write("couldn't save log index %s: %s\n" % \
+                    (idx_fname, err))
+    return index
+
+def read_events(log, offsets):
+    """Reads the events at the given offsets from log, an lcm.EventLog or
+    an mmap_log.MmapEventLog."""
+    for offset in offsets:
+        log.seek(int(offset))
+        yield log.read_next_event()
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        sys.stderr.write("usage: %s <logfile>\n" % sys.argv[0])
+        sys.exit(1)
+    index = get_log_index(sys.argv[1])
+    for channel in sorted(index.channels):
+        entries = index.channels[channel]
+        duration = (entries["timestamp"][-1] - entries["timestamp"][0]) / 1e6
+        rate = 0
+        if duration > 0:
+            rate = (len(entries) - 1) / duration
+        print "%-30s %8d events %12d bytes %8.1f Hz" % (channel, len(entries),
+                entries["size"].sum(), rate)
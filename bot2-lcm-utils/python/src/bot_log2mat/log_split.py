@@ -0,0 +1,104 @@
+#!/usr/bin/python
+#
+#Splits an LCM log file into byte ranges that start on event boundaries, so
+#that the ranges can be read independently, e.g. by several processes.
+
+import os
+import struct
+
+LCM_SYNC_WORD = 0xEDA1DA01
+
+# sync word, event number, timestamp, channel length, data length
+event_header = struct.Struct(">IqqII")
+
+_sync_bytes = struct.pack(">I", LCM_SYNC_WORD)
+
+# longest channel name accepted when resynchronising, as in lcm's eventlog.c
+MAX_CHANNEL_LENGTH = 1000
+
+# number of consecutive event headers checked before accepting a sync word as
+# the start of an event, in case the sync word also appears in message data
+NUM_EVENTS_TO_VALIDATE = 4
+
+def is_event_start(f, offset, file_size):
+    """Checks whether a valid event header starts at offset.
+
+    The event and the NUM_EVENTS_TO_VALIDATE - 1 events following it must
+    have valid headers, increasing event numbers, and fit in the file.
+    """
+    prev_eventnum = None
+    for i in range(NUM_EVENTS_TO_VALIDATE):
+        if offset == file_size:
+            return True
+        f.seek(offset)
+        header = f.read(event_header.size)
+        if len(header) < event_header.size:
+            return False
+        sync, eventnum, timestamp, channellen, datalen = \
+                event_header.unpack(header)
+        if sync != LCM_SYNC_WORD or eventnum < 0 or \
+                channellen == 0 or channellen > MAX_CHANNEL_LENGTH:
+            return False
+        if prev_eventnum is not None and eventnum <= prev_eventnum:
+            return False
+        prev_eventnum = eventnum
+        offset += event_header.size + channellen + datalen
+        if offset > file_size:
+            return False
+    return True
+
+def find_event_start(f, offset, file_size, blocksize=65536):
+    """Returns the offset of the first event that starts at or after offset,
+    or file_size if there is none."""
+    while offset < file_size:
+        f.seek(offset)
+        block = f.read(blocksize + 3)
+        pos = block.find(_sync_bytes)
+        while pos >= 0:
+            if is_event_start(f, offset + pos, file_size):
+                return offset + pos
+            pos = block.find(_sync_bytes, pos + 1)
+        offset += blocksize
+    return file_size
+
+def read_event_timestamp(f, offset):
+    """Returns the timestamp of the event that starts at offset."""
+    f.seek(offset)
+    return event_header.unpack(f.read(event_header.size))[2]
+
+def find_time_offset(f, utime, file_size):
+    """Returns the offset of the first event with a timestamp of at least
+    utime, or file_size if there is none.
+
+    Uses a binary search over the file, so it assumes that timestamps
+    increase through the log, as they do in logs written by lcm-logger.
+    """
+    # find the lowest position whose next event is at or after utime
+    lo = 0
+    hi = file_size
+    while lo < hi:
+        mid = (lo + hi) // 2
+        start = find_event_start(f, mid, file_size)
+        if start == file_size or read_event_timestamp(f, start) >= utime:
+            hi = mid
+        else:
+            lo = start + 1
+    return find_event_start(f, lo, file_size)
+
+def split_log(fname, nranges, start=0, end=None):
+    """Splits the events that start between the byte offsets start and end of
+    the log file fname into at most nranges (start, end) byte ranges of
+    roughly equal size, each starting on an event boundary.  start must be
+    the offset of an event, and end defaults to the end of the file."""
+    file_size = os.path.getsize(fname)
+    if end is None:
+        end = file_size
+    f = open(fname, "rb")
+    starts = [ start ]
+    for i in range(1, nranges):
+        offset = find_event_start(f, max(starts[-1],
+            start + (end - start) * i // nranges), file_size)
+        if offset > starts[-1] and offset < end:
+            starts.append(offset)
+    f.close()
+    return zip(starts, starts[1:] + [ end ])
@@ -12,6 +12,8 @@ import types
 import numpy
 import re
 import getopt
+import multiprocessing
+import math
 
 # check which version for mio location
 if sys.version_info < (2, 6):
@@ -19,8 +21,16 @@ if sys.version_info < (2, 6):
 else:
     import scipy.io.matlab.mio
 
-from lcm import EventLog
+from mmap_log import MmapEventLog
 from scan_for_lcmtypes import *
+from stream_writer import NpyLogWriter, DEFAULT_CHUNK_SIZE
+from column_writer import ColumnLogWriter
+from ragged import ragged_from_rows, ragged_from_array, concatenate_ragged, \
+        lengths_to_offsets, pad_ragged
+from log_split import split_log, find_event_start, find_time_offset, \
+        read_event_timestamp
+from log_index import get_log_index, read_events
+from compiled_flatten import compile_flattener
 
 def usage():
     pname, sname = os.path.split(sys.argv[0])
@@ -34,13 +44,38 @@ def usage():
     -i --ignore=chan          Ignore channelsToProcess that match Python regex [chan]
                               ignores take precedence over includes!
     -o --outfile=ofname       output data to [ofname] instead of default [filename.mat or stdout]
-    -l --lcmtype_pkgs=pkgs    load python modules from comma seperated list of packages [pkgs] defaults to ["botlcm"]
+    -l --lcm_packages=pkgs    only search the comma seperated list of python packages [pkgs] for LCM types,
+                              defaults to searching all of sys.path
+    -S --stream               write each channel incrementally to [ofname without extension]/<channel>.npy
+                              instead of building a .mat in memory
+    -C --columns              write each field of each channel incrementally to its own typed column in
+                              [ofname without extension]/<channel>/<field>.npy, with variable length
+                              fields stored ragged, see column_writer.py.  Columns have the dtype of the
+                              field's LCM type, e.g. int8 or float32
+    -P --pad                  pad the messages of channels whose messages vary in length with zeros to the
+                              length of the longest one.  By default, such channels are stored ragged, as
+                              a struct of the concatenated messages in values and the offsets of the
+                              messages in offsets, or with --stream as <channel>.npy with the offsets in
+                              <channel>.offsets.npy
+    -k --chunk_size=rows      number of rows per channel to buffer in memory with --stream, or values per
+                              column with --columns, defaults to %d
+    -j --jobs=N               decode the log in N worker processes, defaults to 1
+    -x --index                only read the events of the selected channels, using the channel index in
+                              [filename].idx, which is created if it is missing or out of date
+    -b --begin=time           skip the events before [time], given in seconds from the start of the log,
+                              or as an absolute utime prefixed with @, e.g. @1300000000000000
+    -e --end=time             stop at [time], given like for --begin
+    -d --decimate=chan:N      only keep every Nth message on channels that match Python regex [chan]
+    -d --decimate=chan:RHz    only keep one message per 1/R seconds on channels that match [chan],
+                              can be given several times
     -v                        Verbose
 
-    """
+    """ % DEFAULT_CHUNK_SIZE
     sys.exit()
 
 flatteners = {}
+# fixed-size LCM types -> compiled flattener, or None if it can't be compiled
+compiled_flatteners = {}
 data = {}
 
 def make_simple_accessor(fieldname):
@@ -166,10 +201,85 @@ def deleteStatusMsg(statMsg):
         sys.stderr.write("\r")
     return ""
 
-longOpts = ["help", "print", "format", "separator", "channelsToProcess", "ignore", "outfile", "lcm_packages"]
+class Decimator:
+    """Downsamples channels, either keeping every Nth message on a channel,
+    or the first message in each 1/rate second period of the log
+    timestamps."""
+    def __init__(self):
+        # (channel regex, N, rate) of each --decimate option
+        self.rules = []
+        self._channel_rules = {}
+        self._last = {}
+
+    def add(self, spec):
+        regex, sep, value = spec.rpartition(":")
+        if not sep:
+            raise ValueError("bad decimation %s" % spec)
+        if value.lower().endswith("hz"):
+            rule = (re.compile(regex), None, float(value[:-2]))
+        else:
+            rule = (re.compile(regex), int(value), None)
+        self.rules.append(rule)
+
+    def _get_rule(self, channel):
+        try:
+            return self._channel_rules[channel]
+        except KeyError:
+            rule = None
+            for regex, count, rate in self.rules:
+                match = regex.match(channel)
+                if match and len(match.group()) == len(channel):
+                    rule = (count, rate)
+                    break
+            self._channel_rules[channel] = rule
+            return rule
+
+    def keep(self, channel, timestamp):
+        """Checks whether to keep the next message on channel."""
+        rule = self._get_rule(channel)
+        if rule is None:
+            return True
+        count, rate = rule
+        if count is not None:
+            n = self._last.get(channel, 0)
+            self._last[channel] = n + 1
+            return n % count == 0
+        period = math.floor(timestamp * (rate / 1e6))
+        if self._last.get(channel) == period:
+            return False
+        self._last[channel] = period
+        return True
+
+    def select(self, channel, timestamps):
+        """Returns the indices of the messages to keep out of those on
+        channel with the given timestamps, or None to keep them all."""
+        rule = self._get_rule(channel)
+        if rule is None:
+            return None
+        count, rate = rule
+        if count is not None:
+            return numpy.arange(0, len(timestamps), count)
+        periods = numpy.floor(timestamps * (rate / 1e6))
+        keep = numpy.ones(len(periods), dtype=bool)
+        keep[1:] = periods[1:] != periods[:-1]
+        return numpy.flatnonzero(keep)
+
+def parse_time(a):
+    """Parses a --begin or --end time into (seconds or utime, is utime)."""
+    if a.startswith("@"):
+        return int(a[1:]), True
+    return float(a), False
+
+def time_to_utime(t, logStartTime):
+    value, isUtime = t
+    if isUtime:
+        return value
+    return logStartTime + int(round(value * 1e6))
+
+longOpts = ["help", "print", "format", "separator", "channelsToProcess", "ignore", "outfile", "lcm_packages=", "stream", "chunk_size=", "jobs=", "index", "begin=", "end=", "decimate=", "columns", "pad"]
 
 try:
-    opts, args = getopt.gnu_getopt(sys.argv[1:], "hpvfs:c:i:o:l:", longOpts)
+    opts, args = getopt.gnu_getopt(sys.argv[1:], "hpvfSCPxs:c:i:o:l:k:j:b:e:d:", longOpts)
 except getopt.GetoptError, err:
     # print help information and exit:
     print str(err) # will print something like "option -a not recognized"
@@ -178,7 +288,7 @@ if len(args) != 1:
     usage()
 #default options
 fname = args[0]
-lcm_packages = [ "botlcm"]
+lcm_packages = None
 
 outDir, outFname = os.path.split(os.path.abspath(fname))
 outFname = outFname.replace(".", "_")
@@ -193,6 +303,15 @@ channelsToIgnore = ""
 checkIgnore = False
 channelsToProcess = ".*"
 separator = ' '
+streamOutput = False
+columnOutput = False
+padOutput = False
+chunkSize = DEFAULT_CHUNK_SIZE
+numJobs = 1
+useIndex = False
+beginTime = None
+endTime = None
+decimator = Decimator()
 for o, a in opts:
     if o == "-v":
         verbose = True
@@ -214,6 +333,24 @@ for o, a in opts:
         checkIgnore = True
     elif o in ("-l", "--lcm_packages="):
         lcm_packages = a.split(",")
+    elif o in ("-S", "--stream"):
+        streamOutput = True
+    elif o in ("-C", "--columns"):
+        columnOutput = True
+    elif o in ("-P", "--pad"):
+        padOutput = True
+    elif o in ("-k", "--chunk_size"):
+        chunkSize = int(a)
+    elif o in ("-j", "--jobs"):
+        numJobs = int(a)
+    elif o in ("-x", "--index"):
+        useIndex = True
+    elif o in ("-b", "--begin"):
+        beginTime = parse_time(a)
+    elif o in ("-e", "--end"):
+        endTime = parse_time(a)
+    elif o in ("-d", "--decimate"):
+        decimator.add(a)
     else:
         assert False, "unhandled option"
 
@@ -222,11 +359,11 @@ dirname = os.path.dirname(fullPathName)
 outBaseName = ".".join(os.path.basename(outFname).split(".")[0:-1])
 fullBaseName = dirname + "/" + outBaseName
 
-type_db = make_lcmtype_dictionary()
+type_db = LcmtypeResolver(lcm_packages)
 
 channelsToProcess = re.compile(channelsToProcess)
 channelsToIgnore = re.compile(channelsToIgnore)
-log = EventLog(fname, "r")
+log = MmapEventLog(fname)
 
 if printOutput:
     sys.stderr.write("opened % s, printing output to %s \n" % (fname, printFname))
@@ -234,27 +371,40 @@ if printOutput:
         printFile = sys.stdout
     else:
         printFile = open(printFname, "w")
+elif columnOutput:
+    sys.stderr.write("opened % s, writing columns to % s\n" % (fname, fullBaseName))
+    columnWriter = ColumnLogWriter(fullBaseName, chunkSize)
+elif streamOutput:
+    sys.stderr.write("opened % s, streaming output to % s\n" % (fname, fullBaseName))
+    streamWriter = NpyLogWriter(fullBaseName, chunkSize, padOutput)
 else:
     sys.stderr.write("opened % s, outputing to % s\n" % (fname, outFname))
 
-ignored_channels = []
-msgCount = 0
-statusMsg = ""
-startTime = 0
-
-for e in log:
-    if msgCount == 0: 
-        startTime = e.timestamp
-        
+def make_format_string(channel, lcmtype, msg):
+    typeStr, fieldCount = make_lcmtype_string(msg)
+    typeStr.append("%d- log_timestamp" % (fieldCount + 1))
+    return "\n#%s  %s :\n#[\n#%s\n#]\n" % (channel, lcmtype, "\n#".join(typeStr))
+
+def is_channel_ignored(channel):
+    """Checks the channel against the -c and -i regexes."""
+    if checkIgnore:
+        match = channelsToIgnore.match(channel)
+        if match and len(match.group()) == len(channel):
+            return True
+    return not channelsToProcess.match(channel)
+
+def get_event_lcmtype(e, ignored_channels):
+    """Returns the LCM type of the message in the log event e, or None if
+    the event's channel is ignored."""
+    global statusMsg
     if e.channel in ignored_channels:
-        continue
-    if ((checkIgnore and channelsToIgnore.match(e.channel) and len(channelsToIgnore.match(e.channel).group())==len(e.channel)) \
-         or (not channelsToProcess.match(e.channel))):
+        return None
+    if is_channel_ignored(e.channel):
         if verbose:
             statusMsg = deleteStatusMsg(statusMsg)
             sys.stderr.write("ignoring channel %s\n" % e.channel)
-        ignored_channels.append(e.channel)
-        continue
+        ignored_channels.add(e.channel)
+        return None
 
     packed_fingerprint = e.data[:8]
     lcmtype = type_db.get(packed_fingerprint, None)
@@ -262,37 +412,61 @@ for e in log:
         if verbose:
             statusMsg = deleteStatusMsg(statusMsg)
             sys.stderr.write("ignoring channel %s -not a known LCM type\n" % e.channel)
-        ignored_channels.append(e.channel)
-        continue
+        ignored_channels.add(e.channel)
+        return None
+    return lcmtype
+
+def decode_event(e, ignored_channels):
+    """Decodes the LCM message in the log event e, or returns None if the
+    event's channel is ignored or its message can't be decoded."""
+    global statusMsg
+    lcmtype = get_event_lcmtype(e, ignored_channels)
+    if not lcmtype:
+        return None
     try:
-        msg = lcmtype.decode(e.data)
+        return lcmtype.decode(e.data)
     except:
         statusMsg = deleteStatusMsg(statusMsg)
         sys.stderr.write("error: couldn't decode msg on channel %s\n" % e.channel)
-        continue
-    
-    msgCount = msgCount + 1
-    if (msgCount % 5000) == 0:
+        return None
+
+def flatten_event(e, flatteners, ignored_channels, formats=None):
+    """Decodes and flattens the LCM message in the log event e.
+
+    Returns the flattened message, without the log timestamp, or None if
+    the event's channel is ignored or its message can't be decoded.  The
+    first time a channel is seen, its flattener is added to flatteners and,
+    if formats is not None, a description of its data format is appended
+    to formats as a (channel, format) tuple.
+    """
+    global statusMsg
+    lcmtype = get_event_lcmtype(e, ignored_channels)
+    if not lcmtype:
+        return None
+
+    compiled = compiled_flatteners.get(lcmtype)
+    if compiled is not None and e.channel in flatteners and \
+            len(e.data) == compiled.size:
+        return compiled(e.data)
+
+    try:
+        msg = lcmtype.decode(e.data)
+    except:
         statusMsg = deleteStatusMsg(statusMsg)
-        statusMsg = "read % d messages, % d %% done" % (msgCount, log.tell() / float(log.size())*100)
-        sys.stderr.write(statusMsg)
-        sys.stderr.flush()
-    
+        sys.stderr.write("error: couldn't decode msg on channel %s\n" % e.channel)
+        return None
+
     if e.channel in flatteners:
         flattener = flatteners[e.channel]
     else:
         flattener = make_flattener(msg)
         flatteners[e.channel] = flattener
-        data[e.channel] = []
-        if printFormat:
-            statusMsg = deleteStatusMsg(statusMsg)
-            typeStr, fieldCount = make_lcmtype_string(msg)
-            typeStr.append("%d- log_timestamp" % (fieldCount + 1))
-            
-            typeStr = "\n#%s  %s :\n#[\n#%s\n#]\n" % (e.channel, lcmtype, "\n#".join(typeStr))
-            sys.stderr.write(typeStr)
-                
-
+        if formats is not None:
+            formats.append((e.channel, make_format_string(e.channel, lcmtype, msg)))
+        # compiled rows hold python numbers where the generic flattener
+        # returns numpy scalars for arrays, which --print formats differently
+        if lcmtype not in compiled_flatteners and not printOutput:
+            compiled_flatteners[lcmtype] = compile_flattener(lcmtype, e.data, msg, flattener)
 
     a = flattener(msg)
     #in case the initial flattener didn't work for whatever reason :-/
@@ -305,25 +479,274 @@ for e in log:
         flattener = make_flattener(msg)
         flatteners[e.channel] = flattener
         a = flattener(msg)
+    return a
+
+def rows_to_array(rows):
+    """Stacks flattened rows into a 2D array if they all have the same
+    length, or else returns them ragged as (values, lengths).  Also returns
+    the shortest and longest row lengths."""
+    lengths = map(len, rows)
+    minLen = min(lengths)
+    maxLen = max(lengths)
+    if minLen == maxLen:
+        return numpy.array(rows, dtype=float), minLen, maxLen
+    return ragged_from_rows(rows), minLen, maxLen
+
+def make_ragged_struct(values, lengths):
+    return { "values" : values, "offsets" : lengths_to_offsets(lengths) }
+
+def events_in_range(rangeLog, start, end):
+    rangeLog.seek(start)
+    return rangeLog.events(end)
+
+def flatten_range(job):
+    """Flattens the events that start within a byte range of the log, or at
+    a list of offsets if the log index is used.
+
+    Runs in a worker process.  Returns the number of messages, a list of
+    (channel, rows, shortest row length, longest row length) in order of
+    first appearance, and the (channel, data format) of those channels.
+    """
+    rangeLog = MmapEventLog(fname)
+    if useIndex:
+        events = read_events(rangeLog, job)
+    else:
+        start, end = job
+        events = events_in_range(rangeLog, start, end)
+    rangeFlatteners = {}
+    rangeIgnored = set()
+    formats = None
+    if printFormat:
+        formats = []
+    rows = {}
+    channels = []
+    count = 0
+    for e in events:
+        a = flatten_event(e, rangeFlatteners, rangeIgnored, formats)
+        if a is None:
+            continue
+        count = count + 1
+        a.append((e.timestamp - startTime) / 1e6)
+        if e.channel not in rows:
+            rows[e.channel] = []
+            channels.append(e.channel)
+        rows[e.channel].append(a)
+    rangeLog.close()
+    result = []
+    for chan in channels:
+        arr, minLen, maxLen = rows_to_array(rows.pop(chan))
+        result.append((chan, arr, minLen, maxLen))
+    return count, result, formats
+
+ignored_channels = set()
+msgCount = 0
+statusMsg = ""
+startTime = 0
+formats = None
+if printFormat:
+    formats = []
+decodeInParallel = False
+
+if numJobs > 1 and printOutput:
+    sys.stderr.write("--print is not supported with --jobs, decoding sequentially\n")
+    numJobs = 1
+columnOutput = columnOutput and not printOutput
+if numJobs > 1 and columnOutput:
+    sys.stderr.write("--columns is not supported with --jobs, decoding sequentially\n")
+    numJobs = 1
+
+# with the index, the events to decimate are picked up front
+decimateEvents = decimator.rules and not useIndex
+if numJobs > 1 and decimateEvents:
+    sys.stderr.write("--decimate is only supported with --jobs if --index is used, decoding sequentially\n")
+    numJobs = 1
+
+# find the events in the time range by their timestamps
+beginUtime = None
+endUtime = None
+beginOffset = 0
+endOffset = log.size()
+if beginTime is not None or endTime is not None:
+    logFile = open(fname, "rb")
+    firstOffset = find_event_start(logFile, 0, log.size())
+    if firstOffset < log.size():
+        logStartTime = read_event_timestamp(logFile, firstOffset)
+        if beginTime is not None:
+            beginUtime = time_to_utime(beginTime, logStartTime)
+        if endTime is not None:
+            endUtime = time_to_utime(endTime, logStartTime)
+        if not useIndex:
+            if beginUtime is not None:
+                beginOffset = find_time_offset(logFile, beginUtime, log.size())
+            if endUtime is not None:
+                endOffset = find_time_offset(logFile, endUtime, log.size())
+    logFile.close()
+
+def indexed_events(log, offsets, channel_ids, channels):
+    """Reads the events at offsets, skipping those on channels that have
+    been ignored since."""
+    for offset, channel_id in zip(offsets, channel_ids):
+        if channels[channel_id] in ignored_channels:
+            continue
+        log.seek(int(offset))
+        yield log.read_next_event()
+
+if useIndex:
+    # pick the channels once from the index, and only read their events
+    logIndex = get_log_index(fname)
+    selectedChannels = []
+    for chan in sorted(logIndex.channels):
+        if is_channel_ignored(chan):
+            if verbose:
+                sys.stderr.write("ignoring channel %s\n" % chan)
+            ignored_channels.add(chan)
+        else:
+            selectedChannels.append(chan)
+    decimate = None
+    if decimator.rules:
+        decimate = decimator.select
+    selectedOffsets, selectedChannelIds = logIndex.select(selectedChannels,
+            beginUtime, endUtime, decimate)
+    events = indexed_events(log, selectedOffsets, selectedChannelIds,
+            selectedChannels)
+elif beginTime is not None or endTime is not None:
+    events = events_in_range(log, beginOffset, endOffset)
+else:
+    events = log
+
+for e in events:
+    if decimateEvents and not decimator.keep(e.channel, e.timestamp):
+        continue
+    if columnOutput:
+        a = decode_event(e, ignored_channels)
+    else:
+        a = flatten_event(e, flatteners, ignored_channels, formats)
+    if a is None:
+        continue
+    if msgCount == 0:
+        startTime = e.timestamp
+        if numJobs > 1:
+            # the log timestamps are relative to the first message, which
+            # the workers need to know up front
+            decodeInParallel = True
+            break
+
+    msgCount = msgCount + 1
+    if (msgCount % 5000) == 0:
+        statusMsg = deleteStatusMsg(statusMsg)
+        statusMsg = "read % d messages, % d %% done" % (msgCount, log.tell() / float(log.size())*100)
+        sys.stderr.write(statusMsg)
+        sys.stderr.flush()
+
+    if formats:
+        statusMsg = deleteStatusMsg(statusMsg)
+        sys.stderr.write(formats.pop()[1])
+
+    if columnOutput:
+        if not columnWriter.append(e.channel, a, e.timestamp, e.data):
+            statusMsg = deleteStatusMsg(statusMsg)
+            sys.stderr.write("ignoring channel %s -LCM type changed to %s\n" % (e.channel, a.__class__.__name__))
+            ignored_channels.add(e.channel)
+        continue
 
     a.append((e.timestamp - startTime) / 1e6)
     if printOutput:
         printFile.write("%s%s%s\n" % (e.channel, separator, separator.join([str(k) for k in a])))
+    elif streamOutput:
+        streamWriter.append(e.channel, a)
     else:
-        data[e.channel].append(a)
-        
-       
-    
+        data.setdefault(e.channel, []).append(a)
+
+if decodeInParallel:
+    # decode the whole log in worker processes, and merge their results in
+    # log order
+    if useIndex:
+        ranges = numpy.array_split(selectedOffsets, numJobs * 4)
+    else:
+        ranges = split_log(fname, numJobs * 4, beginOffset, endOffset)
+    pool = multiprocessing.Pool(numJobs)
+    rangesDone = 0
+    rowLengths = {}
+    formatsPrinted = set()
+    for count, result, rangeFormats in pool.imap(flatten_range, ranges):
+        for chan, typeStr in rangeFormats or []:
+            if chan not in formatsPrinted:
+                formatsPrinted.add(chan)
+                statusMsg = deleteStatusMsg(statusMsg)
+                sys.stderr.write(typeStr)
+        for chan, arr, minLen, maxLen in result:
+            if streamOutput:
+                if minLen == maxLen:
+                    streamWriter.append_rows(chan, arr)
+                else:
+                    streamWriter.append_ragged(chan, *arr)
+            else:
+                data.setdefault(chan, []).append(arr)
+            prevMin, prevMax = rowLengths.get(chan, (minLen, maxLen))
+            rowLengths[chan] = (min(prevMin, minLen), max(prevMax, maxLen))
+        msgCount = msgCount + count
+        rangesDone = rangesDone + 1
+        statusMsg = deleteStatusMsg(statusMsg)
+        statusMsg = "read % d messages, % d %% done" % (msgCount, rangesDone * 100 / len(ranges))
+        sys.stderr.write(statusMsg)
+        sys.stderr.flush()
+    pool.close()
+    pool.join()
 
 deleteStatusMsg(statusMsg)
-if not printOutput:
-    #need to pad variable length messages with zeros...
+if columnOutput:
+    written = columnWriter.close()
+    for chan in sorted(written):
+        columnDir, nrows = written[chan]
+        if verbose:
+            sys.stderr.write("wrote %d rows of %s to %s\n" % (nrows, chan, columnDir))
+    sys.stderr.write("wrote all %d messages to % s\n" % (msgCount, fullBaseName))
+elif streamOutput and not printOutput:
+    written = streamWriter.close()
+    for chan in sorted(written):
+        npyFname, shape = written[chan]
+        if verbose and shape[1] is None:
+            sys.stderr.write("wrote %d rows of varying length of %s to %s\n" % (shape[0], chan, npyFname))
+        elif verbose:
+            sys.stderr.write("wrote %d rows x %d columns of %s to %s\n" % (shape[0], shape[1], chan, npyFname))
+    sys.stderr.write("streamed all %d messages to % s\n" % (msgCount, fullBaseName))
+elif not printOutput:
+    #need to pad variable length messages with zeros, or store them ragged...
     for chan in data:
-        lengths = map(len, data[chan])
-        maxLen = max(lengths)
-        minLen = min(lengths)
-        if maxLen != minLen:
+        if decodeInParallel:
+            minLen, maxLen = rowLengths[chan]
+        else:
+            lengths = map(len, data[chan])
+            maxLen = max(lengths)
+            minLen = min(lengths)
+        if maxLen != minLen and padOutput:
             sys.stderr.write("padding channel %s with zeros, messages ranged from %d to %d \n" % (chan, minLen, maxLen))
+        elif maxLen != minLen:
+            sys.stderr.write("storing channel %s ragged, messages ranged from %d to %d \n" % (chan, minLen, maxLen))
+            if decodeInParallel:
+                # the arrays of the workers whose messages all had the same
+                # length are 2D
+                pieces = data[chan]
+                for i in range(len(pieces)):
+                    if type(pieces[i]) is not tuple:
+                        pieces[i] = ragged_from_array(pieces[i])
+                data[chan] = make_ragged_struct(*concatenate_ragged(pieces))
+            else:
+                data[chan] = make_ragged_struct(*ragged_from_rows(data[chan]))
+            continue
+        if decodeInParallel:
+            # stack the arrays decoded by each worker
+            arrs = data[chan]
+            for i in range(len(arrs)):
+                if type(arrs[i]) is tuple:
+                    values, lengths = arrs[i]
+                    arrs[i] = pad_ragged(values, lengths, int(lengths.max()))
+            data[chan] = numpy.zeros((sum([ len(arr) for arr in arrs ]), maxLen))
+            row = 0
+            for arr in arrs:
+                data[chan][row:row + len(arr), :arr.shape[1]] = arr
+                row = row + len(arr)
+        elif maxLen != minLen:
             count = 0
             for i in data[chan]:
                 pad = numpy.zeros(maxLen - lengths[count])
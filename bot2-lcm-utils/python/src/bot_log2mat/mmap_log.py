@@ -0,0 +1,132 @@
+#!/usr/bin/python
+#
+#Reads LCM log files through mmap, without copying the messages.  The events
+#read hold a read-only buffer that refers to the message data in the mapped
+#file, which the decode methods of LCM types, struct.unpack_from and
+#numpy.frombuffer all accept in place of a string.
+
+import os
+import mmap
+import struct
+
+from log_split import LCM_SYNC_WORD, MAX_CHANNEL_LENGTH, event_header
+
+_sync_bytes = struct.pack(">I", LCM_SYNC_WORD)
+
+class EventView(object):
+    """An event read by MmapEventLog.
+
+    data is a buffer that refers to the message in the mapped log, and can
+    only be used until the log is closed.  offset is where the event starts
+    in the log.
+    """
+    __slots__ = [ "offset", "eventnum", "timestamp", "channel", "data" ]
+
+    def __init__(self, offset, eventnum, timestamp, channel, data):
+        self.offset = offset
+        self.eventnum = eventnum
+        self.timestamp = timestamp
+        self.channel = channel
+        self.data = data
+
+class MmapEventLog:
+    """Reads an LCM log file, with the same interface as lcm.EventLog in
+    read mode, but returns EventView events whose data isn't copied.
+
+    Like lcm.EventLog, it skips to the next sync word if an event header is
+    corrupt, and stops at an event that is cut off by the end of the file.
+    The whole file is mapped at once, so logs larger than the address space
+    can't be read on 32-bit systems.
+    """
+    def __init__(self, fname, mode="r"):
+        if mode != "r":
+            raise ValueError("MmapEventLog can only read logs")
+        self._file = open(fname, "rb")
+        self._size = os.fstat(self._file.fileno()).st_size
+        self._map = None
+        if self._size:
+            self._map = mmap.mmap(self._file.fileno(), 0,
+                    access=mmap.ACCESS_READ)
+        self._offset = 0
+
+    def size(self):
+        return self._size
+
+    def tell(self):
+        return self._offset
+
+    def seek(self, offset):
+        self._offset = offset
+
+    def read_next_event(self):
+        """Returns the next EventView, or None at the end of the log."""
+        mm = self._map
+        offset = self._offset
+        hsize = event_header.size
+        while offset + hsize <= self._size:
+            sync, eventnum, timestamp, channellen, datalen = \
+                    event_header.unpack_from(mm, offset)
+            if sync != LCM_SYNC_WORD or channellen > MAX_CHANNEL_LENGTH:
+                offset = mm.find(_sync_bytes, offset + 1)
+                if offset < 0:
+                    break
+                continue
+            data_start = offset + hsize + channellen
+            end = data_start + datalen
+            if end > self._size:
+                break
+            self._offset = end
+            return EventView(offset, eventnum, timestamp,
+                    mm[offset + hsize:data_start],
+                    buffer(mm, data_start, datalen))
+        self._offset = self._size
+        return None
+
+    def read_event_at(self, offset):
+        """Returns the EventView that starts at offset."""
+        self._offset = offset
+        return self.read_next_event()
+
+    def events(self, end=None):
+        """Yields the events from the current position up to the end of the
+        log, or to the first event that starts at or after the offset end.
+        """
+        if end is None or end > self._size:
+            end = self._size
+        mm = self._map
+        hsize = event_header.size
+        unpack_from = event_header.unpack_from
+        offset = self._offset
+        # events with valid headers are read here, and read_next_event
+        # takes care of the rest
+        while offset < end:
+            if offset + hsize > self._size:
+                break
+            sync, eventnum, timestamp, channellen, datalen = \
+                    unpack_from(mm, offset)
+            data_start = offset + hsize + channellen
+            next_offset = data_start + datalen
+            if sync != LCM_SYNC_WORD or channellen > MAX_CHANNEL_LENGTH or \
+                    next_offset > self._size:
+                e = self.read_next_event()
+                if e is None:
+                    return
+                offset = self._offset
+                if e.offset >= end:
+                    return
+                yield e
+                continue
+            self._offset = next_offset
+            yield EventView(offset, eventnum, timestamp,
+                    mm[offset + hsize:data_start],
+                    buffer(mm, data_start, datalen))
+            offset = next_offset
+
+    def __iter__(self):
+        return self.events()
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
@@ -0,0 +1,43 @@
+#!/usr/bin/python
+#
+#Helpers for storing flattened rows of different lengths "ragged": the rows are
+#concatenated into a single array of values, and row i is
+#values[offsets[i]:offsets[i + 1]], rather than padding every row with zeros
+#to the length of the longest one.
+
+import itertools
+import numpy
+
+def ragged_from_rows(rows):
+    """Concatenates a list of rows into an array of doubles, and returns it
+    with the lengths of the rows."""
+    lengths = numpy.fromiter(itertools.imap(len, rows), numpy.int64, len(rows))
+    values = numpy.fromiter(itertools.chain.from_iterable(rows),
+            numpy.float64, int(lengths.sum()))
+    return values, lengths
+
+def ragged_from_array(arr):
+    """Returns the rows of a 2D array as (values, lengths)."""
+    nrows, ncols = arr.shape
+    return arr.ravel(), numpy.repeat(numpy.int64(ncols), nrows)
+
+def concatenate_ragged(pieces):
+    """Concatenates a list of (values, lengths) into a single one."""
+    values = numpy.concatenate([ piece[0] for piece in pieces ])
+    lengths = numpy.concatenate([ piece[1] for piece in pieces ])
+    return values, lengths
+
+def lengths_to_offsets(lengths, start=0):
+    """Returns the len(lengths) + 1 offsets of the rows, starting at start."""
+    offsets = numpy.empty(len(lengths) + 1, dtype=numpy.int64)
+    offsets[0] = start
+    numpy.cumsum(lengths, out=offsets[1:])
+    offsets[1:] += start
+    return offsets
+
+def pad_ragged(values, lengths, ncols):
+    """Returns the rows as a 2D array of ncols columns, with the rows shorter
+    than ncols padded with zeros."""
+    arr = numpy.zeros((len(lengths), ncols))
+    arr[numpy.arange(ncols) < lengths[:, numpy.newaxis]] = values
+    return arr
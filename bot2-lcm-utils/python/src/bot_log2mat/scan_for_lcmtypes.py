@@ -3,17 +3,166 @@ import re
 import os
 import sys
 import pyclbr
+import cPickle
+import struct
 
-def find_lcmtypes():
+DEFAULT_CACHE_FNAME = os.path.join(os.path.expanduser("~"), ".cache",
+        "bot_log2mat", "lcmtypes.pickle")
+
+class LcmtypeCache:
+    """On-disk cache of the results of scanning python files for LCM types.
+
+    Maps the path of each scanned file to its (mtime, size), whether it is
+    an LCM type module, and if so what parse_lcmtype_source extracted from
+    it and the type's packed fingerprint once it has been imported.  An
+    entry is only used while the mtime and size of the file are unchanged.
+    """
+    VERSION = 2
+
+    def __init__(self, fname=DEFAULT_CACHE_FNAME):
+        self.fname = fname
+        self.entries = {}
+        self.seen = set()
+        self.modified = False
+        try:
+            f = open(fname, "rb")
+            try:
+                version, entries = cPickle.load(f)
+                if version == LcmtypeCache.VERSION:
+                    self.entries = entries
+            finally:
+                f.close()
+        except (IOError, EOFError, ValueError, TypeError,
+                cPickle.UnpicklingError):
+            pass
+
+    def lookup(self, path, st):
+        """Returns the cached (is_lcmtype, schema, fingerprint) of the file at
+        path, or None if it is not in the cache or has changed since."""
+        self.seen.add(path)
+        entry = self.entries.get(path)
+        if entry is None or entry[0] != (st.st_mtime, st.st_size):
+            return None
+        return entry[1:]
+
+    def store(self, path, st, is_lcmtype, schema):
+        self.entries[path] = ((st.st_mtime, st.st_size), is_lcmtype, schema,
+                None)
+        self.modified = True
+
+    def get_fingerprint(self, path):
+        entry = self.entries.get(path)
+        return entry and entry[3]
+
+    def set_fingerprint(self, path, fingerprint):
+        entry = self.entries.get(path)
+        if entry is not None and entry[3] != fingerprint:
+            self.entries[path] = entry[:3] + (fingerprint,)
+            self.modified = True
+
+    def prune(self):
+        """Forgets the files that have not been looked up, e.g. because they
+        were deleted."""
+        for path in self.entries.keys():
+            if path not in self.seen:
+                del self.entries[path]
+                self.modified = True
+
+    def save(self):
+        if not self.modified:
+            return
+        try:
+            dirname = os.path.dirname(self.fname)
+            if dirname and not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            tmp_fname = "%s.%d" % (self.fname, os.getpid())
+            f = open(tmp_fname, "wb")
+            cPickle.dump((LcmtypeCache.VERSION, self.entries), f,
+                    cPickle.HIGHEST_PROTOCOL)
+            f.close()
+            os.rename(tmp_fname, self.fname)
+            self.modified = False
+        except (IOError, OSError):
+            pass
+
+def _dirs_to_check(packages):
+    """Returns the (sys.path entry, directory) pairs to scan."""
+    if packages is None:
+        return [ (dir_name, dir_name) for dir_name in sys.path ]
+    result = []
+    for dir_name in sys.path:
+        for package in packages:
+            pkg_dir = os.path.join(dir_name, *package.split("."))
+            if os.path.exists(os.path.join(pkg_dir, "__init__.py")):
+                result.append((dir_name, pkg_dir))
+    return result
+
+_hash_regex = re.compile(r"tmphash = \((0x[0-9a-fA-F]+)L?((?:\s*\+\s*[\w.]+\._get_hash_recursive\(newparents\))*)\s*\)")
+_nested_hash_regex = re.compile(r"([\w.]+)\._get_hash_recursive\(newparents\)")
+_import_regex = re.compile(r"^(?:from\s+([\w.]+)\s+)?import\s+([\w.]+)(?:\s+as\s+(\w+))?\s*$", re.M)
+
+def parse_lcmtype_source(contents):
+    """Extracts what is needed to compute an LCM type's fingerprint from the
+    source generated by lcm-gen, without executing it.
+
+    Returns a tuple of the type's base hash, the references to the LCM types
+    it contains as they appear in _get_hash_recursive, and the
+    (from, module, alias) import statements that those references rely on.
+    Returns None if the source doesn't look like generated code.
+    """
+    match = _hash_regex.search(contents)
+    if match is None:
+        return None
+    base_hash = int(match.group(1), 16)
+    nested = _nested_hash_regex.findall(match.group(2))
+    imports = _import_regex.findall(contents)
+    return base_hash, nested, imports
+
+def _scan_file(full_fname, modname, mod_basename):
+    """Checks whether a file is an LCM type module, and returns
+    (is_lcmtype, schema), where schema is the result of parse_lcmtype_source.
+    """
+    # quick regex test -- check if the file contains the
+    # word "_get_packed_fingerprint"
+    try:
+        contents = open(full_fname, "r").read()
+    except IOError:
+        return False, None
+    if not _fingerprint_regex.search(contents):
+        return False, None
+
+    # More thorough check to see if the file corresponds to a
+    # LCM type module genereated by lcm-gen.  Parse the
+    # file using pyclbr, and check if it contains a class
+    # with the right name and methods
+    try:
+        klass = pyclbr.readmodule(modname)[mod_basename]
+        if "decode" in klass.methods and \
+               "_get_packed_fingerprint" in klass.methods:
+            return True, parse_lcmtype_source(contents)
+    except ImportError:
+        pass
+    except KeyError:
+        pass
+    return False, None
+
+_fingerprint_regex = re.compile("_get_packed_fingerprint")
+
+def find_lcmtype_files(packages=None, cache=None):
+    """Searches sys.path for modules corresponding to LCM types.
+
+    If packages is a list of python package names, only those packages are
+    searched.  If cache is an LcmtypeCache, files that have not changed
+    since they were last scanned are not read again.  Returns a list of
+    (module name, file name, schema) tuples, where schema is the result of
+    parse_lcmtype_source for the file.
+    """
     alpha_chars = set("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ")
     valid_chars = set("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_")
     lcmtypes = []
-    regex = re.compile("_get_packed_fingerprint")
-    
-    dirs_to_check = sys.path
 
-    for dir_name in dirs_to_check:
-        for root, dirs, files in os.walk(dir_name):
+    for dir_name, start_dir in _dirs_to_check(packages):
+        for root, dirs, files in os.walk(start_dir):
             subdirs = root[len(dir_name):].split(os.sep)
             subdirs = [ s for s in subdirs if s ]
 
@@ -34,34 +183,29 @@ def find_lcmtypes():
                 if not valid_modname:
                     continue
 
-                # quick regex test -- check if the file contains the 
-                # word "_get_packed_fingerprint"
                 full_fname = os.path.join(root, fname)
-		try: 
-               	    contents = open(full_fname, "r").read()
-		except IOError:
-                    continue
-                if not regex.search(contents):
-                    continue
-                
-                # More thorough check to see if the file corresponds to a
-                # LCM type module genereated by lcm-gen.  Parse the 
-                # file using pyclbr, and check if it contains a class
-                # with the right name and methods
                 if python_package:
                     modname = "%s.%s" % (python_package, mod_basename)
                 else:
                     modname = mod_basename
-                try:
-                    klass = pyclbr.readmodule(modname)[mod_basename]
-                    if "decode" in klass.methods and \
-                       "_get_packed_fingerprint" in klass.methods:
 
-                        lcmtypes.append(modname)
-                except ImportError:
-                    continue
-                except KeyError:
-                    continue
+                if cache is not None:
+                    try:
+                        st = os.stat(full_fname)
+                    except OSError:
+                        continue
+                    cached = cache.lookup(full_fname, st)
+                    if cached is None:
+                        is_lcmtype, schema = _scan_file(full_fname, modname,
+                                mod_basename)
+                        cache.store(full_fname, st, is_lcmtype, schema)
+                    else:
+                        is_lcmtype, schema = cached[:2]
+                else:
+                    is_lcmtype, schema = _scan_file(full_fname, modname,
+                            mod_basename)
+                if is_lcmtype:
+                    lcmtypes.append((modname, full_fname, schema))
 
             # only recurse into subdirectories that correspond to python 
             # packages (i.e., they contain a file named "__init__.py")
@@ -69,9 +213,22 @@ def find_lcmtypes():
                     if os.path.exists(os.path.join(root, subdir_name, "__init__.py")) ]
             del dirs[:]
             dirs.extend(subdirs_to_traverse)
+    if cache is not None and packages is None:
+        cache.prune()
     return lcmtypes
 
-def make_lcmtype_dictionary():
+def find_lcmtypes(packages=None, cache=None):
+    """Returns the names of the modules corresponding to LCM types found by
+    find_lcmtype_files."""
+    return [ lcmtype[0] for lcmtype in find_lcmtype_files(packages, cache) ]
+
+def _import_lcmtype(lcmtype_name):
+    __import__(lcmtype_name)
+    mod = sys.modules[lcmtype_name]
+    type_basename = lcmtype_name.split(".")[-1]
+    return getattr(mod, type_basename)
+
+def make_lcmtype_dictionary(packages=None, cache_fname=DEFAULT_CACHE_FNAME):
     """Create a dictionary of LCM types keyed by fingerprint.
 
     Searches the specified python package directories for modules 
@@ -82,24 +239,181 @@ def make_lcmtype_dictionary():
     The primary use for this dictionary is to automatically identify and 
     decode an LCM message.
 
+    If packages is a list of python package names, only those packages are
+    searched.  The results of the search are cached in cache_fname, so that
+    only new or modified files need to be scanned next time.  Pass None as
+    cache_fname to disable the cache.
     """
-    lcmtypes = find_lcmtypes()
+    cache = None
+    if cache_fname is not None:
+        cache = LcmtypeCache(cache_fname)
+    lcmtypes = find_lcmtype_files(packages, cache)
 
     result = {}
 
-    for lcmtype_name in lcmtypes:
+    for lcmtype_name, fname, schema in lcmtypes:
         try:
-            __import__(lcmtype_name)
-            mod = sys.modules[lcmtype_name]
-            type_basename = lcmtype_name.split(".")[-1]
-            klass = getattr(mod, type_basename)
+            klass = _import_lcmtype(lcmtype_name)
             fingerprint = klass._get_packed_fingerprint()
             result[fingerprint] = klass
+            if cache is not None:
+                cache.set_fingerprint(fname, fingerprint)
             #print "importing %s" % lcmtype_name
         except:
             print "Error importing %s" % lcmtype_name
+    if cache is not None:
+        cache.save()
     return result
  
+_HASH_MASK = 0xffffffffffffffff
+
+def _resolve_type_reference(modname, ref, imports, schemas):
+    """Finds the module of the LCM type that ref refers to in the generated
+    code of modname."""
+    parts = ref.split(".")
+    if len(parts) == 1:
+        return modname
+    aliases = {}
+    for from_name, name, alias in imports:
+        if from_name:
+            aliases[alias or name] = "%s.%s" % (from_name, name)
+        elif alias:
+            aliases[alias] = name
+    first = aliases.get(parts[0], parts[0])
+    target = ".".join([ first ] + parts[1:-1])
+    package = modname.rpartition(".")[0]
+    # python 2 tries implicit relative imports first
+    for candidate in [ package and "%s.%s" % (package, target), target ]:
+        if candidate in schemas:
+            return candidate
+    return None
+
+def compute_fingerprints(schemas):
+    """Computes the packed fingerprints of LCM types from their schemas.
+
+    schemas maps module names to the result of parse_lcmtype_source.
+    Returns a dictionary mapping module names to packed fingerprints, for
+    the types whose fingerprint, and those of all the types they contain,
+    could be computed.
+    """
+    def hash_recursive(modname, parents):
+        if modname in parents:
+            return 0
+        schema = schemas.get(modname)
+        if schema is None:
+            raise KeyError(modname)
+        base_hash, nested, imports = schema
+        newparents = parents + [ modname ]
+        tmphash = base_hash
+        for ref in nested:
+            nested_modname = _resolve_type_reference(modname, ref, imports,
+                    schemas)
+            tmphash += hash_recursive(nested_modname, newparents)
+        tmphash &= _HASH_MASK
+        return (((tmphash << 1) & _HASH_MASK) + (tmphash >> 63)) & _HASH_MASK
+
+    result = {}
+    for modname in schemas:
+        try:
+            result[modname] = struct.pack(">Q", hash_recursive(modname, []))
+        except KeyError:
+            pass
+    return result
+
+class LcmtypeResolver:
+    """Maps packed fingerprints to LCM type classes, like the dictionary
+    returned by make_lcmtype_dictionary, but only imports the module of an
+    LCM type the first time its fingerprint is looked up.
+
+    The fingerprints of the types are computed from their generated source
+    where possible, and cached along with the rest of the scan results in
+    cache_fname.  Types whose source can't be parsed are imported up front
+    the first time they are seen, as make_lcmtype_dictionary does.
+    """
+    def __init__(self, packages=None, cache_fname=DEFAULT_CACHE_FNAME):
+        self._cache = None
+        if cache_fname is not None:
+            self._cache = LcmtypeCache(cache_fname)
+        lcmtypes = find_lcmtype_files(packages, self._cache)
+
+        schemas = {}
+        for lcmtype_name, fname, schema in lcmtypes:
+            if schema is not None:
+                schemas[lcmtype_name] = schema
+        fingerprints = compute_fingerprints(schemas)
+
+        # packed fingerprint -> (module name, file name)
+        self._index = {}
+        self._types = {}
+        for lcmtype_name, fname, schema in lcmtypes:
+            fingerprint = fingerprints.get(lcmtype_name)
+            if fingerprint is None and self._cache is not None:
+                fingerprint = self._cache.get_fingerprint(fname)
+            if fingerprint is None:
+                klass = self._import(lcmtype_name, fname)
+                if klass is None:
+                    continue
+                fingerprint = klass._get_packed_fingerprint()
+                self._types[fingerprint] = klass
+            self._index.setdefault(fingerprint, (lcmtype_name, fname))
+        self._save_cache()
+
+    def _save_cache(self):
+        if self._cache is not None:
+            self._cache.save()
+
+    def _import(self, lcmtype_name, fname):
+        try:
+            klass = _import_lcmtype(lcmtype_name)
+            if self._cache is not None:
+                self._cache.set_fingerprint(fname,
+                        klass._get_packed_fingerprint())
+            return klass
+        except:
+            print "Error importing %s" % lcmtype_name
+            return None
+
+    def _import_all(self):
+        for lcmtype_name, fname in self._index.values():
+            klass = self._import(lcmtype_name, fname)
+            if klass is not None:
+                self._types[klass._get_packed_fingerprint()] = klass
+
+    def get(self, fingerprint, default=None):
+        """Returns the LCM type class with the given packed fingerprint,
+        importing it if needed, or default if there is no such type."""
+        try:
+            klass = self._types[fingerprint]
+        except KeyError:
+            klass = None
+            entry = self._index.get(fingerprint)
+            if entry is not None:
+                klass = self._import(*entry)
+                if klass is not None and \
+                        klass._get_packed_fingerprint() != fingerprint:
+                    # the fingerprint computed from the source was wrong, so
+                    # fall back to importing every type
+                    self._import_all()
+                    klass = self._types.get(fingerprint)
+                self._save_cache()
+            self._types[fingerprint] = klass
+        if klass is None:
+            return default
+        return klass
+
+    def __getitem__(self, fingerprint):
+        klass = self.get(fingerprint)
+        if klass is None:
+            raise KeyError(fingerprint)
+        return klass
+
+    def __contains__(self, fingerprint):
+        return self.get(fingerprint) is not None
+
+    def fingerprints(self):
+        """Returns the packed fingerprints of all the known LCM types."""
+        return self._index.keys()
+
 if __name__ == "__main__":
     import binascii
     print("Searching for LCM types...")
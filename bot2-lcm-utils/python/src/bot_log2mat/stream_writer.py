@@ -0,0 +1,270 @@
+#!/usr/bin/python
+#
+#Incrementally writes the flattened rows of each channel to its own .npy file,
+#so that converting a log only needs to hold a bounded number of rows per
+#channel in memory.
+
+import os
+import re
+import struct
+import numpy
+
+from ragged import ragged_from_rows, ragged_from_array, lengths_to_offsets, \
+        pad_ragged
+
+# size reserved for the .npy header, so that the final shape can be written
+# in place once all the rows are known
+NPY_HEADER_SIZE = 128
+
+DEFAULT_CHUNK_SIZE = 10000
+
+def make_npy_header(nrows, ncols, descr="<f8"):
+    """Returns a .npy header of NPY_HEADER_SIZE bytes for an array of nrows
+    rows of ncols columns, or a 1D array if ncols is None."""
+    if ncols is None:
+        shape = "(%d,)" % nrows
+    else:
+        shape = "(%d, %d)" % (nrows, ncols)
+    header = "{'descr': '%s', 'fortran_order': False, 'shape': %s, }" % \
+            (descr, shape)
+    hlen = NPY_HEADER_SIZE - 10
+    return "\x93NUMPY\x01\x00" + struct.pack("<H", hlen) + \
+            header.ljust(hlen - 1) + "\n"
+
+def safe_channel_name(channel):
+    return re.sub("[^A-Za-z0-9_.-]", "_", channel)
+
+def channel_filename(channel):
+    return safe_channel_name(channel) + ".npy"
+
+class NpyChannelWriter:
+    """Appends rows of doubles to a 2D .npy file.
+
+    Rows are collected in a preallocated buffer of chunk_size rows, which is
+    written out whenever it fills up.  Rows shorter than the widest row seen
+    so far are padded with zeros.  If a wider row arrives, the rows written
+    so far are kept in a separate segment and padded when the writer is
+    closed.
+    """
+    def __init__(self, fname, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.fname = fname
+        self.chunk_size = chunk_size
+        self.nrows = 0
+        self.ncols = 0
+        # (filename, data offset, nrows, ncols) of each completed segment
+        self._segments = []
+        self._file = None
+        self._segment_rows = 0
+        self._buf = None
+        self._buflen = 0
+
+    def append(self, row):
+        n = len(row)
+        if n > self.ncols:
+            self._start_segment(n)
+        buf = self._buf
+        buf[self._buflen, :n] = row
+        if n < self.ncols:
+            buf[self._buflen, n:] = 0
+        self._buflen += 1
+        self.nrows += 1
+        if self._buflen == self.chunk_size:
+            self._flush()
+
+    def append_ragged(self, values, lengths):
+        """Appends rows given as concatenated values and row lengths."""
+        self.append_rows(pad_ragged(values, lengths, int(lengths.max())))
+
+    def append_rows(self, rows):
+        """Appends the rows of a 2D array."""
+        nrows, n = rows.shape
+        if n > self.ncols:
+            self._start_segment(n)
+        pos = 0
+        while pos < nrows:
+            count = min(nrows - pos, self.chunk_size - self._buflen)
+            block = self._buf[self._buflen:self._buflen + count]
+            block[:, :n] = rows[pos:pos + count]
+            if n < self.ncols:
+                block[:, n:] = 0
+            self._buflen += count
+            self.nrows += count
+            pos += count
+            if self._buflen == self.chunk_size:
+                self._flush()
+
+    def _flush(self):
+        if self._buflen:
+            self._buf[:self._buflen].tofile(self._file)
+            self._segment_rows += self._buflen
+            self._buflen = 0
+
+    def _finish_segment(self):
+        if self._file is None:
+            return
+        self._flush()
+        if self._segments:
+            offset = 0
+        else:
+            offset = NPY_HEADER_SIZE
+        self._segments.append((self._file.name, offset, self._segment_rows,
+            self.ncols))
+        self._file.close()
+        self._file = None
+
+    def _start_segment(self, ncols):
+        self._finish_segment()
+        self.ncols = ncols
+        self._segment_rows = 0
+        self._buf = numpy.empty((self.chunk_size, ncols), dtype="<f8")
+        if not self._segments:
+            self._file = open(self.fname, "wb")
+            self._file.write(make_npy_header(0, ncols))
+        else:
+            self._file = open("%s.%d.tmp" % (self.fname,
+                len(self._segments)), "wb")
+
+    def close(self):
+        """Finishes the .npy file and returns its (nrows, ncols) shape."""
+        self._finish_segment()
+        self._buf = None
+        if len(self._segments) == 1:
+            f = open(self.fname, "r+b")
+            f.write(make_npy_header(self.nrows, self.ncols))
+            f.close()
+            return self.nrows, self.ncols
+
+        # the row width grew while writing, so pad the earlier segments
+        tmp_fname = self.fname + ".tmp"
+        out = open(tmp_fname, "wb")
+        out.write(make_npy_header(self.nrows, self.ncols))
+        for fname, offset, nrows, ncols in self._segments:
+            f = open(fname, "rb")
+            f.seek(offset)
+            padded = numpy.zeros((self.chunk_size, self.ncols), dtype="<f8")
+            while nrows > 0:
+                n = min(nrows, self.chunk_size)
+                chunk = numpy.fromfile(f, dtype="<f8", count=n * ncols)
+                padded[:n, :ncols] = chunk.reshape(n, ncols)
+                padded[:n].tofile(out)
+                nrows -= n
+            f.close()
+            if fname != self.fname:
+                os.remove(fname)
+        out.close()
+        os.rename(tmp_fname, self.fname)
+        return self.nrows, self.ncols
+
+def offsets_filename(fname):
+    return fname[:-len(".npy")] + ".offsets.npy"
+
+class RaggedNpyChannelWriter:
+    """Appends rows of doubles of any length to a .npy file.
+
+    The rows are concatenated into a 1D array, and the nrows + 1 offsets of
+    the rows are written to a second .npy file, see offsets_filename.  If
+    all the rows turn out to have the same length, the offsets are dropped
+    and the values are written as a 2D array when the writer is closed.
+    """
+    def __init__(self, fname, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.fname = fname
+        self.chunk_size = chunk_size
+        self.nrows = 0
+        self.nvalues = 0
+        self.min_length = None
+        self.max_length = 0
+        self._rows = []
+        self._file = open(fname, "wb")
+        self._file.write(make_npy_header(0, None))
+        self._offsets_file = open(offsets_filename(fname), "wb")
+        self._offsets_file.write(make_npy_header(0, None, "<i8"))
+        numpy.zeros(1, dtype="<i8").tofile(self._offsets_file)
+
+    def append(self, row):
+        self._rows.append(row)
+        if len(self._rows) == self.chunk_size:
+            self._flush()
+
+    def append_rows(self, rows):
+        """Appends the rows of a 2D array."""
+        self._flush()
+        self.append_ragged(*ragged_from_array(rows))
+
+    def append_ragged(self, values, lengths):
+        """Appends rows given as concatenated values and row lengths."""
+        self._flush()
+        if not len(lengths):
+            return
+        numpy.asarray(values, dtype="<f8").tofile(self._file)
+        lengths_to_offsets(lengths, self.nvalues)[1:].astype("<i8").tofile(
+                self._offsets_file)
+        self.nrows += len(lengths)
+        self.nvalues += len(values)
+        min_length = int(lengths.min())
+        if self.min_length is None or min_length < self.min_length:
+            self.min_length = min_length
+        self.max_length = max(self.max_length, int(lengths.max()))
+
+    def _flush(self):
+        if self._rows:
+            rows = self._rows
+            self._rows = []
+            self.append_ragged(*ragged_from_rows(rows))
+
+    def close(self):
+        """Finishes the .npy files and returns the (nrows, ncols) shape of
+        the values, where ncols is None if they are ragged."""
+        self._flush()
+        self._offsets_file.seek(0)
+        self._offsets_file.write(make_npy_header(self.nrows + 1, None, "<i8"))
+        self._offsets_file.close()
+        self._file.seek(0)
+        if self.min_length == self.max_length:
+            ncols = self.max_length
+            self._file.write(make_npy_header(self.nrows, ncols))
+            os.remove(offsets_filename(self.fname))
+        else:
+            ncols = None
+            self._file.write(make_npy_header(self.nvalues, None))
+        self._file.close()
+        return self.nrows, ncols
+
+class NpyLogWriter:
+    """Writes each channel to <dirname>/<channel>.npy through a
+    RaggedNpyChannelWriter, or if pad is true, an NpyChannelWriter."""
+    def __init__(self, dirname, chunk_size=DEFAULT_CHUNK_SIZE, pad=False):
+        self.dirname = dirname
+        self.chunk_size = chunk_size
+        self.pad = pad
+        self.writers = {}
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+
+    def _get_writer(self, channel):
+        writer = self.writers.get(channel)
+        if writer is None:
+            if self.pad:
+                writer_class = NpyChannelWriter
+            else:
+                writer_class = RaggedNpyChannelWriter
+            writer = writer_class(os.path.join(self.dirname,
+                channel_filename(channel)), self.chunk_size)
+            self.writers[channel] = writer
+        return writer
+
+    def append(self, channel, row):
+        self._get_writer(channel).append(row)
+
+    def append_rows(self, channel, rows):
+        self._get_writer(channel).append_rows(rows)
+
+    def append_ragged(self, channel, values, lengths):
+        self._get_writer(channel).append_ragged(values, lengths)
+
+    def close(self):
+        """Finishes all the channel files, and returns a dictionary mapping
+        channels to their (filename, shape)."""
+        result = {}
+        for channel, writer in self.writers.items():
+            result[channel] = (writer.fname, writer.close())
+        return result
@@ -1,6 +1,12 @@
 import cStringIO as StringIO
 import bot_lcmgl.data_t as data_t
 import struct
+import zlib
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 LCMGL_GL_BEGIN         = 4
 LCMGL_GL_END           = 5
@@ -39,6 +45,10 @@ LCMGL_TEXTURE_DRAW_QUAD= 37
 LCMGL_SPHERE           = 38
 LCMGL_CYLINDER         = 39
 
+# Leads the first data_t of a compressed or chunked scene.  Followed by u32
+# compression, u32 uncompressed scene length and u32 number of chunks.
+LCMGL_SCENE_HEADER     = 43
+
 # text flags
 LCMGL_TEXT_DROP_SHADOW                   = 1
 LCMGL_TEXT_JUSTIFY_LEFT                  = 2
@@ -53,12 +63,21 @@ LCMGL_TEXT_ANCHOR_VCENTER                = 512
 LCMGL_TEXT_NORMALIZED_SCREEN_COORDINATES = 1024
 LCMGL_TEXT_MONOSPACED                    = 2048
 
-# texture constants
-LCMGL_LUMINANCE = 0
-LCMGL_RGB = 1
-LCMGL_RGBA = 2
+# texture constants (values pulled from gl.h)
+LCMGL_LUMINANCE = 0x1909
+LCMGL_RGB       = 0x1907
+LCMGL_RGBA      = 0x1908
+
+LCMGL_UNSIGNED_BYTE  = 0x1401
+LCMGL_BYTE           = 0x1400
+LCMGL_UNSIGNED_SHORT = 0x1403
+LCMGL_SHORT          = 0x1402
+LCMGL_UNSIGNED_INT   = 0x1405
+LCMGL_INT            = 0x1404
+LCMGL_FLOAT          = 0x1406
 
 LCMGL_COMPRESS_NONE = 0
+LCMGL_COMPRESS_ZLIB = 1
 
 # redefine OpenGL constants
 GL_POINTS         = 0x0000
@@ -116,29 +135,91 @@ def _lcmgl_make_encode_0(cmd):
         self.data.write(data)
         self.datalen += 1
     return encode
-    
+
+def _lcmgl_as_array(name, a, ncols, nrows=None):
+    a = numpy.asarray(a, dtype=numpy.float64)
+    if a.ndim != 2 or a.shape[1] not in ncols:
+        raise ValueError("%s must be an (N, %s) array" % \
+                (name, "|".join([str(c) for c in ncols])))
+    if nrows is not None and a.shape[0] != nrows:
+        raise ValueError("%s has %d rows, expected %d" % \
+                (name, a.shape[0], nrows))
+    return a
+
+_scene_header = struct.Struct(">BIII")
+
+# limits on what a scene header may claim, like in lcmgl_bot_renderer.c.
+# Until the first chunk of a scene has arrived, chunks with sequence numbers
+# up to _MAX_SCENE_CHUNKS are kept.
+_MAX_SCENE_CHUNKS = 65536
+_MAX_SCENE_SIZE = 256 * 1024 * 1024
+
+def _lcmgl_make_chunks(data, compression, max_chunk_size):
+    if compression == LCMGL_COMPRESS_NONE:
+        body = data
+    elif compression == LCMGL_COMPRESS_ZLIB:
+        body = zlib.compress(data)
+    else:
+        raise ValueError("Invalid compression value")
+
+    total = _scene_header.size + len(body)
+    if max_chunk_size is None:
+        nchunks = 1
+        max_chunk_size = total
+    else:
+        if max_chunk_size < _scene_header.size:
+            raise ValueError("max_chunk_size must be at least %d" % \
+                    _scene_header.size)
+        nchunks = (total + max_chunk_size - 1) // max_chunk_size
+
+    payload = _scene_header.pack(LCMGL_SCENE_HEADER, compression,
+            len(data), nchunks) + body
+    return [ payload[i:i + max_chunk_size] \
+            for i in range(0, total, max_chunk_size) ]
+
 class lcmgl:
-    def __init__(self, name, lcm):
+    def __init__(self, name, lcm, compression=LCMGL_COMPRESS_NONE,
+            max_chunk_size=None):
+        """Creates an LCMGL drawing context that publishes on LCMGL.
+
+        If compression is LCMGL_COMPRESS_ZLIB, each scene is deflated before
+        it is published.  If max_chunk_size is set, scenes larger than
+        max_chunk_size bytes are split across several data_t messages
+        numbered by their sequence field.  Use lcmgl_assembler to put them
+        back together on the receiving end.
+        """
         self.lcm = lcm
         self.data = StringIO.StringIO()
         self.datalen = 0
         self.scene = 1
         self.name = name
         self.ntextures = 0
+        self.compression = compression
+        self.max_chunk_size = max_chunk_size
 
     def switch_buffer(self):
         d = self.data.getvalue()
 
-        msg = data_t()
-        msg.name = self.name
-        msg.scene = self.scene
-        msg.sequence = 0
-        msg.datalen = len(d)
-        msg.data = d
-        self.lcm.publish("LCMGL", msg.encode())
+        if self.compression == LCMGL_COMPRESS_NONE and \
+                (self.max_chunk_size is None or \
+                len(d) <= self.max_chunk_size):
+            chunks = [ d ]
+        else:
+            chunks = _lcmgl_make_chunks(d, self.compression,
+                    self.max_chunk_size)
+
+        for sequence, chunk in enumerate(chunks):
+            msg = data_t()
+            msg.name = self.name
+            msg.scene = self.scene
+            msg.sequence = sequence
+            msg.datalen = len(chunk)
+            msg.data = chunk
+            self.lcm.publish("LCMGL", msg.encode())
 
         self.ntextures = 0
         self.data = StringIO.StringIO()
+        self.datalen = 0
         self.scene += 1
 
     glBegin        = _lcmgl_make_encode_1(LCMGL_GL_BEGIN, "I")
@@ -178,37 +259,140 @@ class lcmgl:
     # cylinder(x, y, z, r_base, r_top, height, slices, stacks)
     cylinder       = _lcmgl_make_encode_8(LCMGL_CYLINDER, "ddddddII")
 
+    # Batched geometry.  These methods take NumPy arrays and emit exactly the
+    # same opcode stream as the equivalent sequence of glColor*/glNormal3f/
+    # glVertex* calls, but build it in a single vectorized pass.
+
+    def vertices(self, points, colors=None, normals=None,
+            single_precision=False):
+        """Emits one vertex per row of points, an (N, 2) or (N, 3) array.
+
+        colors may be a single RGB(A) tuple, emitted once before the
+        vertices, or an (N, 3) / (N, 4) array of per-vertex colors.  normals
+        may likewise be a single 3-vector or an (N, 3) array.  Vertices are
+        encoded as glVertex*d unless single_precision is True, in which case
+        glVertex*f is used.  Must be called between glBegin and glEnd.
+        """
+        if numpy is None:
+            raise RuntimeError("bot_lcmgl batched geometry requires numpy")
+
+        points = _lcmgl_as_array("points", points, (2, 3))
+        npoints, dim = points.shape
+
+        fields = []
+        columns = []
+        if colors is not None:
+            colors = numpy.asarray(colors, dtype=numpy.float64)
+            if colors.ndim == 1:
+                if len(colors) == 3:
+                    self.glColor3f(*colors)
+                elif len(colors) == 4:
+                    self.glColor4f(*colors)
+                else:
+                    raise ValueError("colors must have 3 or 4 components")
+            else:
+                colors = _lcmgl_as_array("colors", colors, (3, 4), npoints)
+                if colors.shape[1] == 3:
+                    opcode = LCMGL_GL_COLOR3F
+                else:
+                    opcode = LCMGL_GL_COLOR4F
+                fields.append(("color", ">f4", colors.shape[1], opcode))
+                columns.append(colors)
+
+        if normals is not None:
+            normals = numpy.asarray(normals, dtype=numpy.float64)
+            if normals.ndim == 1:
+                if len(normals) != 3:
+                    raise ValueError("normals must have 3 components")
+                self.glNormal3f(*normals)
+            else:
+                normals = _lcmgl_as_array("normals", normals, (3,), npoints)
+                fields.append(("normal", ">f4", 3, LCMGL_GL_NORMAL3F))
+                columns.append(normals)
+
+        if single_precision:
+            opcode = { 2 : LCMGL_GL_VERTEX2F, 3 : LCMGL_GL_VERTEX3F }[dim]
+            fields.append(("vertex", ">f4", dim, opcode))
+        else:
+            opcode = { 2 : LCMGL_GL_VERTEX2D, 3 : LCMGL_GL_VERTEX3D }[dim]
+            fields.append(("vertex", ">f8", dim, opcode))
+        columns.append(points)
+
+        dtype = numpy.dtype([ item for name, fmt, count, opcode in fields \
+                for item in ((name + "_op", "u1"), (name, fmt, (count,))) ])
+        buf = numpy.empty(npoints, dtype=dtype)
+        for (name, fmt, count, opcode), column in zip(fields, columns):
+            buf[name + "_op"] = opcode
+            buf[name] = column
+
+        self.data.write(buf.tobytes())
+        self.datalen += buf.nbytes
+
+    def _primitive(self, mode, points, colors, normals, single_precision):
+        self.glBegin(mode)
+        self.vertices(points, colors, normals, single_precision)
+        self.glEnd()
+
+    def points(self, points, colors=None, size=None, single_precision=False):
+        """Draws each row of points as a GL_POINTS vertex."""
+        if size is not None:
+            self.glPointSize(size)
+        self._primitive(GL_POINTS, points, colors, None, single_precision)
+
+    def lines(self, points, colors=None, width=None, single_precision=False):
+        """Draws GL_LINES segments between consecutive pairs of rows."""
+        if width is not None:
+            self.glLineWidth(width)
+        self._primitive(GL_LINES, points, colors, None, single_precision)
+
+    def line_strip(self, points, colors=None, width=None,
+            single_precision=False):
+        """Draws a GL_LINE_STRIP through the rows of points."""
+        if width is not None:
+            self.glLineWidth(width)
+        self._primitive(GL_LINE_STRIP, points, colors, None, single_precision)
+
+    def triangles(self, points, colors=None, normals=None,
+            single_precision=False):
+        """Draws GL_TRIANGLES from consecutive triples of rows."""
+        self._primitive(GL_TRIANGLES, points, colors, normals,
+                single_precision)
+
     def text(self, x, y, z, text, flags = 0):
         font = 0
         self.data.write(struct.pack(">BIIdddI", LCMGL_TEXT_LONG, font, flags, x, y, z, len(text)))
         self.data.write(text)
         self.datalen += 37 + len(text)
 
-    def texture2d(self, data, width, height, format, compression):
-        self.ntextures += 1
-        tex_id = self.ntextures
-
+    def texture2d(self, data, width, height, format, compression,
+            type=LCMGL_UNSIGNED_BYTE):
         if format not in [ LCMGL_LUMINANCE, LCMGL_RGB, LCMGL_RGBA ]:
             raise ValueError("Invalid format")
-#        bytes_per_pixel = 1
-#        if format == LCMGL_LUMINANCE:
-#            bytes_per_pixel = 1
-#        elif format == LCMGL_RGB:
-#            bytes_per_pixel = 3
-#        elif format == LCMGL_RGBA:
-#            bytes_per_pixel = 4
-#        else:
-#        bytes_per_row = width * bytes_per_pixel
-#        datalen = bytes_per_row * height
+        if height <= 0 or len(data) % height:
+            raise ValueError("Texture data is not a whole number of rows")
 
         if compression == LCMGL_COMPRESS_NONE:
             data_tosend = data
+        elif compression == LCMGL_COMPRESS_ZLIB:
+            # like the C client, compress each row separately and prefix it
+            # with its compressed size
+            bytes_per_row = len(data) // height
+            rows = []
+            for start in range(0, len(data), bytes_per_row):
+                row = zlib.compress(data[start:start + bytes_per_row])
+                rows.append(struct.pack(">I", len(row)))
+                rows.append(row)
+            data_tosend = "".join(rows)
         else:
             raise ValueError("Invalid compression value")
 
-        self.data.write(struct.pack(">BIIIIII", LCMGL_TEXTURE2D, tex_id,
-            width, height, format, compression, len(data_tosend)))
+        self.ntextures += 1
+        tex_id = self.ntextures
+
+        self.data.write(struct.pack(">BIIIIIII", LCMGL_TEXTURE2D, tex_id,
+            width, height, format, type, compression, len(data)))
         self.data.write(data_tosend)
+        self.datalen += 33 + len(data_tosend)
 
         return tex_id
 
@@ -226,6 +410,78 @@ class lcmgl:
             top_right_xyz[0], top_right_xyz[1], top_right_xyz[2]))
 
 
+class lcmgl_assembler:
+    """Reassembles the data_t messages published by lcmgl.switch_buffer.
+
+    Feed every received data_t to add().  Once all the chunks of a scene
+    have arrived, add() returns the decompressed LCMGL command stream for
+    it.  Messages from scenes that are superseded before they complete are
+    dropped, as are messages whose sequence number is out of range and
+    scenes whose header claims more than _MAX_SCENE_SIZE bytes or
+    _MAX_SCENE_CHUNKS chunks.
+    """
+    def __init__(self):
+        # name -> (scene, { sequence : data })
+        self._partial = {}
+
+    def add(self, msg):
+        """Returns the scene's command stream when msg completes it, or
+        None if more chunks are needed."""
+        if msg.sequence == 0 and not msg.data.startswith(
+                chr(LCMGL_SCENE_HEADER)):
+            self._partial.pop(msg.name, None)
+            return msg.data
+
+        if not 0 <= msg.sequence < _MAX_SCENE_CHUNKS:
+            return None
+        scene, chunks = self._partial.get(msg.name, (None, None))
+        if scene != msg.scene:
+            chunks = {}
+            self._partial[msg.name] = (msg.scene, chunks)
+        if 0 in chunks:
+            nchunks = _scene_header.unpack_from(chunks[0])[3]
+            if msg.sequence >= nchunks:
+                return None
+        elif msg.sequence == 0:
+            if len(msg.data) < _scene_header.size:
+                del self._partial[msg.name]
+                raise ValueError("Bad scene header")
+            opcode, compression, datalen, nchunks = \
+                    _scene_header.unpack_from(msg.data)
+            if datalen > _MAX_SCENE_SIZE or \
+                    not 0 < nchunks <= _MAX_SCENE_CHUNKS:
+                del self._partial[msg.name]
+                raise ValueError("Bad scene header: %d bytes in %d chunks" % \
+                        (datalen, nchunks))
+            # drop the chunks that were received out of range before
+            for sequence in chunks.keys():
+                if sequence >= nchunks:
+                    del chunks[sequence]
+        chunks[msg.sequence] = msg.data
+
+        if 0 not in chunks:
+            return None
+        opcode, compression, datalen, nchunks = \
+                _scene_header.unpack_from(chunks[0])
+        if len(chunks) < nchunks:
+            return None
+
+        del self._partial[msg.name]
+        payload = "".join([ chunks[i] for i in range(nchunks) ])
+        body = payload[_scene_header.size:]
+        if compression == LCMGL_COMPRESS_NONE:
+            data = body
+        elif compression == LCMGL_COMPRESS_ZLIB:
+            # don't inflate more than the header claims
+            data = zlib.decompressobj().decompress(body, datalen + 1)
+        else:
+            raise ValueError("Invalid compression value %d" % compression)
+        if len(data) != datalen:
+            raise ValueError("Scene is %d bytes, expected %d" % \
+                    (len(data), datalen))
+        return data
+
+
 if __name__ == "__main__":
     import array
     import math
@@ -241,7 +497,7 @@ if __name__ == "__main__":
             a.append(int(v * 50 + 127))
     img_data = a.tostring()
     print len(img_data)
-    tex_id = g.texture2d(img_data, width, height, LCMGL_LUMINANCE, LCMGL_COMPRESS_NONE)
+    tex_id = g.texture2d(img_data, width, height, LCMGL_LUMINANCE, LCMGL_COMPRESS_ZLIB)
     g.glColor3f(0, 0, 1)
     g.textureDrawQuad(tex_id, 
             (-10, 10, 0),
@@ -357,7 +357,9 @@ enum _bot_lcmgl_enum_t
     BOT_LCMGL_CYLINDER,
     BOT_LCMGL_MATRIX_MODE,
     BOT_LCMGL_ORTHO,
-    BOT_LCMGL_SCALE_TO_VIEWER_AR
+    BOT_LCMGL_SCALE_TO_VIEWER_AR,
+    // first byte of a compressed or chunked scene, see lcmgl_bot_renderer.c
+    BOT_LCMGL_SCENE_HEADER
 };
 
 /**
@@ -1,17 +1,39 @@
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <zlib.h>
+
 #include <lcm/lcm.h>
 
 #include <bot_core/bot_core.h>
 #include <bot_vis/bot_vis.h>
 #include <lcmtypes/bot_lcmgl_data_t.h>
 
+#include "../bot_lcmgl_client/lcmgl.h"
 #include "lcmgl_decode.h"
 #include "lcmgl_bot_renderer.h"
 
+// header leading a compressed or chunked scene:
+// u8 BOT_LCMGL_SCENE_HEADER, u32 compression, u32 datalen, u32 nchunks
+#define SCENE_HEADER_SIZE 13
+
+// limits on what a scene header may claim, so that a corrupt or malicious
+// message can't make the viewer allocate huge buffers.  Until the first chunk
+// of a scene has arrived, chunks with sequence numbers up to
+// MAX_SCENE_CHUNKS are kept.
+#define MAX_SCENE_CHUNKS 65536
+#define MAX_SCENE_SIZE (256 * 1024 * 1024)
+
 typedef struct
 {
     GPtrArray *backbuffer;
     GPtrArray *frontbuffer;
     int enabled;
+
+    // chunks received so far of a scene split across several messages
+    GPtrArray *chunks;
+    int chunks_scene;
+    int chunks_received;
 } lcmgl_channel_t;
 
 typedef struct _BotLcmglRenderer {
@@ -63,6 +85,153 @@ static void my_draw( BotViewer *viewer, BotRenderer *renderer )
     g_list_free (keys);
 }
 
+static uint32_t decode_u32(const uint8_t *data)
+{
+    return ((uint32_t) data[0] << 24) | ((uint32_t) data[1] << 16) |
+        ((uint32_t) data[2] << 8) | (uint32_t) data[3];
+}
+
+static void clear_chunks(lcmgl_channel_t *chan)
+{
+    for (int i = 0; i < chan->chunks->len; i++) {
+        bot_lcmgl_data_t *chunk = g_ptr_array_index(chan->chunks, i);
+        if (chunk)
+            bot_lcmgl_data_t_destroy(chunk);
+    }
+    g_ptr_array_set_size(chan->chunks, 0);
+    chan->chunks_received = 0;
+}
+
+/*
+ * Adds a message of a compressed or chunked scene.  Returns the
+ * reassembled, uncompressed scene once all of its chunks have been received,
+ * and NULL otherwise.
+ */
+static bot_lcmgl_data_t *add_scene_chunk(lcmgl_channel_t *chan,
+        const bot_lcmgl_data_t *msg)
+{
+    if (chan->chunks_scene != msg->scene) {
+        clear_chunks(chan);
+        chan->chunks_scene = msg->scene;
+    }
+    if (msg->sequence < 0 || msg->sequence >= MAX_SCENE_CHUNKS)
+        return NULL;
+
+    // once the first chunk is known, so is the number of chunks
+    bot_lcmgl_data_t *first = NULL;
+    if (chan->chunks->len > 0)
+        first = g_ptr_array_index(chan->chunks, 0);
+    if (first && (uint32_t) msg->sequence >= decode_u32(first->data + 9))
+        return NULL;
+
+    if (msg->sequence >= chan->chunks->len)
+        g_ptr_array_set_size(chan->chunks, msg->sequence + 1);
+    if (g_ptr_array_index(chan->chunks, msg->sequence))
+        return NULL;
+
+    if (msg->sequence == 0) {
+        if (msg->datalen < SCENE_HEADER_SIZE ||
+                msg->data[0] != BOT_LCMGL_SCENE_HEADER) {
+            fprintf(stderr, "lcmgl: bad scene header from %s\n", msg->name);
+            clear_chunks(chan);
+            return NULL;
+        }
+        uint32_t datalen = decode_u32(msg->data + 5);
+        uint32_t nchunks = decode_u32(msg->data + 9);
+        if (datalen > MAX_SCENE_SIZE || nchunks == 0 ||
+                nchunks > MAX_SCENE_CHUNKS) {
+            fprintf(stderr, "lcmgl: bad scene header from %s "
+                    "(%u bytes in %u chunks)\n", msg->name, datalen, nchunks);
+            clear_chunks(chan);
+            return NULL;
+        }
+        // drop the chunks that were received out of range before
+        for (int i = nchunks; i < chan->chunks->len; i++) {
+            bot_lcmgl_data_t *chunk = g_ptr_array_index(chan->chunks, i);
+            if (chunk) {
+                bot_lcmgl_data_t_destroy(chunk);
+                chan->chunks_received--;
+            }
+        }
+        if (chan->chunks->len > nchunks)
+            g_ptr_array_set_size(chan->chunks, nchunks);
+    }
+
+    g_ptr_array_index(chan->chunks, msg->sequence) =
+        bot_lcmgl_data_t_copy(msg);
+    chan->chunks_received++;
+
+    first = g_ptr_array_index(chan->chunks, 0);
+    if (!first)
+        return NULL;
+    uint32_t compression = decode_u32(first->data + 1);
+    uint32_t datalen = decode_u32(first->data + 5);
+    uint32_t nchunks = decode_u32(first->data + 9);
+    if (chan->chunks_received < nchunks)
+        return NULL;
+
+    if (chan->chunks->len < nchunks)
+        return NULL;
+    size_t payload_len = 0;
+    for (int i = 0; i < nchunks; i++) {
+        bot_lcmgl_data_t *chunk = g_ptr_array_index(chan->chunks, i);
+        if (!chunk)
+            return NULL;
+        payload_len += chunk->datalen;
+    }
+    if (payload_len - SCENE_HEADER_SIZE > compressBound(datalen)) {
+        fprintf(stderr, "lcmgl: scene %d from %s is too large\n",
+                msg->scene, msg->name);
+        clear_chunks(chan);
+        return NULL;
+    }
+    uint8_t *payload = (uint8_t*) malloc(payload_len);
+    int pos = 0;
+    for (int i = 0; i < nchunks; i++) {
+        bot_lcmgl_data_t *chunk = g_ptr_array_index(chan->chunks, i);
+        memcpy(payload + pos, chunk->data, chunk->datalen);
+        pos += chunk->datalen;
+    }
+    clear_chunks(chan);
+
+    bot_lcmgl_data_t *scene =
+        (bot_lcmgl_data_t*) calloc(1, sizeof(bot_lcmgl_data_t));
+    scene->name = strdup(msg->name);
+    scene->scene = msg->scene;
+    scene->sequence = 0;
+    scene->datalen = datalen;
+    scene->data = (uint8_t*) malloc(datalen);
+
+    uint8_t *body = payload + SCENE_HEADER_SIZE;
+    uLong body_len = payload_len - SCENE_HEADER_SIZE;
+    int ok = 0;
+    switch (compression) {
+        case BOT_LCMGL_COMPRESS_NONE:
+            if (body_len == datalen) {
+                memcpy(scene->data, body, datalen);
+                ok = 1;
+            }
+            break;
+        case BOT_LCMGL_COMPRESS_ZLIB:
+        {
+            uLong uncompressed_size = datalen;
+            ok = uncompress((Bytef*) scene->data, &uncompressed_size,
+                    (Bytef*) body, body_len) == Z_OK &&
+                uncompressed_size == datalen;
+            break;
+        }
+    }
+    free(payload);
+
+    if (!ok) {
+        fprintf(stderr, "lcmgl: could not decode scene %d from %s\n",
+                msg->scene, msg->name);
+        bot_lcmgl_data_t_destroy(scene);
+        return NULL;
+    }
+    return scene;
+}
+
 static void on_lcmgl_data (const lcm_recv_buf_t *rbuf, const char *channel,
         const bot_lcmgl_data_t *_msg, void *user_data )
 {
@@ -75,6 +244,7 @@ static void on_lcmgl_data (const lcm_recv_buf_t *rbuf, const char *channel,
         chan->enabled=1;
         //chan->backbuffer = g_ptr_array_new();
         chan->frontbuffer = g_ptr_array_new();
+        chan->chunks = g_ptr_array_new();
         g_hash_table_insert(self->channels, strdup(_msg->name), chan);
         bot_gtk_param_widget_add_booleans (self->pw,
                 0, strdup(_msg->name), 1, NULL);
@@ -104,10 +274,21 @@ static void on_lcmgl_data (const lcm_recv_buf_t *rbuf, const char *channel,
     }
 #endif
 
+    bot_lcmgl_data_t *scene;
+    if (_msg->sequence == 0 &&
+            (_msg->datalen == 0 || _msg->data[0] != BOT_LCMGL_SCENE_HEADER)) {
+        // the whole scene fits in one uncompressed message
+        scene = bot_lcmgl_data_t_copy(_msg);
+    } else {
+        scene = add_scene_chunk(chan, _msg);
+        if (!scene)
+            return;
+    }
+
     for (int i = 0; i < chan->frontbuffer->len; i++)
         bot_lcmgl_data_t_destroy(g_ptr_array_index(chan->frontbuffer, i));
     g_ptr_array_set_size (chan->frontbuffer, 0);
-    g_ptr_array_add(chan->frontbuffer, bot_lcmgl_data_t_copy(_msg));
+    g_ptr_array_add(chan->frontbuffer, scene);
     bot_viewer_request_redraw( self->viewer );
 }
 
@@ -0,0 +1,332 @@
+"""Faster encoders and decoders for the bot_procman LCM types.
+
+The classes generated by lcm-gen decode messages one field at a time, with a
+struct.unpack and a read from a StringIO for each field, and check the
+fingerprint of every nested message when encoding.  The codecs here are
+compiled from the schemas of the types below: consecutive fixed size fields,
+along with the length of the string that follows them, are unpacked with a
+single precompiled struct.Struct at an offset into the message, and strings
+are sliced straight out of it.  They produce and accept the same objects and
+bytes as the generated classes.
+
+Only the field types used by the bot_procman types are supported: primitive
+scalars, strings, LCM types, and variable length arrays of strings and LCM
+types.
+
+fast_codec_test.py checks the codecs against the generated classes and
+compares their speed.
+"""
+
+import codecs
+import struct
+
+from bot_procman.command2_t import command2_t
+from bot_procman.deputy_cmd2_t import deputy_cmd2_t
+from bot_procman.deputy_cmd_t import deputy_cmd_t
+from bot_procman.discovery_t import discovery_t
+from bot_procman.info2_t import info2_t
+from bot_procman.info_t import info_t
+from bot_procman.orders2_t import orders2_t
+from bot_procman.orders_t import orders_t
+from bot_procman.printf_t import printf_t
+from bot_procman.sheriff_cmd2_t import sheriff_cmd2_t
+from bot_procman.sheriff_cmd_t import sheriff_cmd_t
+
+_PRIMITIVE_FORMATS = {
+        "int8_t" : "b",
+        "int16_t" : "h",
+        "int32_t" : "i",
+        "int64_t" : "q",
+        "float" : "f",
+        "double" : "d",
+        "boolean" : "b",
+        "byte" : "B",
+        }
+
+# The fields of each type, in the order of the lcmtypes/*.lcm files.  A field
+# is (name, type, length), where type is a primitive type name, "string" or an
+# LCM type, and length is None for scalars or the name of the field holding
+# the length of an array.
+SCHEMAS = [
+        (command2_t, [
+            ("exec_str", "string", None),
+            ("command_name", "string", None),
+            ("group", "string", None),
+            ("auto_respawn", "boolean", None),
+            ("stop_signal", "int8_t", None),
+            ("stop_time_allowed", "float", None),
+            ("num_options", "int32_t", None),
+            ("option_names", "string", "num_options"),
+            ("option_values", "string", "num_options"),
+            ]),
+        (deputy_cmd2_t, [
+            ("cmd", command2_t, None),
+            ("pid", "int32_t", None),
+            ("actual_runid", "int32_t", None),
+            ("exit_code", "int32_t", None),
+            ("cpu_usage", "float", None),
+            ("mem_vsize_bytes", "int64_t", None),
+            ("mem_rss_bytes", "int64_t", None),
+            ("sheriff_id", "int32_t", None),
+            ]),
+        (deputy_cmd_t, [
+            ("name", "string", None),
+            ("nickname", "string", None),
+            ("group", "string", None),
+            ("pid", "int32_t", None),
+            ("actual_runid", "int32_t", None),
+            ("exit_code", "int32_t", None),
+            ("cpu_usage", "float", None),
+            ("mem_vsize_bytes", "int64_t", None),
+            ("mem_rss_bytes", "int64_t", None),
+            ("sheriff_id", "int32_t", None),
+            ("auto_respawn", "boolean", None),
+            ]),
+        (discovery_t, [
+            ("utime", "int64_t", None),
+            ("host", "string", None),
+            ("nonce", "int64_t", None),
+            ]),
+        (info2_t, [
+            ("utime", "int64_t", None),
+            ("host", "string", None),
+            ("cpu_load", "float", None),
+            ("phys_mem_total_bytes", "int64_t", None),
+            ("phys_mem_free_bytes", "int64_t", None),
+            ("swap_total_bytes", "int64_t", None),
+            ("swap_free_bytes", "int64_t", None),
+            ("ncmds", "int32_t", None),
+            ("cmds", deputy_cmd2_t, "ncmds"),
+            ("num_options", "int32_t", None),
+            ("option_names", "string", "num_options"),
+            ("option_values", "string", "num_options"),
+            ]),
+        (info_t, [
+            ("utime", "int64_t", None),
+            ("host", "string", None),
+            ("cpu_load", "float", None),
+            ("phys_mem_total_bytes", "int64_t", None),
+            ("phys_mem_free_bytes", "int64_t", None),
+            ("swap_total_bytes", "int64_t", None),
+            ("swap_free_bytes", "int64_t", None),
+            ("ncmds", "int32_t", None),
+            ("cmds", deputy_cmd_t, "ncmds"),
+            ]),
+        (orders2_t, [
+            ("utime", "int64_t", None),
+            ("host", "string", None),
+            ("sheriff_name", "string", None),
+            ("ncmds", "int32_t", None),
+            ("cmds", sheriff_cmd2_t, "ncmds"),
+            ("num_options", "int32_t", None),
+            ("option_names", "string", "num_options"),
+            ("option_values", "string", "num_options"),
+            ]),
+        (orders_t, [
+            ("utime", "int64_t", None),
+            ("host", "string", None),
+            ("sheriff_name", "string", None),
+            ("ncmds", "int32_t", None),
+            ("cmds", sheriff_cmd_t, "ncmds"),
+            ("nvars", "int32_t", None),
+            ("varnames", "string", "nvars"),
+            ("varvals", "string", "nvars"),
+            ]),
+        (printf_t, [
+            ("utime", "int64_t", None),
+            ("deputy_name", "string", None),
+            ("sheriff_id", "int32_t", None),
+            ("text", "string", None),
+            ]),
+        (sheriff_cmd2_t, [
+            ("cmd", command2_t, None),
+            ("desired_runid", "int32_t", None),
+            ("force_quit", "int8_t", None),
+            ("sheriff_id", "int32_t", None),
+            ]),
+        (sheriff_cmd_t, [
+            ("name", "string", None),
+            ("nickname", "string", None),
+            ("group", "string", None),
+            ("desired_runid", "int32_t", None),
+            ("force_quit", "int8_t", None),
+            ("sheriff_id", "int32_t", None),
+            ("auto_respawn", "boolean", None),
+            ]),
+        ]
+
+class _Compiler(object):
+    """Writes the source of the decode and encode functions of the types,
+    and the structs that they use."""
+    def __init__(self):
+        self.namespace = { "_new" : object.__new__, "_unicode" : unicode,
+                "_utf_8_encode" : codecs.utf_8_encode }
+        self.lines = []
+        self._structs = {}
+
+    def struct_name(self, fmt):
+        name = self._structs.get(fmt)
+        if name is None:
+            name = "_s%d" % len(self._structs)
+            self._structs[fmt] = name
+            self.namespace[name] = struct.Struct(">" + fmt)
+        return name
+
+    def add_type(self, lcmtype, fields):
+        name = lcmtype.__name__
+        self.namespace["_" + name] = lcmtype
+        for fieldname, fieldtype, length in fields:
+            if length is not None and fieldtype in _PRIMITIVE_FORMATS:
+                raise ValueError("%s.%s: arrays of primitive types are not "
+                        "supported" % (name, fieldname))
+        self._add_decoder(name, fields)
+        self._add_encoder(name, fields)
+
+    def _add_decoder(self, name, fields):
+        out = self.lines
+        out.append("def _decode_%s(data, offset):" % name)
+        out.append("    self = _new(_%s)" % name)
+        run = []
+        def flush_run():
+            if not run:
+                return
+            fmt = "".join([ f for f, target in run ])
+            out.append("    %s, = %s.unpack_from(data, offset)" % \
+                    (", ".join([ target for f, target in run ]),
+                        self.struct_name(fmt)))
+            out.append("    offset += %d" % struct.calcsize(">" + fmt))
+            del run[:]
+        for fieldname, fieldtype, length in fields:
+            attr = "self." + fieldname
+            if length is not None:
+                flush_run()
+                out.append("    items = []")
+                out.append("    for i in xrange(self.%s):" % length)
+                if fieldtype == "string":
+                    out.append("        n, = %s.unpack_from(data, offset)" % \
+                            self.struct_name("I"))
+                    out.append("        offset += 4")
+                    out.append("        items.append(_unicode("
+                            "data[offset:offset + n - 1], 'utf-8', 'replace'))")
+                    out.append("        offset += n")
+                else:
+                    out.append("        item, offset = _decode_%s(data, offset)"
+                            % fieldtype.__name__)
+                    out.append("        items.append(item)")
+                out.append("    %s = items" % attr)
+            elif fieldtype in _PRIMITIVE_FORMATS:
+                run.append((_PRIMITIVE_FORMATS[fieldtype], attr))
+            elif fieldtype == "string":
+                run.append(("I", "n"))
+                flush_run()
+                out.append("    %s = _unicode(data[offset:offset + n - 1], "
+                        "'utf-8', 'replace')" % attr)
+                out.append("    offset += n")
+            else:
+                flush_run()
+                out.append("    %s, offset = _decode_%s(data, offset)" % \
+                        (attr, fieldtype.__name__))
+        flush_run()
+        out.append("    return self, offset")
+        out.append("")
+
+    def _add_encoder(self, name, fields):
+        out = self.lines
+        out.append("def _encode_%s(self, append):" % name)
+        run = []
+        strings = []
+        def flush_run():
+            if not run:
+                return
+            fmt = "".join([ f for f, value in run ])
+            out.append("    append(%s.pack(%s))" % (self.struct_name(fmt),
+                ", ".join([ value for f, value in run ])))
+            for s in strings:
+                out.append("    append(%s)" % s)
+                out.append("    append(\"\\0\")")
+            del run[:]
+            del strings[:]
+        for fieldname, fieldtype, length in fields:
+            attr = "self." + fieldname
+            if length is not None:
+                flush_run()
+                out.append("    for i in xrange(self.%s):" % length)
+                if fieldtype == "string":
+                    out.append("        s = _utf_8_encode(%s[i])[0]" % attr)
+                    out.append("        append(%s.pack(len(s) + 1))" % \
+                            self.struct_name("I"))
+                    out.append("        append(s)")
+                    out.append("        append(\"\\0\")")
+                else:
+                    out.append("        _encode_%s(%s[i], append)" % \
+                            (fieldtype.__name__, attr))
+            elif fieldtype in _PRIMITIVE_FORMATS:
+                run.append((_PRIMITIVE_FORMATS[fieldtype], attr))
+            elif fieldtype == "string":
+                # the string is encoded first, so that its length can be
+                # packed along with the fields before it
+                s = "s%d" % len(strings)
+                out.append("    %s = _utf_8_encode(%s)[0]" % (s, attr))
+                run.append(("I", "len(%s) + 1" % s))
+                strings.append(s)
+                flush_run()
+            else:
+                flush_run()
+                out.append("    _encode_%s(%s, append)" % \
+                        (fieldtype.__name__, attr))
+        flush_run()
+        out.append("    return")
+        out.append("")
+
+    def compile(self):
+        self.source = "\n".join(self.lines)
+        exec compile(self.source, "<bot_procman.fast_codec>", "exec") in \
+                self.namespace
+        return self.namespace
+
+def _compile_codecs():
+    compiler = _Compiler()
+    for lcmtype, fields in SCHEMAS:
+        compiler.add_type(lcmtype, fields)
+    namespace = compiler.compile()
+    decoders = {}
+    encoders = {}
+    for lcmtype, fields in SCHEMAS:
+        decoders[lcmtype] = namespace["_decode_" + lcmtype.__name__]
+        encoders[lcmtype] = namespace["_encode_" + lcmtype.__name__]
+    return decoders, encoders, compiler.source
+
+_decoders, _encoders, _source = _compile_codecs()
+
+def decode(lcmtype, data):
+    """Decodes an encoded message of the type lcmtype, which is one of the
+    bot_procman types, from a string or a buffer.  Raises ValueError if the
+    fingerprint doesn't match or the message is cut short, like
+    lcmtype.decode().
+    """
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    if data[:8] != lcmtype._get_packed_fingerprint():
+        raise ValueError("Decode error")
+    try:
+        msg, end = _decoders[lcmtype](data, 8)
+    except struct.error:
+        raise ValueError("Decode error")
+    if end > len(data):
+        raise ValueError("Decode error")
+    return msg
+
+def encode(msg):
+    """Encodes msg, an instance of one of the bot_procman types, to the same
+    bytes as msg.encode().  Unlike msg.encode(), the types of the nested
+    messages aren't checked."""
+    parts = [ msg._get_packed_fingerprint() ]
+    _encoders[type(msg)](msg, parts.append)
+    return "".join(parts)
+
+def encode_one(msg):
+    """Encodes msg without the fingerprint, like msg._encode_one(), which is
+    how messages are encoded when nested in other messages."""
+    parts = []
+    _encoders[type(msg)](msg, parts.append)
+    return "".join(parts)
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""Conformance and throughput test of bot_procman.fast_codec.
+
+Encodes and decodes randomly filled messages of every type in
+fast_codec.SCHEMAS with both fast_codec and the classes generated by lcm-gen,
+checks that the encoded bytes and the decoded fields are identical and that
+truncated messages are rejected, and then times both codecs on large info2_t
+and orders2_t messages.
+
+usage: python -m bot_procman.fast_codec_test [messages_per_type]
+"""
+
+import cStringIO
+import random
+import struct
+import sys
+import timeit
+
+from bot_procman import fast_codec
+from bot_procman.fast_codec import SCHEMAS
+from bot_procman.deputy_cmd2_t import deputy_cmd2_t
+from bot_procman.info2_t import info2_t
+from bot_procman.orders2_t import orders2_t
+from bot_procman.printf_t import printf_t
+from bot_procman.sheriff_cmd2_t import sheriff_cmd2_t
+
+_INT_RANGES = {
+        "int8_t" : (-2**7, 2**7 - 1),
+        "int16_t" : (-2**15, 2**15 - 1),
+        "int32_t" : (-2**31, 2**31 - 1),
+        "int64_t" : (-2**63, 2**63 - 1),
+        "boolean" : (0, 1),
+        "byte" : (0, 255),
+        }
+
+_FIELDS = dict(SCHEMAS)
+
+class _MessageMaker(object):
+    def __init__(self, seed):
+        self.rand = random.Random(seed)
+
+    def string(self):
+        if self.rand.random() < 0.3:
+            return "ascii-%d" % self.rand.randint(0, 999)
+        return u"".join([ self.rand.choice(u"abc xyz/é中-") \
+                for i in range(self.rand.randint(0, 20)) ])
+
+    def message(self, lcmtype, max_array_len=4):
+        """Returns an instance of lcmtype with random field values."""
+        msg = lcmtype()
+        for name, fieldtype, length in _FIELDS[lcmtype]:
+            if length is not None:
+                count = getattr(msg, length)
+                if fieldtype == "string":
+                    value = [ self.string() for i in range(count) ]
+                else:
+                    value = [ self.message(fieldtype, 2) \
+                            for i in range(count) ]
+            elif fieldtype == "string":
+                value = self.string()
+            elif fieldtype == "float":
+                # round to what a float can hold
+                value = struct.unpack(">f", struct.pack(">f",
+                    self.rand.uniform(-1e6, 1e6)))[0]
+            elif fieldtype == "double":
+                value = self.rand.uniform(-1e6, 1e6)
+            elif fieldtype in _INT_RANGES:
+                if _is_length_field(lcmtype, name):
+                    value = self.rand.randint(0, max_array_len)
+                else:
+                    value = self.rand.randint(*_INT_RANGES[fieldtype])
+            else:
+                value = self.message(fieldtype, 2)
+            setattr(msg, name, value)
+        return msg
+
+def _is_length_field(lcmtype, name):
+    return any([ length == name for f, t, length in _FIELDS[lcmtype] ])
+
+def assert_same_fields(a, b, lcmtype, path=None):
+    """Asserts that the messages a and b of the type lcmtype have equal
+    fields of the same types."""
+    if path is None:
+        path = lcmtype.__name__
+    for name, fieldtype, length in _FIELDS[lcmtype]:
+        fieldpath = "%s.%s" % (path, name)
+        x = getattr(a, name)
+        y = getattr(b, name)
+        if isinstance(fieldtype, type):
+            if length is None:
+                x = [ x ]
+                y = [ y ]
+            assert len(x) == len(y), fieldpath
+            for xi, yi in zip(x, y):
+                assert type(xi) is fieldtype and type(yi) is fieldtype, \
+                        fieldpath
+                assert_same_fields(xi, yi, fieldtype, fieldpath)
+        else:
+            assert x == y and type(x) is type(y), \
+                    "%s: %r != %r" % (fieldpath, x, y)
+
+def check_conformance(messages_per_type=300, seed=1):
+    """Checks fast_codec against the generated classes, and returns the
+    number of messages checked."""
+    maker = _MessageMaker(seed)
+    count = 0
+    for lcmtype, fields in SCHEMAS:
+        for i in range(messages_per_type):
+            msg = maker.message(lcmtype)
+
+            # encoding
+            expected = msg.encode()
+            assert fast_codec.encode(msg) == expected, lcmtype.__name__
+            buf = cStringIO.StringIO()
+            msg._encode_one(buf)
+            assert fast_codec.encode_one(msg) == buf.getvalue(), \
+                    lcmtype.__name__
+
+            # decoding, from each kind of input that decode() accepts
+            reference = lcmtype.decode(expected)
+            for data in (expected, memoryview(expected),
+                    buffer("xx" + expected + "yy", 2, len(expected))):
+                assert_same_fields(fast_codec.decode(lcmtype, data),
+                        reference, lcmtype)
+
+            # truncated messages
+            for end in range(0, len(expected), max(1, len(expected) // 7)):
+                try:
+                    fast_codec.decode(lcmtype, expected[:end])
+                except ValueError:
+                    pass
+                else:
+                    raise AssertionError("%s truncated to %d bytes was "
+                            "accepted" % (lcmtype.__name__, end))
+            count += 1
+
+    # messages of the wrong type
+    data = maker.message(printf_t).encode()
+    try:
+        fast_codec.decode(info2_t, data)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("printf_t accepted as an info2_t")
+
+    # strings that aren't valid UTF-8 are decoded the same way
+    msg = printf_t()
+    msg.utime = 1
+    msg.deputy_name = "deputy"
+    msg.sheriff_id = 2
+    msg.text = ""
+    data = msg.encode()[:-5] + struct.pack(">I", 3) + "\xff\xfe\0"
+    assert_same_fields(fast_codec.decode(printf_t, data),
+            printf_t.decode(data), printf_t)
+    return count
+
+def _large_message(maker, lcmtype, cmdtype, ncmds):
+    msg = maker.message(lcmtype)
+    msg.ncmds = ncmds
+    msg.cmds = [ maker.message(cmdtype, 2) for i in range(ncmds) ]
+    return msg
+
+def benchmark(number=2000, ncmds=30):
+    """Times both codecs on info2_t and orders2_t messages with ncmds
+    commands, and prints the results."""
+    maker = _MessageMaker(2)
+    for lcmtype, cmdtype in ((info2_t, deputy_cmd2_t),
+            (orders2_t, sheriff_cmd2_t)):
+        msg = _large_message(maker, lcmtype, cmdtype, ncmds)
+        data = msg.encode()
+        for label, func in (
+                ("generated decode", lambda: lcmtype.decode(data)),
+                ("fast decode", lambda: fast_codec.decode(lcmtype, data)),
+                ("generated encode", msg.encode),
+                ("fast encode", lambda: fast_codec.encode(msg))):
+            elapsed = min(timeit.repeat(func, number=number, repeat=3))
+            print "%-9s %-16s %8.1f us/msg  (%d bytes, %d cmds)" % \
+                    (lcmtype.__name__, label, elapsed / number * 1e6,
+                            len(data), ncmds)
+
+def main():
+    messages_per_type = 300
+    if len(sys.argv) > 1:
+        messages_per_type = int(sys.argv[1])
+    count = check_conformance(messages_per_type)
+    print "conformance ok: %d messages" % count
+    benchmark()
+
+if __name__ == "__main__":
+    main()
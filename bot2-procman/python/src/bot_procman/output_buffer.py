@@ -0,0 +1,189 @@
+"""Bounded storage for the console output of commands.
+
+The output of each command is kept in an OutputRingBuffer instead of a GUI
+text widget, so that commands that aren't being looked at cost only the
+memory of their most recent output.  Text is stored along with the ANSI SGR
+codes (colors, bold, etc.) that apply to it, so that a viewer can format it
+when it's displayed.
+
+The text is stored UTF-8 encoded in fixed-size chunks, with a list of the
+offsets at which the formatting changes, so that output made of many small
+writes costs little more than its bytes.
+"""
+
+import collections
+
+# the size of the chunks that the text of an OutputRingBuffer is stored in
+CHUNK_SIZE = 4096
+
+# how many bytes each change of formatting is counted as in the size of an
+# OutputRingBuffer, for the (offset, style) tuple that records it
+STYLE_SPAN_BYTES = 64
+
+def parse_ansi(text, style=None):
+    """Splits text on ANSI SGR escape sequences ("\\x1b[...m").
+
+    Returns (segments, style).  segments is a list of (style, text), where
+    style is the key of the codes that apply to the text: the codes joined by
+    ";" in sorted order, or None for unformatted text.  The style argument is
+    the style at the start of text, and the returned style is the one in
+    effect at its end.  Escape sequences that aren't terminated by "m" are
+    left in the text.
+    """
+    segments = []
+    for segnum, seg in enumerate(text.split("\x1b[")):
+        if segnum > 0:
+            try:
+                esc_seq, seg = seg.split("m", 1)
+            except ValueError:
+                pass
+            else:
+                if not esc_seq:
+                    esc_seq = "0"
+                codes = esc_seq.split(";")
+                codes.sort()
+                style = ";".join(codes)
+        if seg:
+            segments.append((style, seg))
+    return segments, style
+
+class OutputRingBuffer(object):
+    """The most recent output, up to max_bytes bytes, with formatting.
+
+    The size counts the UTF-8 encoded text plus STYLE_SPAN_BYTES for each
+    change of formatting.  Every byte appended has an offset, which counts
+    the bytes appended since the buffer was created, so a viewer can
+    remember how far it has read with get_end_offset() and later retrieve
+    only the output that followed with get_segments_since().
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        # bytearrays of at most CHUNK_SIZE bytes, oldest first.  The first
+        # _head_skip bytes of the first chunk have been dropped.
+        self._chunks = collections.deque()
+        self._head_skip = 0
+        self._start_offset = 0
+        self._end_offset = 0
+        # (offset, style) where the style of the text changes, oldest first.
+        # The first one applies from the start of the stored text.
+        self._spans = collections.deque()
+        self._style = None
+
+    def append(self, text):
+        """Appends text, interpreting its ANSI escape sequences, and drops
+        the oldest output if the buffer is over its size."""
+        if isinstance(text, unicode):
+            text = text.encode("utf-8")
+        segments, self._style = parse_ansi(text, self._style)
+        for style, seg in segments:
+            if not self._spans or self._spans[-1][1] != style:
+                if style is not None:
+                    style = intern(style)
+                self._spans.append((self._end_offset, style))
+            self._write(seg)
+        self._trim()
+
+    def _write(self, data):
+        pos = 0
+        while pos < len(data):
+            if not self._chunks or len(self._chunks[-1]) >= CHUNK_SIZE:
+                self._chunks.append(bytearray())
+            chunk = self._chunks[-1]
+            n = CHUNK_SIZE - len(chunk)
+            chunk += data[pos:pos + n]
+            pos += n
+        self._end_offset += len(data)
+
+    def _get_size(self, start_offset):
+        return self._end_offset - start_offset + \
+                max(len(self._spans) - 1, 0) * STYLE_SPAN_BYTES
+
+    def _trim(self):
+        start = self._start_offset
+        while self._get_size(start) > self.max_bytes and \
+                start < self._end_offset:
+            # dropping the text of a style also drops its span, so go no
+            # further than the next span at a time
+            start += self._get_size(start) - self.max_bytes
+            if len(self._spans) > 1:
+                start = min(start, self._spans[1][0])
+            start = min(start, self._end_offset)
+            while len(self._spans) > 1 and self._spans[1][0] <= start:
+                self._spans.popleft()
+        self._drop(start - self._start_offset)
+        # don't keep the remains of a character that was cut in two
+        while self._chunks and \
+                self._chunks[0][self._head_skip] & 0xc0 == 0x80:
+            self._drop(1)
+
+    def _drop(self, nbytes):
+        self._start_offset += nbytes
+        while nbytes:
+            chunk = self._chunks[0]
+            avail = len(chunk) - self._head_skip
+            if nbytes >= avail:
+                self._chunks.popleft()
+                self._head_skip = 0
+                nbytes -= avail
+            else:
+                self._head_skip += nbytes
+                nbytes = 0
+
+    def _read(self, start, end):
+        """Returns the stored bytes from offset start up to end."""
+        pos = start - self._start_offset + self._head_skip
+        length = end - start
+        result = []
+        for chunk in self._chunks:
+            if pos >= len(chunk):
+                pos -= len(chunk)
+                continue
+            piece = chunk[pos:pos + length]
+            result.append(str(piece))
+            length -= len(piece)
+            pos = 0
+            if not length:
+                break
+        return "".join(result)
+
+    def clear(self):
+        """Discards the stored output.  Offsets keep counting from where
+        they were."""
+        self._chunks.clear()
+        self._spans.clear()
+        self._head_skip = 0
+        self._start_offset = self._end_offset
+
+    def get_start_offset(self):
+        """Returns the offset of the oldest byte stored."""
+        return self._start_offset
+
+    def get_end_offset(self):
+        """Returns the offset that the next byte appended will have."""
+        return self._end_offset
+
+    def get_segments(self):
+        """Returns all of the stored output, as a list of (style, text)."""
+        return self.get_segments_since(self._start_offset)
+
+    def get_segments_since(self, offset):
+        """Returns the output appended at or after offset, as a list of
+        (style, text), where text is unicode.  If some of that output has
+        already been dropped, then only what is still stored is returned."""
+        offset = max(offset, self._start_offset)
+        result = []
+        end = self._end_offset
+        for span_offset, style in reversed(self._spans):
+            start = max(span_offset, offset)
+            if start < end:
+                result.append((style,
+                    self._read(start, end).decode("utf-8", "replace")))
+            if span_offset <= offset:
+                break
+            end = span_offset
+        result.reverse()
+        return result
+
+    def __len__(self):
+        """Returns the number of bytes of text stored."""
+        return self._end_offset - self._start_offset
@@ -0,0 +1,216 @@
+"""Timer and I/O scheduling for the Sheriff.
+
+The Sheriff doesn't run an event loop of its own.  It schedules its timers
+through a Scheduler, and the application drives LCM by watching the LCM file
+descriptor with the same Scheduler.  Two implementations are provided: one on
+the GLib main loop, which is what the GTK sheriff uses, and one on an asyncio
+event loop, so that headless sheriffs can run without GLib or be embedded in
+asyncio applications.
+
+example usage:
+\code
+import lcm
+import bot_procman
+from bot_procman.scheduler import make_scheduler
+
+lc = lcm.LCM()
+scheduler = make_scheduler("asyncio")
+sheriff = bot_procman.Sheriff(lc, scheduler)
+scheduler.add_reader(lc, lc.handle)
+scheduler.call_repeatedly(1000, sheriff.send_orders)
+scheduler.run()
+\endcode
+"""
+
+class Scheduler(object):
+    """Interface to an event loop.
+
+    \ingroup python_api
+
+    Times are given in milliseconds.  Callbacks are called with the extra
+    arguments passed when they were scheduled, and their return values are
+    ignored.  Each scheduling method returns a handle whose cancel() method
+    unschedules the callback.
+    """
+    def call_later(self, delay_ms, callback, *args):
+        """Calls callback once, after delay_ms milliseconds."""
+        raise NotImplementedError()
+
+    def call_soon(self, callback, *args):
+        """Calls callback once, the next time the event loop runs."""
+        return self.call_later(0, callback, *args)
+
+    def call_repeatedly(self, interval_ms, callback, *args):
+        """Calls callback every interval_ms milliseconds, until the handle
+        is cancelled."""
+        raise NotImplementedError()
+
+    def add_reader(self, fileobj, callback, *args):
+        """Calls callback whenever fileobj, a file descriptor or an object
+        with a fileno() method such as an LCM instance, is readable."""
+        raise NotImplementedError()
+
+    def run(self):
+        """Runs the event loop until stop() is called."""
+        raise NotImplementedError()
+
+    def stop(self):
+        """Makes run() return."""
+        raise NotImplementedError()
+
+class _GLibSource(object):
+    def __init__(self, gobject):
+        self._gobject = gobject
+        self.source_id = None
+
+    def _fired(self):
+        self.source_id = None
+
+    def cancel(self):
+        if self.source_id is not None:
+            self._gobject.source_remove(self.source_id)
+            self.source_id = None
+
+class GLibScheduler(Scheduler):
+    """Scheduler on the default GLib main context.
+
+    \ingroup python_api
+
+    Sources added here are also dispatched by gtk.main(), so a GTK
+    application doesn't need to call run().
+    """
+    def __init__(self):
+        import gobject
+        self._gobject = gobject
+        self._mainloop = None
+
+    def call_later(self, delay_ms, callback, *args):
+        source = _GLibSource(self._gobject)
+        def on_timeout():
+            source._fired()
+            callback(*args)
+            return False
+        source.source_id = self._gobject.timeout_add(int(delay_ms), on_timeout)
+        return source
+
+    def call_repeatedly(self, interval_ms, callback, *args):
+        source = _GLibSource(self._gobject)
+        def on_timeout():
+            callback(*args)
+            return True
+        source.source_id = self._gobject.timeout_add(int(interval_ms),
+                on_timeout)
+        return source
+
+    def add_reader(self, fileobj, callback, *args):
+        source = _GLibSource(self._gobject)
+        def on_readable(*unused):
+            callback(*args)
+            return True
+        source.source_id = self._gobject.io_add_watch(fileobj,
+                self._gobject.IO_IN, on_readable)
+        return source
+
+    def run(self):
+        self._mainloop = self._gobject.MainLoop()
+        try:
+            self._mainloop.run()
+        finally:
+            self._mainloop = None
+
+    def stop(self):
+        if self._mainloop is not None:
+            self._mainloop.quit()
+
+def _import_asyncio():
+    try:
+        import asyncio
+    except ImportError:
+        # trollius is the asyncio backport for Python 2
+        import trollius as asyncio
+    return asyncio
+
+class _RepeatingCall(object):
+    def __init__(self, loop, interval, callback, args):
+        self._loop = loop
+        self._interval = interval
+        self._callback = callback
+        self._args = args
+        self._handle = loop.call_later(interval, self._run)
+
+    def _run(self):
+        self._handle = self._loop.call_later(self._interval, self._run)
+        self._callback(*self._args)
+
+    def cancel(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+class _Reader(object):
+    def __init__(self, loop, fd):
+        self._loop = loop
+        self._fd = fd
+
+    def cancel(self):
+        if self._fd is not None:
+            self._loop.remove_reader(self._fd)
+            self._fd = None
+
+class AsyncioScheduler(Scheduler):
+    """Scheduler on an asyncio event loop, or on a trollius event loop on
+    Python 2.
+
+    \ingroup python_api
+
+    If loop is None, the current event loop is used.  An application that
+    runs the loop itself doesn't need to call run().
+    """
+    def __init__(self, loop=None):
+        if loop is None:
+            loop = _import_asyncio().get_event_loop()
+        self.loop = loop
+
+    def call_later(self, delay_ms, callback, *args):
+        return self.loop.call_later(delay_ms / 1000.0, callback, *args)
+
+    def call_soon(self, callback, *args):
+        return self.loop.call_soon(callback, *args)
+
+    def call_repeatedly(self, interval_ms, callback, *args):
+        return _RepeatingCall(self.loop, interval_ms / 1000.0, callback, args)
+
+    def add_reader(self, fileobj, callback, *args):
+        if hasattr(fileobj, "fileno"):
+            fd = fileobj.fileno()
+        else:
+            fd = fileobj
+        self.loop.add_reader(fd, callback, *args)
+        return _Reader(self.loop, fd)
+
+    def run(self):
+        self.loop.run_forever()
+
+    def stop(self):
+        self.loop.stop()
+
+## Names accepted by make_scheduler()
+SCHEDULER_NAMES = [ "glib", "asyncio" ]
+
+def make_scheduler(name=None):
+    """Creates a Scheduler by name, "glib" or "asyncio".
+
+    If name is None, an AsyncioScheduler is created if asyncio (or trollius)
+    can be imported, and a GLibScheduler otherwise.
+    """
+    if name is None:
+        try:
+            _import_asyncio()
+            name = "asyncio"
+        except ImportError:
+            name = "glib"
+    if name == "glib":
+        return GLibScheduler()
+    elif name == "asyncio":
+        return AsyncioScheduler()
+    raise ValueError("Unknown scheduler %s" % name)
@@ -8,8 +8,7 @@ import sys
 import time
 import random
 import signal
-
-import gobject
+import struct
 
 import lcm
 from bot_procman.info_t import info_t
@@ -21,7 +20,9 @@ from bot_procman.orders2_t import orders2_t
 from bot_procman.sheriff_cmd2_t import sheriff_cmd2_t
 from bot_procman.deputy_cmd2_t import deputy_cmd2_t
 from bot_procman.discovery_t import discovery_t
+import bot_procman.fast_codec as fast_codec
 import bot_procman.sheriff_config as sheriff_config
+from bot_procman.scheduler import GLibScheduler
 from bot_procman.sheriff_script import SheriffScript
 from bot_procman.signal_slot import Signal
 
@@ -35,6 +36,10 @@ def _warn(text):
 def _now_utime():
     return int(time.time() * 1000000)
 
+def _encode_lcm_string(val):
+    encoded = val.encode('utf-8')
+    return struct.pack('>I', len(encoded) + 1) + encoded + "\0"
+
 ## \addtogroup python_api
 # @{
 
@@ -66,6 +71,11 @@ RESTARTING = "Restarting (Command Sent)"
 
 DEFAULT_STOP_SIGNAL = 2
 DEFAULT_STOP_TIME_ALLOWED = 7
+DEFAULT_ORDERS_KEEPALIVE_INTERVAL = 5
+
+# byte offset of the utime field in encoded orders_t and orders2_t messages,
+# just past the packed fingerprint.
+_ORDERS_UTIME_OFFSET = 8
 
 class SheriffCommandSpec(object):
     """Basic command specification.
@@ -171,13 +181,46 @@ class SheriffDeputyCommand(object):
         # received from a deputy, False if not.
         self.updated_from_info = False
 
+        # Cached encoding of this command as a sheriff_cmd2_t, used to
+        # assemble orders2_t messages.  Reset to None whenever a field that
+        # appears in the orders changes.
+        self._orders2_fragment = None
+
+        # Everything that status() and the comparison with the orders depend
+        # on, as of the last update from the deputy.  If an update leaves this
+        # unchanged, then the update can't change either of them.
+        self._info_fingerprint = None
+
+        # Whether the deputy's last report for this command agreed with the
+        # orders for it, or None if not known.
+        self._info_matches_orders = None
+
+    def _orders_changed(self):
+        self._orders2_fragment = None
+        self._info_matches_orders = None
+
+    def _make_info_fingerprint(self, cmd_msg):
+        # includes the command as reported by the deputy, which is compared
+        # against the orders, so that the deputy catching up with a modified
+        # command is noticed.
+        reported_cmd = cmd_msg.cmd
+        return (cmd_msg.pid, cmd_msg.actual_runid, cmd_msg.exit_code,
+                self.desired_runid, self.force_quit, self.auto_respawn,
+                self.scheduled_for_removal,
+                reported_cmd.exec_str, reported_cmd.command_name,
+                reported_cmd.group, reported_cmd.auto_respawn,
+                reported_cmd.stop_signal, reported_cmd.stop_time_allowed)
+
+    def _update_usage_from_cmd_info2(self, cmd_msg):
+        self.cpu_usage = cmd_msg.cpu_usage
+        self.mem_vsize_bytes = cmd_msg.mem_vsize_bytes
+        self.mem_rss_bytes = cmd_msg.mem_rss_bytes
+
     def _update_from_cmd_info2(self, cmd_msg):
         self.pid = cmd_msg.pid
         self.actual_runid = cmd_msg.actual_runid
         self.exit_code = cmd_msg.exit_code
-        self.cpu_usage = cmd_msg.cpu_usage
-        self.mem_vsize_bytes = cmd_msg.mem_vsize_bytes
-        self.mem_rss_bytes = cmd_msg.mem_rss_bytes
+        self._update_usage_from_cmd_info2(cmd_msg)
         self.updated_from_info = True
 
         # if the command has run to completion and we don't need it to respawn,
@@ -187,9 +230,13 @@ class SheriffDeputyCommand(object):
             not self.auto_respawn and \
             not self.force_quit:
                 self.force_quit = 1
+                self._orders_changed()
+
+        self._info_fingerprint = self._make_info_fingerprint(cmd_msg)
 
     def _update_from_cmd_order2(self, cmd_msg):
         assert self.sheriff_id == cmd_msg.sheriff_id
+        self._orders_changed()
         self.exec_str = cmd_msg.cmd.exec_str
         self.command_id = cmd_msg.cmd.command_name
         self.group = cmd_msg.cmd.group
@@ -200,6 +247,7 @@ class SheriffDeputyCommand(object):
 
     def _set_group(self, group):
         self.group = group
+        self._orders_changed()
 
     def _start(self):
         # if the command is already running, then ignore
@@ -210,15 +258,41 @@ class SheriffDeputyCommand(object):
         if self.desired_runid > (2 << 31):
             self.desired_runid = 1
         self.force_quit = 0
+        self._orders_changed()
 
     def _restart(self):
         self.desired_runid += 1
         if self.desired_runid > (2 << 31):
             self.desired_runid = 1
         self.force_quit = 0
+        self._orders_changed()
 
     def _stop(self):
         self.force_quit = 1
+        self._orders_changed()
+
+    def _make_sheriff_cmd2_message(self):
+        cmd_msg = sheriff_cmd2_t()
+        cmd_msg.cmd = command2_t()
+        cmd_msg.cmd.exec_str = self.exec_str
+        cmd_msg.cmd.command_name = self.command_id
+        cmd_msg.cmd.group = self.group
+        cmd_msg.cmd.auto_respawn = self.auto_respawn
+        cmd_msg.cmd.stop_signal = self.stop_signal
+        cmd_msg.cmd.stop_time_allowed = self.stop_time_allowed
+        cmd_msg.cmd.num_options = 0
+        cmd_msg.cmd.option_names = []
+        cmd_msg.cmd.option_values = []
+        cmd_msg.sheriff_id = self.sheriff_id
+        cmd_msg.desired_runid = self.desired_runid
+        cmd_msg.force_quit = self.force_quit
+        return cmd_msg
+
+    def _get_orders2_fragment(self):
+        if self._orders2_fragment is None:
+            self._orders2_fragment = fast_codec.encode_one(
+                    self._make_sheriff_cmd2_message())
+        return self._orders2_fragment
 
     def status(self):
         """Retrieve the status of the command, as understood by the
@@ -272,12 +346,145 @@ class SheriffDeputyCommand(object):
    mem_rss:      %(mem_rss_bytes)d
    actual_runid: %(actual_runid)d""" % self.__dict__
 
+def _split_group_name(group_name):
+    return group_name.split("/")
+
+class _GroupTrieNode(object):
+    __slots__ = [ "children", "commands" ]
+
+    def __init__(self):
+        # group name component -> _GroupTrieNode
+        self.children = {}
+
+        # commands whose group path ends at this node
+        self.commands = set()
+
+class _SheriffCommandIndex(object):
+    """Lookup tables over the commands of all deputies managed by a Sheriff.
+
+    The index is updated by SheriffDeputy and Sheriff whenever a command is
+    added or removed, or when its sheriff id, command id, or group changes.
+    """
+    def __init__(self):
+        # sheriff_id -> (SheriffDeputy, SheriffDeputyCommand)
+        self._by_sheriff_id = {}
+
+        # command_id -> set of SheriffDeputyCommand
+        self._by_command_id = {}
+
+        # trie of group name components.  Each node holds the commands whose
+        # group is exactly the path from the root to that node.
+        self._group_root = _GroupTrieNode()
+
+    def add(self, deputy, cmd):
+        existing = self._by_sheriff_id.get(cmd.sheriff_id)
+        if existing is not None:
+            self.remove(existing[1])
+        self._by_sheriff_id[cmd.sheriff_id] = (deputy, cmd)
+        self._by_command_id.setdefault(cmd.command_id, set()).add(cmd)
+        self._group_add(cmd, cmd.group)
+
+    def remove(self, cmd):
+        existing = self._by_sheriff_id.get(cmd.sheriff_id)
+        if existing is None or existing[1] is not cmd:
+            return
+        del self._by_sheriff_id[cmd.sheriff_id]
+        self._command_id_remove(cmd, cmd.command_id)
+        self._group_remove(cmd, cmd.group)
+
+    def remove_deputy(self, deputy):
+        for cmd in deputy._commands.values():
+            self.remove(cmd)
+
+    def get(self, sheriff_id):
+        """Returns a (deputy, cmd) tuple, or None if the sheriff id is not
+        in use."""
+        return self._by_sheriff_id.get(sheriff_id)
+
+    def has_sheriff_id(self, sheriff_id):
+        return sheriff_id in self._by_sheriff_id
+
+    def commands_with_id(self, command_id):
+        return list(self._by_command_id.get(command_id, ()))
+
+    def commands_in_group(self, group_name):
+        node = self._group_root
+        for part in _split_group_name(group_name):
+            node = node.children.get(part)
+            if node is None:
+                return []
+        result = []
+        to_visit = [ node ]
+        while to_visit:
+            node = to_visit.pop()
+            result.extend(node.commands)
+            to_visit.extend(node.children.values())
+        return result
+
+    def sheriff_id_changed(self, cmd, old_sheriff_id):
+        existing = self._by_sheriff_id.get(old_sheriff_id)
+        if existing is None or existing[1] is not cmd:
+            return
+        del self._by_sheriff_id[old_sheriff_id]
+        self._by_sheriff_id[cmd.sheriff_id] = existing
+
+    def command_id_changed(self, cmd, old_command_id):
+        if not self._is_indexed(cmd) or old_command_id == cmd.command_id:
+            return
+        self._command_id_remove(cmd, old_command_id)
+        self._by_command_id.setdefault(cmd.command_id, set()).add(cmd)
+
+    def group_changed(self, cmd, old_group):
+        if not self._is_indexed(cmd) or old_group == cmd.group:
+            return
+        self._group_remove(cmd, old_group)
+        self._group_add(cmd, cmd.group)
+
+    def _is_indexed(self, cmd):
+        existing = self._by_sheriff_id.get(cmd.sheriff_id)
+        return existing is not None and existing[1] is cmd
+
+    def _command_id_remove(self, cmd, command_id):
+        cmds = self._by_command_id.get(command_id)
+        if cmds is None:
+            return
+        cmds.discard(cmd)
+        if not cmds:
+            del self._by_command_id[command_id]
+
+    def _group_add(self, cmd, group):
+        node = self._group_root
+        for part in _split_group_name(group):
+            child = node.children.get(part)
+            if child is None:
+                child = _GroupTrieNode()
+                node.children[part] = child
+            node = child
+        node.commands.add(cmd)
+
+    def _group_remove(self, cmd, group):
+        path = [ (None, self._group_root) ]
+        node = self._group_root
+        for part in _split_group_name(group):
+            node = node.children.get(part)
+            if node is None:
+                return
+            path.append((part, node))
+        node.commands.discard(cmd)
+
+        # prune trie nodes that no longer lead to any commands
+        for i in range(len(path) - 1, 0, -1):
+            part, node = path[i]
+            if node.commands or node.children:
+                break
+            del path[i - 1][1].children[part]
+
 class SheriffDeputy(object):
     """%Sheriff view of a deputy
 
     \ingroup python_api
     """
-    def __init__(self, name):
+    def __init__(self, name, command_index=None):
         """Initializes a deputy with the specified name.  Do not use this
         constructor directly.  Instead, get a list of deputies from the
         Sheriff.
@@ -307,6 +514,25 @@ class SheriffDeputy(object):
         # Dictionary of commands owned by the deputy
         self._commands = {}
 
+        # Sheriff-wide command index, updated as commands are added, removed,
+        # and modified.
+        self._command_index = command_index
+        if self._command_index is None:
+            self._command_index = _SheriffCommandIndex()
+
+        # Most recently encoded orders message for the deputy, along with the
+        # orders version it was encoded for.  The encoded message is reused
+        # until a command owned by the deputy changes.
+        self._orders_data = None
+        self._orders_data_version = None
+        self._orders_dirty = True
+
+        # Time that orders were last transmitted to the deputy.
+        self._last_orders_utime = 0
+
+        # True if the deputy's last reported state disagrees with the orders
+        # that the sheriff has for it.
+        self._orders_diverged = True
 
     def get_commands(self):
         """Retrieve a list of all commands managed by the deputy
@@ -330,10 +556,23 @@ class SheriffDeputy(object):
         @dep_info_msg: an instance of bot_procman.info2_t
         """
         status_changes = []
+        num_matching_orders = 0
+        reported_ids = set()
         for cmd_msg in dep_info_msg.cmds:
+            reported_ids.add(cmd_msg.sheriff_id)
+
             # look up the command, or create a new one if it's not found
-            if cmd_msg.sheriff_id in self._commands:
-                cmd = self._commands[cmd_msg.sheriff_id]
+            cmd = self._commands.get(cmd_msg.sheriff_id)
+            if cmd is not None:
+                if cmd._info_matches_orders is not None and \
+                        cmd._info_fingerprint == \
+                        cmd._make_info_fingerprint(cmd_msg):
+                    # nothing that affects the command status or its orders
+                    # has changed.  Only the resource usage needs updating.
+                    cmd._update_usage_from_cmd_info2(cmd_msg)
+                    if cmd._info_matches_orders:
+                        num_matching_orders += 1
+                    continue
                 old_status = cmd.status()
             else:
                 cmd = SheriffDeputyCommand()
@@ -349,23 +588,39 @@ class SheriffDeputy(object):
                 self._add_command(cmd)
                 old_status = None
 
+            old_force_quit = cmd.force_quit
             cmd._update_from_cmd_info2(cmd_msg)
+            if cmd.force_quit != old_force_quit:
+                self._command_changed(cmd)
             new_status = cmd.status()
 
             if old_status != new_status:
                 status_changes.append((cmd, old_status, new_status))
 
-        updated_ids = [ cmd_msg.sheriff_id for cmd_msg in dep_info_msg.cmds ]
-
-        can_safely_remove = [ cmd for cmd in self._commands.values() \
-                if cmd.scheduled_for_removal and \
-                cmd.sheriff_id not in updated_ids ]
-
-        for toremove in can_safely_remove:
-            cmd = self._commands[toremove.sheriff_id]
+            cmd._info_matches_orders = \
+                    self._cmd_info_matches_orders(cmd, cmd_msg)
+            if cmd._info_matches_orders:
+                num_matching_orders += 1
+
+        can_safely_remove = []
+        num_ordered = 0
+        for cmd in self._commands.itervalues():
+            if not cmd.scheduled_for_removal:
+                num_ordered += 1
+            elif cmd.sheriff_id not in reported_ids:
+                can_safely_remove.append(cmd)
+
+        # the deputy is in agreement with the orders if every command it
+        # reports is a command it's been ordered to manage, and it reports
+        # every such command.
+        self._orders_diverged = \
+                num_matching_orders != len(dep_info_msg.cmds) or \
+                num_matching_orders != num_ordered
+
+        for cmd in can_safely_remove:
             old_status = cmd.status()
             status_changes.append((cmd, old_status, None))
-            del self._commands[toremove.sheriff_id]
+            self._remove_command(cmd)
 
         self.last_update_utime = _now_utime()
         self.cpu_load = dep_info_msg.cpu_load
@@ -373,7 +628,26 @@ class SheriffDeputy(object):
         self.phys_mem_free_bytes = dep_info_msg.phys_mem_free_bytes
         return status_changes
 
+    def _cmd_info_matches_orders(self, cmd, cmd_msg):
+        if cmd.scheduled_for_removal:
+            return False
+        if cmd.exec_str != cmd_msg.cmd.exec_str or \
+                cmd.command_id != cmd_msg.cmd.command_name or \
+                cmd.group != cmd_msg.cmd.group or \
+                bool(cmd.auto_respawn) != bool(cmd_msg.cmd.auto_respawn):
+            return False
+        # orders_t doesn't carry the stop signal or stop time allowed
+        if self._orders_version != 1 and \
+                (cmd.stop_signal != cmd_msg.cmd.stop_signal or \
+                cmd.stop_time_allowed != cmd_msg.cmd.stop_time_allowed):
+            return False
+        if cmd.force_quit:
+            return cmd_msg.pid <= 0
+        return cmd_msg.actual_runid == cmd.desired_runid
+
     def _update_from_deputy_orders2(self, orders_msg):
+        # orders from another sheriff supersede any cached orders
+        self._orders_dirty = True
         status_changes = []
         for cmd_msg in orders_msg.cmds:
             if cmd_msg.sheriff_id in self._commands:
@@ -391,7 +665,11 @@ class SheriffDeputy(object):
                 cmd.desired_runid = cmd_msg.desired_runid
                 self._add_command(cmd)
                 old_status = None
+            old_command_id = cmd.command_id
+            old_group = cmd.group
             cmd._update_from_cmd_order2(cmd_msg)
+            self._command_index.command_id_changed(cmd, old_command_id)
+            self._command_index.group_changed(cmd, old_group)
             new_status = cmd.status()
             if old_status != new_status:
                 status_changes.append((cmd, old_status, new_status))
@@ -409,14 +687,34 @@ class SheriffDeputy(object):
         assert newcmd.sheriff_id != 0
         assert isinstance(newcmd, SheriffDeputyCommand)
         self._commands[newcmd.sheriff_id] = newcmd
+        self._command_index.add(self, newcmd)
+        self._orders_dirty = True
+
+    def _remove_command(self, cmd):
+        del self._commands[cmd.sheriff_id]
+        self._command_index.remove(cmd)
+        self._orders_dirty = True
+
+    def _change_command_sheriff_id(self, cmd, new_sheriff_id):
+        old_sheriff_id = cmd.sheriff_id
+        del self._commands[old_sheriff_id]
+        cmd.sheriff_id = new_sheriff_id
+        self._commands[new_sheriff_id] = cmd
+        self._command_index.sheriff_id_changed(cmd, old_sheriff_id)
+        self._command_changed(cmd)
+
+    def _command_changed(self, cmd):
+        cmd._orders_changed()
+        self._orders_dirty = True
 
     def _schedule_for_removal(self, cmd):
         if not self.owns_command(cmd):
             raise KeyError("invalid command")
         old_status = cmd.status()
         cmd.scheduled_for_removal = True
+        self._orders_dirty = True
         if not self.last_update_utime:
-            del self._commands[cmd.sheriff_id]
+            self._remove_command(cmd)
             new_status = None
         else:
             new_status = cmd.status()
@@ -456,57 +754,278 @@ class SheriffDeputy(object):
             if cmd.scheduled_for_removal:
                 msg.ncmds -= 1
                 continue
-            cmd_msg = sheriff_cmd2_t()
-            cmd_msg.cmd = command2_t()
-            cmd_msg.cmd.exec_str = cmd.exec_str
-            cmd_msg.cmd.command_name = cmd.command_id
-            cmd_msg.cmd.group = cmd.group
-            cmd_msg.cmd.auto_respawn = cmd.auto_respawn
-            cmd_msg.cmd.stop_signal = cmd.stop_signal
-            cmd_msg.cmd.stop_time_allowed = cmd.stop_time_allowed
-            cmd_msg.cmd.num_options = 0
-            cmd_msg.cmd.option_names = []
-            cmd_msg.cmd.option_values = []
-            cmd_msg.sheriff_id = cmd.sheriff_id
-            cmd_msg.desired_runid = cmd.desired_runid
-            cmd_msg.force_quit = cmd.force_quit
-            msg.cmds.append(cmd_msg)
+            msg.cmds.append(cmd._make_sheriff_cmd2_message())
         msg.num_options = 0
         msg.option_names = []
         msg.option_values = []
         return msg
 
+    def _encode_orders2_message(self, sheriff_name):
+        """Encodes an orders2_t message equivalent to
+        _make_orders2_message(sheriff_name).encode(), but assembled from the
+        cached per-command encodings so that only commands that changed since
+        the last call are re-encoded.  The utime field is set to zero."""
+        fragments = [ cmd._get_orders2_fragment() \
+                for cmd in self._commands.values() \
+                if not cmd.scheduled_for_removal ]
+        return "".join([ orders2_t._get_packed_fingerprint(),
+            struct.pack(">q", 0),
+            _encode_lcm_string(self.name),
+            _encode_lcm_string(sheriff_name),
+            struct.pack(">i", len(fragments)) ] +
+            fragments +
+            [ struct.pack(">i", 0) ])
+
+    def _needs_orders(self, now, keepalive_interval_usec):
+        return self._orders_dirty or self._orders_diverged or \
+                self._orders_data_version != self._orders_version or \
+                now - self._last_orders_utime >= keepalive_interval_usec
+
+    def _get_encoded_orders(self, sheriff_name, now):
+        """Returns the encoded orders message for the deputy, stamped with
+        \p now.  The message is only rebuilt if a command owned by the deputy
+        has changed since the last call."""
+        if self._orders_dirty or self._orders_data is None or \
+                self._orders_data_version != self._orders_version:
+            if self._orders_version == 1:
+                msg = self._make_orders_message(sheriff_name)
+                self._orders_data = msg.encode()
+            else:
+                self._orders_data = self._encode_orders2_message(sheriff_name)
+            self._orders_data_version = self._orders_version
+            self._orders_dirty = False
+        data = self._orders_data
+        return data[:_ORDERS_UTIME_OFFSET] + struct.pack(">q", now) + \
+                data[_ORDERS_UTIME_OFFSET + 8:]
+
+class _SequenceExecution(object):
+    """Executes a list of script actions one after the other."""
+    def __init__(self, context, actions, on_done):
+        self.context = context
+        self.actions = actions
+        self.on_done = on_done
+        self.index = -1
+
+    def start(self):
+        self._execute_next()
+
+    def _execute_next(self):
+        self.index += 1
+        if self.index >= len(self.actions):
+            self.on_done()
+            return
+        self.context.execute_action(self.actions[self.index],
+                self._execute_next)
+
+class _ParallelExecution(object):
+    """Executes the actions of a parallel block, each one as soon as the
+    actions that it depends on have finished."""
+    def __init__(self, context, actions, on_done):
+        self.context = context
+        self.pending = list(actions)
+        self.num_running = 0
+        self.finished_labels = set()
+        self.on_done = on_done
+
+    def start(self):
+        self._execute_ready()
+
+    def _execute_ready(self):
+        ready = [ action for action in self.pending \
+                if not [ label for label in action.after \
+                    if label not in self.finished_labels ] ]
+        for action in ready:
+            self.pending.remove(action)
+        self.num_running += len(ready)
+        for action in ready:
+            self.context.execute_action(action,
+                    lambda action=action: self._action_done(action))
+        # dependencies are checked before the script runs, so nothing can be
+        # left pending once everything else is done.
+        if not self.num_running:
+            self.on_done()
+
+    def _action_done(self, action):
+        self.num_running -= 1
+        if action.label is not None:
+            self.finished_labels.add(action.label)
+        self._execute_ready()
+
+class _StatusWait(object):
+    """Commands that a script action is waiting on to reach a status.
+
+    outstanding holds the commands that haven't reached it yet, and is kept
+    up to date from status changes, so that the wait is over as soon as it
+    becomes empty.
+    """
+    def __init__(self, action, cmds, on_done):
+        if action.wait_status == "running":
+            self.acceptable_statuses = frozenset([ RUNNING ])
+        elif action.wait_status == "stopped":
+            self.acceptable_statuses = frozenset([ STOPPED_OK, STOPPED_ERROR ])
+        else:
+            raise ValueError("Invalid desired status %s" % action.wait_status)
+        self.action = action
+        self.cmds = set(cmds)
+        self.on_done = on_done
+        self.timer = None
+        self.outstanding = set()
+        self.recount()
+
+    def recount(self):
+        self.outstanding = set([ cmd for cmd in self.cmds \
+                if cmd.status() not in self.acceptable_statuses ])
+
+    def update(self, cmd, new_status):
+        if new_status is None:
+            # the command was removed, and will never reach the status
+            self.cmds.discard(cmd)
+            self.outstanding.discard(cmd)
+        elif new_status in self.acceptable_statuses:
+            self.outstanding.discard(cmd)
+        else:
+            self.outstanding.add(cmd)
+
 class ScriptExecutionContext(object):
+    """State of a script that the sheriff is executing.
+
+    Actions are executed by execute_action(), which calls an on_done
+    callback when the action has finished.  on_done is always called from the
+    scheduler rather than from execute_action(), so that a script never
+    recurses into itself.  Parallel blocks can have several actions running
+    at once.
+    """
     def __init__(self, sheriff, script):
         assert(script is not None)
         self.script = script
-        self.current_action = -1
-        self.subscript_context = None
         self.sheriff = sheriff
-
-    def get_next_action(self):
-        if self.subscript_context:
-            # if we're recursing into a called script, return its next action
-            action = self.subscript_context.get_next_action()
-            if action:
-                return action
-            else:
-                # unless it's done, in which case fall through to our next
-                # action
-                self.subscript_context = None
-        self.current_action += 1
-        if self.current_action >= len(self.script.actions):
-            # no more actions
-            return None
-        action = self.script.actions[self.current_action]
+        self.active = True
+        # for each command that pending waits are on, the list of those waits
+        self.waits_by_command = {}
+        self._timers = set()
+
+    def start(self):
+        _SequenceExecution(self, self.script.actions, self._finished).start()
+
+    def _finished(self):
+        if self.active:
+            self.sheriff._finish_script_execution()
+
+    def call_later(self, delay_ms, callback):
+        """Calls callback after delay_ms, unless the script is stopped
+        first."""
+        def on_timeout():
+            self._timers.discard(handle)
+            if self.active:
+                callback()
+        handle = self.sheriff._scheduler.call_later(delay_ms, on_timeout)
+        self._timers.add(handle)
+        return handle
+
+    def cancel_timer(self, handle):
+        if handle in self._timers:
+            self._timers.discard(handle)
+            handle.cancel()
+
+    def add_wait(self, wait):
+        if not wait.outstanding:
+            self.call_later(0, wait.on_done)
+            return
+        for cmd in wait.cmds:
+            self.waits_by_command.setdefault(cmd, []).append(wait)
+        if wait.action.timeout_ms is not None:
+            wait.timer = self.call_later(wait.action.timeout_ms,
+                    lambda: self._wait_timed_out(wait))
+
+    def _remove_wait(self, wait):
+        for cmd in wait.cmds:
+            waits = self.waits_by_command.get(cmd)
+            if waits is None:
+                continue
+            waits.remove(wait)
+            if not waits:
+                del self.waits_by_command[cmd]
+        if wait.timer is not None:
+            self.cancel_timer(wait.timer)
+            wait.timer = None
+
+    def update_waits(self, cmd, new_status):
+        """Updates the waits on cmd after its status changes to new_status,
+        or None if it was removed, and finishes the waits that are over."""
+        waits = self.waits_by_command.get(cmd)
+        if not waits:
+            return
+        if new_status is None:
+            del self.waits_by_command[cmd]
+        for wait in waits[:]:
+            wait.update(cmd, new_status)
+            if wait.outstanding:
+                continue
+            # the commands' statuses can also change without the sheriff
+            # noticing, so make sure before moving on.
+            wait.recount()
+            if wait.outstanding:
+                continue
+            self._remove_wait(wait)
+            self.call_later(0, wait.on_done)
+
+    def _wait_timed_out(self, wait):
+        wait.timer = None
+        self._remove_wait(wait)
+        self.sheriff.script_action_timed_out(self.script, wait.action)
+        if self.active:
+            self.sheriff._finish_script_execution()
+
+    def stop(self):
+        self.active = False
+        self.waits_by_command = {}
+        for handle in self._timers:
+            handle.cancel()
+        self._timers.clear()
+
+    def execute_action(self, action, on_done):
+        if not self.active:
+            return
+        sheriff = self.sheriff
 
         if action.action_type == "run_script":
-            subscript = self.sheriff.get_script(action.script_name)
-            self.subscript_context = ScriptExecutionContext(self.sheriff,
-                    subscript)
-            return self.get_next_action()
+            subscript = sheriff.get_script(action.script_name)
+            _SequenceExecution(self, subscript.actions,
+                    lambda: self.call_later(0, on_done)).start()
+            return
+        if action.action_type == "parallel":
+            _ParallelExecution(self, action.actions,
+                    lambda: self.call_later(0, on_done)).start()
+            return
+
+        sheriff.script_action_executing(self.script, action)
+
+        # fixed time wait -- just set a timer
+        if action.action_type == "wait_ms":
+            self.call_later(action.delay_ms, on_done)
+            return
+
+        # find the commands that we're operating on
+        cmds = sheriff._get_action_commands(action.ident_type, action.ident)
+
+        # execute an immediate action if applicable
+        if action.action_type == "start":
+            for cmd in cmds:
+                sheriff.start_command(cmd)
+        elif action.action_type == "stop":
+            for cmd in cmds:
+                sheriff.stop_command(cmd)
+        elif action.action_type == "restart":
+            for cmd in cmds:
+                sheriff.restart_command(cmd)
+
+        # do we need to wait for the commands to achieve a desired status?
+        if action.wait_status:
+            # yes
+            self.add_wait(_StatusWait(action, cmds, on_done))
         else:
-            return action
+            # no.  Just move on
+            self.call_later(0, on_done)
 
 class Sheriff(object):
     """Controls deputies and processes.
@@ -514,22 +1033,24 @@ class Sheriff(object):
     \ingroup python_api
 
     The Sheriff class provides the primary interface for controlling processes
-    using the Procman Python API.  It requires a GLib event loop to run.
+    using the Procman Python API.  It schedules its timers through a
+    [Scheduler](\ref bot_procman.scheduler.Scheduler), which runs on a GLib
+    event loop unless another one is given.
 
     example usage:
     \code
     import bot_procman
-    import gobject
+    from bot_procman.scheduler import GLibScheduler
 
     lc = lcm.LCM()
-    sheriff = bot_procman.Sheriff(lc)
+    scheduler = GLibScheduler()
+    sheriff = bot_procman.Sheriff(lc, scheduler)
 
     # add commands or load a config file
 
-    mainloop = gobject.MainLoop()
-    gobject.io_add_watch(lc, gobject.IO_IN, lambda *s: lc.handle() or True)
-    gobject.timeout_add(1000, lambda *s: sheriff.send_orders() or True)
-    mainloop.run()
+    scheduler.add_reader(lc, lc.handle)
+    scheduler.call_repeatedly(1000, sheriff.send_orders)
+    scheduler.run()
     \endcode
 
     ## Signals ##
@@ -548,30 +1069,35 @@ class Sheriff(object):
     \endcode
     """
 
-    def __init__ (self, lcm_obj = None):
+    def __init__ (self, lcm_obj = None, scheduler = None):
         """Initialize a new Sheriff object.
 
         \param lcm_obj the LCM object to use for communication.  If None, then
         the sheriff creates a new lcm.LCM() instance.
+        \param scheduler the bot_procman.scheduler.Scheduler used for the
+        sheriff's timers.  If None, then a GLibScheduler is used.
         """
         self._lcm = lcm_obj
         if self._lcm is None:
             self._lcm = lcm.LCM()
+        self._scheduler = scheduler
+        if self._scheduler is None:
+            self._scheduler = GLibScheduler()
         self._lcm.subscribe("PMD_INFO", self._on_pmd_info)
         self._lcm.subscribe("PMD_INFO2", self._on_pmd_info2)
         self._lcm.subscribe("PMD_ORDERS", self._on_pmd_orders)
         self._lcm.subscribe("PMD_ORDERS2", self._on_pmd_orders2)
         self._deputies = {}
+        self._command_index = _SheriffCommandIndex()
         self._is_observer = False
+        self._delta_orders = False
+        self._orders_keepalive_usec = DEFAULT_ORDERS_KEEPALIVE_INTERVAL * 1000000
         self._name = platform.node() + ":" + str(os.getpid()) + \
                 ":" + str(_now_utime())
 
         # variables for scripts
         self._scripts = []
         self._active_script_context = None
-        self._waiting_on_commands = []
-        self._waiting_for_status = None
-        self._last_script_action_time = None
 
         # publish a discovery message to query for existing deputies
         discover_msg = discovery_t()
@@ -620,6 +1146,14 @@ class Sheriff(object):
         # \param cmd_object the command whose group changes.
         self.command_group_changed = Signal()
 
+        ## [Signal](\ref bot_procman.signal_slot.Signal) emitted when the
+        # executable, command id, auto-respawn setting, stop signal or stop
+        # time allowed of a command is changed through the sheriff.
+        # `command_changed(cmd_object)`
+        #
+        # \param cmd_object the command that was changed.
+        self.command_changed = Signal()
+
         ## [Signal](\ref bot_procman.signal_slot.Signal) emitted when a script
         # is added.
         #
@@ -650,6 +1184,16 @@ class Sheriff(object):
         # [RunScriptAction](\ref bot_procman.sheriff_script.RunScriptAction)
         self.script_action_executing = Signal()
 
+        ## [Signal](\ref bot_procman.signal_slot.Signal) emitted when an
+        # action in a script times out waiting for commands to reach a status.
+        # The script is then aborted.
+        # `script_action_timed_out(script_object, action)`
+        #
+        # \param script_object a [SheriffScript](\ref bot_procman.sheriff_script.SheriffScript) object
+        # \param action the [StartStopRestartAction](\ref bot_procman.sheriff_script.StartStopRestartAction)
+        # or [WaitStatusAction](\ref bot_procman.sheriff_script.WaitStatusAction) that timed out.
+        self.script_action_timed_out = Signal()
+
         ## [Signal](\ref bot_procman.signal_slot.Signal) emitted when a script
         # finishes execution.
         # `script_finished(script_object)`
@@ -659,7 +1203,8 @@ class Sheriff(object):
 
     def _get_or_make_deputy(self, deputy_name):
         if deputy_name not in self._deputies:
-            self._deputies[deputy_name] = SheriffDeputy(deputy_name)
+            self._deputies[deputy_name] = SheriffDeputy(deputy_name,
+                    self._command_index)
         return self._deputies[deputy_name]
 
     def _maybe_emit_status_change_signals(self, deputy, status_changes):
@@ -668,17 +1213,19 @@ class Sheriff(object):
                 continue
             if old_status is None:
                 self.command_added(deputy, cmd)
-            elif new_status is None:
+                continue
+            if self._active_script_context is not None:
+                self._active_script_context.update_waits(cmd, new_status)
+            if new_status is None:
                 self.command_removed(deputy, cmd)
             else:
-                self._check_wait_action_status()
                 self.command_status_changed(cmd, old_status, new_status)
 
     def _get_command_deputy(self, cmd):
-        for deputy in self._deputies.values():
-            if deputy.owns_command(cmd):
-                return deputy
-        raise KeyError()
+        entry = self._command_index.get(cmd.sheriff_id)
+        if entry is None or entry[1] is not cmd:
+            raise KeyError()
+        return entry[0]
 
     def _handle_info2_t(self, info_msg, version):
         now = _now_utime()
@@ -708,21 +1255,14 @@ class Sheriff(object):
                               cmd.auto_respawn == cmd_msg.cmd.auto_respawn
                     if not matched:
                         continue
-                    collision = False
-                    for other_deputy in self._deputies.values():
-                        if other_deputy._commands.get(cmd_msg.sheriff_id, cmd) \
-                                is not cmd:
-                            collision = True
-                            break
-                    if collision:
+                    entry = self._command_index.get(cmd_msg.sheriff_id)
+                    if entry is not None and entry[1] is not cmd:
                         continue
                     # found a command managed by the deputy that looks
                     # exactly like the command the sheriff wants the
                     # deputy to run.  Reassign the sheriff ID to match
                     # what the deputy is reporting.
-                    del deputy._commands[cmd.sheriff_id]
-                    cmd.sheriff_id = cmd_msg.sheriff_id
-                    deputy._commands[cmd.sheriff_id] = cmd
+                    deputy._change_command_sheriff_id(cmd, cmd_msg.sheriff_id)
                     _dbg("Merging command [%s] with command reported by deputy" \
                             % cmd.command_id)
                     break
@@ -736,7 +1276,7 @@ class Sheriff(object):
 
     def _on_pmd_info2(self, _, data):
         try:
-            info_msg = info2_t.decode(data)
+            info_msg = fast_codec.decode(info2_t, data)
         except ValueError:
             print("invalid info2_t message")
             return
@@ -744,7 +1284,7 @@ class Sheriff(object):
 
     def _on_pmd_info(self, _, data):
         try:
-            dep_info = info_t.decode(data)
+            dep_info = fast_codec.decode(info_t, data)
         except ValueError:
             print("invalid info_t message")
             return
@@ -794,11 +1334,11 @@ class Sheriff(object):
         self._maybe_emit_status_change_signals(deputy, status_changes)
 
     def _on_pmd_orders2(self, _, data):
-        orders_msg = orders2_t.decode(data)
+        orders_msg = fast_codec.decode(orders2_t, data)
         self._handle_orders2_t(orders_msg)
 
     def _on_pmd_orders(self, _, data):
-        dep_orders = orders_t.decode(data)
+        dep_orders = fast_codec.decode(orders_t, data)
 
         new_orders = orders2_t()
         new_orders.utime = dep_orders.utime
@@ -831,11 +1371,7 @@ class Sheriff(object):
         id_to_try = random.randint(0, (1 << 31) - 1)
 
         for _ in range(1 << 16):
-            collision = False
-            for deputy in self._deputies.values():
-                if id_to_try in deputy._commands:
-                    collision = True
-                    break
+            collision = self._command_index.has_sheriff_id(id_to_try)
 
             if not collision:
                 result = id_to_try
@@ -865,17 +1401,47 @@ class Sheriff(object):
         """
         if self._is_observer:
             raise ValueError("Can't send orders in Observer mode")
+        now = _now_utime()
         for deputy in self._deputies.values():
             # only send orders to a deputy if we've heard from it.
-            if deputy.last_update_utime > 0:
+            if deputy.last_update_utime <= 0:
+                continue
 
-                version = deputy._orders_version
-                if version == 1:
-                    msg = deputy._make_orders_message(self._name)
-                    self._lcm.publish("PMD_ORDERS", msg.encode())
-                else:
-                    msg = deputy._make_orders2_message(self._name)
-                    self._lcm.publish("PMD_ORDERS2", msg.encode())
+            # in delta mode, skip deputies that are already carrying out
+            # the current orders.
+            if self._delta_orders and \
+                    not deputy._needs_orders(now, self._orders_keepalive_usec):
+                continue
+
+            data = deputy._get_encoded_orders(self._name, now)
+            deputy._last_orders_utime = now
+            if deputy._orders_version == 1:
+                self._lcm.publish("PMD_ORDERS", data)
+            else:
+                self._lcm.publish("PMD_ORDERS2", data)
+
+    def set_delta_orders(self, enabled,
+            keepalive_interval=DEFAULT_ORDERS_KEEPALIVE_INTERVAL):
+        """Enable or disable delta orders mode.
+
+        In delta mode, send_orders() only transmits orders to a deputy if one
+        of its commands has changed, if the deputy's last reported state
+        disagrees with the orders, or if \p keepalive_interval seconds have
+        passed since orders were last sent to it.  Otherwise, orders are sent
+        to every deputy on each call to send_orders().
+
+        @param enabled True to enable delta orders mode, False to disable it.
+        @param keepalive_interval maximum time (seconds) between orders
+        transmissions to a deputy in delta mode.
+        """
+        self._delta_orders = enabled
+        self._orders_keepalive_usec = int(keepalive_interval * 1000000)
+
+    def _mark_orders_dirty(self, cmd):
+        cmd._orders_changed()
+        entry = self._command_index.get(cmd.sheriff_id)
+        if entry is not None:
+            entry[0]._orders_dirty = True
 
     def add_command(self, spec):
         """Add a new command.
@@ -924,6 +1490,7 @@ class Sheriff(object):
         cmd._start()
         new_status = cmd.status()
         deputy = self.get_command_deputy(cmd)
+        deputy._orders_dirty = True
         self._maybe_emit_status_change_signals(deputy,
                 ((cmd, old_status, new_status),))
         self.send_orders()
@@ -944,6 +1511,7 @@ class Sheriff(object):
         cmd._restart()
         new_status = cmd.status()
         deputy = self.get_command_deputy(cmd)
+        deputy._orders_dirty = True
         self._maybe_emit_status_change_signals(deputy,
                 ((cmd, old_status, new_status),))
         self.send_orders()
@@ -961,6 +1529,7 @@ class Sheriff(object):
         cmd._stop()
         new_status = cmd.status()
         deputy = self.get_command_deputy(cmd)
+        deputy._orders_dirty = True
         self._maybe_emit_status_change_signals(deputy,
                 ((cmd, old_status, new_status),))
         self.send_orders()
@@ -977,6 +1546,8 @@ class Sheriff(object):
         @param exec_str the actual command string to execute.
         """
         cmd.exec_str = exec_str
+        self._mark_orders_dirty(cmd)
+        self.command_changed(cmd)
 
     def set_command_id(self, cmd, new_id):
         """Set the command id.
@@ -988,7 +1559,11 @@ class Sheriff(object):
             raise ValueError("Empty command id not allowed")
         if self.get_commands_by_id(new_id):
             _warn("Duplicate command id [%s]" % new_id)
+        old_id = cmd.command_id
         cmd.command_id = new_id
+        self._command_index.command_id_changed(cmd, old_id)
+        self._mark_orders_dirty(cmd)
+        self.command_changed(cmd)
 
     def set_command_group(self, cmd, group_name):
         """Set the command group.
@@ -1005,6 +1580,8 @@ class Sheriff(object):
         old_group = cmd.group
         if old_group != group_name:
             cmd._set_group(group_name)
+            self._command_index.group_changed(cmd, old_group)
+            self._mark_orders_dirty(cmd)
             self.command_group_changed( cmd)
 
     def set_auto_respawn(self, cmd, newauto_respawn):
@@ -1016,18 +1593,24 @@ class Sheriff(object):
         restarted.
         """
         cmd.auto_respawn = newauto_respawn
+        self._mark_orders_dirty(cmd)
+        self.command_changed(cmd)
 
     def set_command_stop_signal(self, cmd, new_stop_signal):
         """Set the OS signal that is sent to a command when requesting it to
         stop cleanly.  If the command doesn't cleanly exit within the stop time
         allowed, then it is sent a SIGKILL."""
         cmd.stop_signal = new_stop_signal
+        self._mark_orders_dirty(cmd)
+        self.command_changed(cmd)
 
     def set_command_stop_time_allowed(self, cmd, new_stop_time_allowed):
         """Set how much time (seconds) to wait for a command to exit cleanly when
         stopping the command, before sending it a SIGKILL.  Integer values only.
         """
         cmd.stop_time_allowed = int(new_stop_time_allowed)
+        self._mark_orders_dirty(cmd)
+        self.command_changed(cmd)
 
     def schedule_command_for_removal(self, cmd):
         """Remove a command.  This starts the process of purging a command from
@@ -1110,6 +1693,7 @@ class Sheriff(object):
             cmds = deputy._commands.values()
             if not deputy._commands or \
                     all([ cmd.scheduled_for_removal for cmd in cmds ]):
+                self._command_index.remove_deputy(deputy)
                 del self._deputies[deputy_name]
 
     def get_command_by_sheriff_id(self, sheriff_id):
@@ -1119,10 +1703,10 @@ class Sheriff(object):
         is not the same as the user-assigned command ID.  You generally should
         not need to use this function.
         """
-        for deputy in self._deputies.values():
-            if sheriff_id in deputy._commands:
-                return deputy._commands[sheriff_id]
-        raise KeyError("No such command")
+        entry = self._command_index.get(sheriff_id)
+        if entry is None:
+            raise KeyError("No such command")
+        return entry[1]
 
     def get_command_deputy(self, command):
         """Retrieve the SheriffDeputy that manages the specified command.
@@ -1132,10 +1716,10 @@ class Sheriff(object):
         @return a SheriffDeputy object corresponding to the deputy that manages
         the specified command.
         """
-        for deputy in self._deputies.values():
-            if command.sheriff_id in deputy._commands:
-                return deputy
-        raise KeyError("No such command")
+        entry = self._command_index.get(command.sheriff_id)
+        if entry is None:
+            raise KeyError("No such command")
+        return entry[0]
 
     def get_all_commands(self):
         """Retrieve all commands managed by all deputies.
@@ -1157,13 +1741,11 @@ class Sheriff(object):
         @return a list of SheriffDeputyCommand objects matching the query, or an
         empty list if none are found.
         """
-        if deputy_name not in self._deputies:
+        deputy = self._deputies.get(deputy_name)
+        if deputy is None:
             return []
-        result = []
-        for cmd in self._deputies[deputy_name]._commands.values():
-            if cmd.command_id == cmd_id:
-                result.append(cmd)
-        return result
+        return [ cmd for cmd in self._command_index.commands_with_id(cmd_id) \
+                if deputy.owns_command(cmd) ]
 
     def get_commands_by_id(self, cmd_id):
         """Retrieve all commands with the specified id.  This should only
@@ -1174,12 +1756,7 @@ class Sheriff(object):
         @return a list of SheriffDeputyCommand objects matching the query, or an
         empty list if none are found.
         """
-        result = []
-        for deputy in self._deputies.values():
-            for cmd in deputy._commands.values():
-                if cmd.command_id == cmd_id:
-                    result.append(cmd)
-        return result
+        return self._command_index.commands_with_id(cmd_id)
 
     def get_commands_by_group(self, group_name):
         """Retrieve a list of all commands in the specified group.  Use this
@@ -1190,19 +1767,10 @@ class Sheriff(object):
 
         @return a list of SheriffDeputyCommand objects.
         """
-        result = []
         group_name = group_name.strip("/")
         while group_name.find("//") >= 0:
             group_name = group_name.replace("//", "/")
-        group_parts = group_name.split("/")
-        for deputy in self._deputies.values():
-            for cmd in deputy._commands.values():
-                cmd_group_parts = cmd.group.split("/")
-                if len(group_parts) <= len(cmd_group_parts) and \
-                        all([ cgp == gp for cgp, gp in zip(group_parts,
-                            cmd_group_parts)]):
-                    result.append(cmd)
-        return result
+        return self._command_index.commands_in_group(group_name)
 
     def get_active_script(self):
         """Retrieve the currently executing script
@@ -1286,7 +1854,17 @@ class Sheriff(object):
             err_msgs.append("Infinite loop: script %s eventually calls itself" % script.name)
             check_subscripts = False
 
-        for action in script.actions:
+        self._check_actions_for_errors(script, script.actions, path_to_root,
+                check_subscripts, False, err_msgs)
+        return err_msgs
+
+    def _check_actions_for_errors(self, script, actions, path_to_root,
+            check_subscripts, in_parallel, err_msgs):
+        if in_parallel:
+            err_msgs.extend(sheriff_config.check_action_dependencies(actions))
+        for action in actions:
+            if action.after and not in_parallel:
+                err_msgs.append("'after' is only allowed inside a parallel block")
             if action.action_type in \
                     [ "start", "stop", "restart", "wait_status" ]:
                 if action.ident_type == "cmd":
@@ -1295,6 +1873,8 @@ class Sheriff(object):
                 elif action.ident_type == "group":
                     if not self.get_commands_by_group(action.ident):
                         err_msgs.append("No such group: %s" % action.ident)
+                if action.timeout_ms is not None and action.timeout_ms < 1:
+                    err_msgs.append("Wait timeouts must be positive")
             elif action.action_type == "wait_ms":
                 if action.delay_ms < 0:
                     err_msgs.append("Wait times must be nonnegative")
@@ -1313,101 +1893,24 @@ class Sheriff(object):
                     parstr = "->".join([s.name for s in (path + [subscript])])
                     for msg in sub_messages:
                         err_msgs.append("%s - %s" % (parstr, msg))
-
+            elif action.action_type == "parallel":
+                self._check_actions_for_errors(script, action.actions,
+                        path_to_root, check_subscripts, True, err_msgs)
             else:
                 err_msgs.append("Unrecognized action %s" % action.action_type)
-        return err_msgs
 
     def _finish_script_execution(self):
-        script = self._active_script_context.script
+        context = self._active_script_context
+        context.stop()
         self._active_script_context = None
-        self._waiting_on_commands = []
-        self._waiting_for_status = None
-        if script:
-            self.script_finished(script)
-
-    def _check_wait_action_status(self):
-        if not self._waiting_on_commands:
-            return
-
-        # hack.. don't execute actions faster than 10 Hz
-        time_elapsed_ms = (_now_utime() - self._last_script_action_time) * 1000
-        if time_elapsed_ms < 100:
-            return
-
-        if self._waiting_for_status == "running":
-            acceptable_statuses = RUNNING
-        elif self._waiting_for_status == "stopped":
-            acceptable_statuses = [ STOPPED_OK, STOPPED_ERROR ]
-        else:
-            raise ValueError("Invalid desired status %s" % \
-                    self._waiting_for_status)
-
-        for cmd in self._waiting_on_commands:
-            if cmd.status() not in acceptable_statuses:
-                return
-
-        # all commands passed the status check.  schedule the next action
-        self._waiting_on_commands = []
-        self._waiting_for_status = None
-        gobject.timeout_add(0, self._execute_next_script_action)
-
-    def _execute_next_script_action(self):
-        # make sure there's an active script
-        if not self._active_script_context:
-            return False
-
-        action = self._active_script_context.get_next_action()
-
-        if action is None:
-            # no more actions, script is done.
-            self._finish_script_execution()
-            return False
-
-        assert action.action_type != "run_script"
-
-        self.script_action_executing(self._active_script_context.script, action)
-
-        # fixed time wait -- just set a GObject timer to call this function
-        # again
-        if action.action_type == "wait_ms":
-            gobject.timeout_add(action.delay_ms,
-                    self._execute_next_script_action)
-            return False
-
-        # find the commands that we're operating on
-        cmds = self._get_action_commands(action.ident_type, action.ident)
-
-        self._last_script_action_time = _now_utime()
-
-        # execute an immediate action if applicable
-        if action.action_type == "start":
-            for cmd in cmds:
-                self.start_command(cmd)
-        elif action.action_type == "stop":
-            for cmd in cmds:
-                self.stop_command(cmd)
-        elif action.action_type == "restart":
-            for cmd in cmds:
-                self.restart_command(cmd)
-
-        # do we need to wait for the commands to achieve a desired status?
-        if action.wait_status:
-            # yes
-            self._waiting_on_commands = cmds
-            self._waiting_for_status = action.wait_status
-            self._check_wait_action_status()
-        else:
-            # no.  Just move on
-            gobject.timeout_add(0, self._execute_next_script_action)
-
-        return False
+        if context.script:
+            self.script_finished(context.script)
 
     def execute_script(self, script):
         """Starts executing a script.  If another script is executing, then
         that script is aborted first.  Calling this method executes the first
         action in the script.  Other actions will be invoked during LCM message
-        handling and by the GLib event loop (e.g., timers).
+        handling and by the sheriff's scheduler (e.g., timers).
 
         @param script a sheriff_script.SheriffScript object to execute
         @sa get_script()
@@ -1425,7 +1928,7 @@ class Sheriff(object):
 
         self._active_script_context = ScriptExecutionContext(self, script)
         self.script_started(script)
-        self._execute_next_script_action()
+        self._active_script_context.start()
 
     def abort_script(self):
         """Cancels execution of the active script."""
@@ -1548,7 +2051,8 @@ def main():
         script_name = args[1]
 
     comms = lcm.LCM()
-    sheriff = Sheriff(comms)
+    scheduler = GLibScheduler()
+    sheriff = Sheriff(comms, scheduler)
     if cfg is not None:
         sheriff.load_config(cfg, False)
 
@@ -1566,10 +2070,9 @@ def main():
     sheriff.deputy_info_received.connect(\
             lambda s, dep: sys.stdout.write("deputy info received from %s\n" %
                 dep.name))
-    mainloop = gobject.MainLoop()
-    gobject.io_add_watch(comms, gobject.IO_IN, lambda *s: comms.handle() or True)
-    gobject.timeout_add(1000, lambda *s: sheriff.send_orders() or True)
-    mainloop.run()
+    scheduler.add_reader(comms, comms.handle)
+    scheduler.call_repeatedly(1000, sheriff.send_orders)
+    scheduler.run()
 
 if __name__ == "__main__":
     main()
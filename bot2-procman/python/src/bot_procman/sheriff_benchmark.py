@@ -0,0 +1,124 @@
+"""Benchmark of how the sheriff handles deputy info2_t messages.
+
+Times Sheriff._handle_info2_t on info2_t messages from a deputy whose
+commands are all running and unchanged since its previous message, which is
+what the sheriff receives most of the time, for deputies with 10 to 1000
+commands.  The messages are decoded up front, so decoding isn't included.
+Run it on two versions of sheriff.py to compare them.
+
+usage: python -m bot_procman.sheriff_benchmark [messages_per_count]
+"""
+
+import sys
+import time
+import timeit
+
+from bot_procman.command2_t import command2_t
+from bot_procman.deputy_cmd2_t import deputy_cmd2_t
+from bot_procman.info2_t import info2_t
+from bot_procman.scheduler import Scheduler
+from bot_procman.sheriff import Sheriff, SheriffCommandSpec
+
+COMMAND_COUNTS = (10, 100, 500, 1000)
+
+class _NullLCM(object):
+    """Stands in for lcm.LCM, and drops everything that is published."""
+    def subscribe(self, channel, callback):
+        pass
+
+    def publish(self, channel, data):
+        pass
+
+class _Timer(object):
+    def cancel(self):
+        pass
+
+class _NullScheduler(Scheduler):
+    """Never calls the callbacks it is given, as nothing waits on them
+    here."""
+    def call_later(self, delay_ms, callback, *args):
+        return _Timer()
+
+    def call_repeatedly(self, interval_ms, callback, *args):
+        return _Timer()
+
+def _make_info(deputy_name, cmds):
+    """Returns an info2_t that reports each of cmds running."""
+    msg = info2_t()
+    msg.utime = int(time.time() * 1000000)
+    msg.host = deputy_name
+    msg.cpu_load = 0.25
+    msg.phys_mem_total_bytes = 1 << 34
+    msg.phys_mem_free_bytes = 1 << 33
+    msg.swap_total_bytes = 1 << 32
+    msg.swap_free_bytes = 1 << 32
+    msg.cmds = []
+    for i, cmd in enumerate(cmds):
+        cmd_msg = deputy_cmd2_t()
+        cmd_msg.cmd = command2_t()
+        cmd_msg.cmd.exec_str = cmd.exec_str
+        cmd_msg.cmd.command_name = cmd.command_id
+        cmd_msg.cmd.group = cmd.group
+        cmd_msg.cmd.auto_respawn = cmd.auto_respawn
+        cmd_msg.cmd.stop_signal = cmd.stop_signal
+        cmd_msg.cmd.stop_time_allowed = cmd.stop_time_allowed
+        cmd_msg.cmd.num_options = 0
+        cmd_msg.cmd.option_names = []
+        cmd_msg.cmd.option_values = []
+        cmd_msg.pid = 1000 + i
+        cmd_msg.actual_runid = cmd.desired_runid
+        cmd_msg.exit_code = 0
+        cmd_msg.cpu_usage = 0.01
+        cmd_msg.mem_vsize_bytes = 1 << 28
+        cmd_msg.mem_rss_bytes = 1 << 24
+        cmd_msg.sheriff_id = cmd.sheriff_id
+        msg.cmds.append(cmd_msg)
+    msg.ncmds = len(msg.cmds)
+    msg.num_options = 0
+    msg.option_names = []
+    msg.option_values = []
+    return msg
+
+def _make_sheriff(ncmds, deputy_name="deputy"):
+    """Returns a sheriff with ncmds commands on one deputy, all started,
+    and the info2_t in which the deputy reports them running."""
+    sheriff = Sheriff(_NullLCM(), _NullScheduler())
+    cmds = []
+    for i in range(ncmds):
+        spec = SheriffCommandSpec()
+        spec.deputy_name = deputy_name
+        spec.exec_str = "/usr/bin/process-%d --option %d" % (i, i)
+        spec.command_id = "process-%d" % i
+        spec.group_name = "group-%d/subgroup-%d" % (i % 10, i % 3)
+        cmds.append(sheriff.add_command(spec))
+    for cmd in cmds:
+        sheriff.start_command(cmd)
+    msg = _make_info(deputy_name, cmds)
+    # the first message makes the commands running, and the ones after it
+    # change nothing
+    sheriff._handle_info2_t(msg, 2)
+    for cmd in cmds:
+        assert cmd.status() == "Running", cmd.status()
+    return sheriff, msg
+
+def benchmark(number=None):
+    """Times Sheriff._handle_info2_t for each of COMMAND_COUNTS, and prints
+    the results."""
+    for ncmds in COMMAND_COUNTS:
+        sheriff, msg = _make_sheriff(ncmds)
+        n = number
+        if n is None:
+            n = max(20, 20000 // ncmds)
+        func = lambda: sheriff._handle_info2_t(msg, 2)
+        elapsed = min(timeit.repeat(func, number=n, repeat=3))
+        print "%5d cmds %9.1f us/msg %7.2f us/cmd" % (ncmds,
+                elapsed / n * 1e6, elapsed / n / ncmds * 1e6)
+
+def main():
+    number = None
+    if len(sys.argv) > 1:
+        number = int(sys.argv[1])
+    benchmark(number)
+
+if __name__ == "__main__":
+    main()
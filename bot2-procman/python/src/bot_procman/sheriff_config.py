@@ -143,6 +143,59 @@ def escape_str(text):
 
     return "".join([ escape_char(c) for c in text ])
 
+def action_dependency_str(action):
+    """Returns the 'as' and 'after' clauses of a script action, e.g.
+    ' as "a" after "b" "c"', or an empty string if it has neither."""
+    val = ""
+    if action.label is not None:
+        val += " as \"%s\"" % escape_str(action.label)
+    if action.after:
+        val += " after " + " ".join([ "\"%s\"" % escape_str(label) \
+                for label in action.after ])
+    return val
+
+def check_action_dependencies(actions):
+    """Checks the labels and dependencies of the actions of a parallel
+    block.  Labels must be unique within the block, and actions can only
+    depend on the labels of other actions in the same block, without
+    circular dependencies.
+
+    Returns a list of error messages, which is empty if there are no errors.
+    """
+    err_msgs = []
+    labels = set()
+    for action in actions:
+        if action.label is None:
+            continue
+        if action.label in labels:
+            err_msgs.append("Duplicate label \"%s\"" % action.label)
+        labels.add(action.label)
+    for action in actions:
+        for label in action.after:
+            if label not in labels:
+                err_msgs.append("Unknown label \"%s\"" % label)
+    if err_msgs:
+        return err_msgs
+
+    # repeatedly remove the actions whose dependencies are all removed.  If
+    # any are left over, then they depend on each other.
+    remaining = list(actions)
+    done = set()
+    while remaining:
+        ready = [ action for action in remaining \
+                if not [ l for l in action.after if l not in done ] ]
+        if not ready:
+            names = [ action.label for action in remaining \
+                    if action.label is not None ]
+            err_msgs.append("Circular dependency between %s" % \
+                    ", ".join([ "\"%s\"" % name for name in sorted(names) ]))
+            break
+        for action in ready:
+            remaining.remove(action)
+            if action.label is not None:
+                done.add(action.label)
+    return err_msgs
+
 class CommandNode(object):
     def __init__ (self):
         self.attributes = { \
@@ -215,13 +268,24 @@ class GroupNode(object):
     def __str__ (self):
         return self.to_config_string(0)
 
+def wait_timeout_str(action):
+    """Returns the 'timeout' clause of a script action that waits, or an
+    empty string if it has no timeout."""
+    if action.timeout_ms is None:
+        return ""
+    return " timeout %d" % action.timeout_ms
+
 class StartStopRestartActionNode(object):
-    def __init__(self, action_type, ident_type, ident, wait_status):
+    def __init__(self, action_type, ident_type, ident, wait_status,
+            timeout_ms=None):
         assert action_type in ["start", "stop", "restart"]
         assert ident_type in [ "everything", "group", "cmd" ]
         self.action_type = action_type
         self.ident_type = ident_type
         self.wait_status = wait_status
+        self.timeout_ms = timeout_ms
+        self.label = None
+        self.after = []
         assert wait_status in [None, "running", "stopped"]
         if self.ident_type == "everything":
             self.ident = None
@@ -235,38 +299,62 @@ class StartStopRestartActionNode(object):
         else:
             ident_str = "%s \"%s\"" % (self.ident_type, escape_str(self.ident))
         if self.wait_status is not None:
-            return "%s %s wait \"%s\";" % (self.action_type,
-                    ident_str, self.wait_status)
+            return "%s %s wait \"%s\"%s%s;" % (self.action_type,
+                    ident_str, self.wait_status, wait_timeout_str(self),
+                    action_dependency_str(self))
         else:
-            return "%s %s;" % (self.action_type, ident_str)
+            return "%s %s%s;" % (self.action_type, ident_str,
+                    action_dependency_str(self))
 
 class WaitMsActionNode(object):
     def __init__(self, delay_ms):
         self.delay_ms = delay_ms
         self.action_type = "wait_ms"
+        self.label = None
+        self.after = []
 
     def __str__(self):
-        return "wait ms %d;" % self.delay_ms
+        return "wait ms %d%s;" % (self.delay_ms, action_dependency_str(self))
 
 class WaitStatusActionNode(object):
-    def __init__(self, ident_type, ident, wait_status):
+    def __init__(self, ident_type, ident, wait_status, timeout_ms=None):
         self.ident_type = ident_type
         self.ident = ident
         self.wait_status = wait_status
+        self.timeout_ms = timeout_ms
         self.action_type = "wait_status"
+        self.label = None
+        self.after = []
         assert wait_status in ["running", "stopped"]
 
     def __str__(self):
-        return "wait %s \"%s\" status \"%s\";" % \
-                (self.ident_type, escape_str(self.ident), self.wait_status)
+        return "wait %s \"%s\" status \"%s\"%s%s;" % \
+                (self.ident_type, escape_str(self.ident), self.wait_status,
+                        wait_timeout_str(self), action_dependency_str(self))
 
 class RunScriptActionNode(object):
     def __init__(self, script_name):
         self.script_name = script_name
         self.action_type = "run_script"
+        self.label = None
+        self.after = []
+
+    def __str__(self):
+        return "run_script \"%s\"%s;" % (escape_str(self.script_name),
+                action_dependency_str(self))
+
+class ParallelActionNode(object):
+    def __init__(self, actions):
+        self.actions = actions
+        self.action_type = "parallel"
+        self.label = None
+        self.after = []
 
     def __str__(self):
-        return "run_script \"%s\";" % escape_str(self.script_name)
+        val = "parallel%s {" % action_dependency_str(self)
+        for action in self.actions:
+            val = val + "\n    " + str(action).replace("\n", "\n    ")
+        return val + "\n}"
 
 class ScriptNode(object):
     def __init__(self, name):
@@ -281,7 +369,7 @@ class ScriptNode(object):
     def __str__(self):
         val = "script \"%s\" {" % escape_str(self.name)
         for action in self.actions:
-            val = val + "\n    " + str(action)
+            val = val + "\n    " + str(action).replace("\n", "\n    ")
         val = val + "\n}\n"
         return val
 
@@ -361,6 +449,13 @@ class Parser:
             self._fail_next_token(err_msg)
         return self._cur_tok.val
 
+    def _eat_identifier(self, identifier):
+        if self._next_tok and self._next_tok.type == TokIdentifier and \
+                self._next_tok.val == identifier:
+            self._get_token ()
+            return True
+        return False
+
     def _expect_identifier(self, identifier, err_msg = None):
         if err_msg is None:
             err_msg = "Expected %s" % identifier
@@ -455,49 +550,78 @@ class Parser:
         ident = None
         if ident_type != "everything":
             ident = self._parse_string_or_fail()
-        if self._eat_token(TokEndStatement):
-            return StartStopRestartActionNode(action_type, ident_type, ident,
-                    None)
-        self._expect_identifier("wait", "Expected ';' or 'wait'")
-        wait_status = self._parse_string_one_of(["running", "stopped"])
-        self._eat_token_or_fail(TokEndStatement, "Expected ';'")
+        wait_status = None
+        timeout_ms = None
+        if self._eat_identifier("wait"):
+            wait_status = self._parse_string_one_of(["running", "stopped"])
+            timeout_ms = self._parse_wait_timeout()
         return StartStopRestartActionNode(action_type, ident_type, ident,
-                wait_status)
+                wait_status, timeout_ms)
+
+    def _parse_wait_timeout(self):
+        if not self._eat_identifier("timeout"):
+            return None
+        err_msg = "Expected integer constant"
+        timeout_ms = int(self._eat_token_or_fail(TokInteger, err_msg))
+        if timeout_ms < 1:
+            self._fail("Wait timeouts must be positive")
+        return timeout_ms
 
     def _parse_wait_action(self):
         wait_type = self._parse_identifier_one_of(["ms", "cmd", "group"])
         if wait_type == "ms":
             err_msg = "Expected integer constant"
             delay_ms = int(self._eat_token_or_fail(TokInteger, err_msg))
-            self._eat_token_or_fail(TokEndStatement, "Expected ';'")
             return WaitMsActionNode(delay_ms)
         else:
             ident = self._parse_string_or_fail()
             self._expect_identifier("status")
             wait_status = self._parse_string_one_of(["running", "stopped"])
-            self._eat_token_or_fail(TokEndStatement, "Expected ';'")
-            return WaitStatusActionNode(wait_type, ident, wait_status)
+            timeout_ms = self._parse_wait_timeout()
+            return WaitStatusActionNode(wait_type, ident, wait_status,
+                    timeout_ms)
 
     def _parse_run_script(self):
         script_name = self._eat_token_or_fail(TokString, "expected script name")
-        self._eat_token_or_fail(TokEndStatement, "Expected ';'")
         return RunScriptActionNode(script_name)
 
-    def _parse_script_action_list(self):
+    def _parse_action_dependencies(self, action, in_parallel):
+        if self._eat_identifier("as"):
+            action.label = self._parse_string_or_fail()
+        if self._eat_identifier("after"):
+            if not in_parallel:
+                self._fail("'after' is only allowed inside a parallel block")
+            action.after.append(self._parse_string_or_fail())
+            while self._eat_token(TokString):
+                action.after.append(self._cur_tok.val)
+
+    def _parse_script_action_list(self, in_parallel=False):
         self._eat_token_or_fail (TokOpenStruct, "Expected '{'")
         actions = []
         while self._eat_token(TokIdentifier):
             action_type = self._cur_tok.val
             if action_type in [ "start", "stop", "restart" ]:
                 action = self._parse_start_stop_restart_action(action_type)
-                actions.append(action)
             elif action_type == "wait":
-                actions.append(self._parse_wait_action())
+                action = self._parse_wait_action()
             elif action_type == "run_script":
-                actions.append(self._parse_run_script())
+                action = self._parse_run_script()
+            elif action_type == "parallel":
+                action = ParallelActionNode([])
+                self._parse_action_dependencies(action, in_parallel)
+                action.actions = self._parse_script_action_list(True)
+                actions.append(action)
+                continue
             else:
                 self._fail("Unexpected token %s" % action_type)
+            self._parse_action_dependencies(action, in_parallel)
+            self._eat_token_or_fail(TokEndStatement, "Expected ';'")
+            actions.append(action)
         self._eat_token_or_fail(TokCloseStruct, "Unexpected token")
+        if in_parallel:
+            err_msgs = check_action_dependencies(actions)
+            if err_msgs:
+                self._fail(err_msgs[0])
         return actions
 
     def _parse_script(self):
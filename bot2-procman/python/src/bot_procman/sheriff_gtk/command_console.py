@@ -5,8 +5,28 @@ import gtk
 import pango
 
 from bot_procman.printf_t import printf_t
+import bot_procman.fast_codec as fast_codec
+from bot_procman.output_buffer import OutputRingBuffer, parse_ansi
 
+# Console output rate limits for each command, for all of the commands on a
+# deputy, and for all commands together.
 DEFAULT_MAX_KB_PER_SECOND = 500
+DEFAULT_MAX_KB_PER_SECOND_PER_DEPUTY = 2000
+DEFAULT_MAX_KB_PER_SECOND_TOTAL = 5000
+
+# Output within the rate limits can arrive in bursts of up to this many
+# seconds' worth.
+RATE_LIMIT_BURST_SECONDS = 2.5
+
+# How often output that was dropped by the rate limits is reported.
+RATE_LIMIT_REPORT_INTERVAL_MS = 500
+
+# Output is queued as it arrives, and inserted into the text buffers at most
+# this often.
+OUTPUT_FLUSH_INTERVAL_MS = 50
+
+# How many bytes of output are kept for each command.
+COMMAND_OUTPUT_MAX_BYTES = 256 * 1024
 
 ANSI_CODES_TO_TEXT_TAG_PROPERTIES = { \
         "1" : ("weight", pango.WEIGHT_BOLD),
@@ -32,10 +52,38 @@ ANSI_CODES_TO_TEXT_TAG_PROPERTIES = { \
 
 def now_str (): return time.strftime ("[%H:%M:%S] ")
 
+class TokenBucket(object):
+    """Rate limiter that allows an average of max_kb_per_sec kB of output per
+    second, in bursts of up to RATE_LIMIT_BURST_SECONDS worth.
+
+    Tokens are refilled when they're asked for, so idle buckets cost
+    nothing.
+    """
+    def __init__ (self, max_kb_per_sec, now):
+        self.tokens = 0
+        self.set_rate (max_kb_per_sec)
+        self.tokens = self.capacity
+        self.last_time = now
+
+    def set_rate (self, max_kb_per_sec):
+        self.rate = max_kb_per_sec * 1000
+        self.capacity = int(self.rate * RATE_LIMIT_BURST_SECONDS)
+        self.tokens = min (self.tokens, self.capacity)
+
+    def available (self, now):
+        if now > self.last_time:
+            self.tokens = min (self.capacity,
+                    self.tokens + (now - self.last_time) * self.rate)
+        self.last_time = now
+        return int(self.tokens)
+
+    def consume (self, count):
+        self.tokens -= count
+
 class CommandExtraData(object):
-    def __init__ (self, text_tag_table):
-        self.tb = gtk.TextBuffer (text_tag_table)
-        self.printf_keep_count = [ 0, 0, 0, 0, 0, 0 ]
+    def __init__ (self, max_kb_per_sec, now):
+        self.output = OutputRingBuffer (COMMAND_OUTPUT_MAX_BYTES)
+        self.rate_limit = TokenBucket (max_kb_per_sec, now)
         self.printf_drop_count = 0
 
 class SheriffCommandConsole(gtk.ScrolledWindow):
@@ -43,8 +91,9 @@ class SheriffCommandConsole(gtk.ScrolledWindow):
         super(SheriffCommandConsole, self).__init__()
 
         self.stdout_maxlines = 2000
-        self.max_kb_per_sec = 0
-        self.max_chars_per_2500_ms = 0
+        self.max_kb_per_sec = DEFAULT_MAX_KB_PER_SECOND
+        self.max_kb_per_sec_per_deputy = DEFAULT_MAX_KB_PER_SECOND_PER_DEPUTY
+        self.max_kb_per_sec_total = DEFAULT_MAX_KB_PER_SECOND_TOTAL
 
         self.sheriff = _sheriff
 
@@ -54,6 +103,14 @@ class SheriffCommandConsole(gtk.ScrolledWindow):
         self.sheriff_tb = self.stdout_textview.get_buffer ()
         self.add (self.stdout_textview)
 
+        # The output of commands is stored in CommandExtraData.output, and
+        # copied into command_tb only for the command that is being shown.
+        # shown_cmd_offset is how much of that command's output command_tb
+        # has.
+        self.command_tb = gtk.TextBuffer (self.sheriff_tb.get_tag_table())
+        self.shown_cmd = None
+        self.shown_cmd_offset = 0
+
         stdout_adj = self.get_vadjustment ()
         stdout_adj.set_data ("scrolled-to-end", 1)
         stdout_adj.connect ("changed", self.on_adj_changed)
@@ -70,8 +127,18 @@ class SheriffCommandConsole(gtk.ScrolledWindow):
         self.set_background_color(self.base_color)
         self.set_text_color(self.text_color)
 
-        # stdout rate limit maintenance events
-        gobject.timeout_add (500, self._stdout_rate_limit_upkeep)
+        # stdout rate limits.  Commands that have had output dropped since
+        # the last report are in _dropping_cmds.
+        self._deputy_rate_limits = {}
+        self._total_rate_limit = TokenBucket (self.max_kb_per_sec_total,
+                time.time())
+        self._dropping_cmds = {}
+        self._drop_report_source_id = None
+
+        # text waiting to be added to each text buffer, and the timer that
+        # adds it.
+        self._pending_output = {}
+        self._flush_source_id = None
 
         self.sheriff.command_added.connect(self._on_sheriff_command_added)
         self.sheriff.command_removed.connect(self._on_sheriff_command_removed)
@@ -85,8 +152,6 @@ class SheriffCommandConsole(gtk.ScrolledWindow):
         for tt in self.text_tags.values():
             self.sheriff_tb.get_tag_table().add(tt)
 
-        self.set_output_rate_limit(DEFAULT_MAX_KB_PER_SECOND)
-
     def get_background_color(self):
         return self.base_color
 
@@ -112,60 +177,120 @@ class SheriffCommandConsole(gtk.ScrolledWindow):
         self.font_str = font_str
         self.stdout_textview.modify_font(pango.FontDescription(font_str))
 
-    def _stdout_rate_limit_upkeep (self):
-        for cmd in self.sheriff.get_all_commands ():
-            extradata = self._cmd_extradata.get(cmd, None)
-            if not extradata:
-                continue
-            if extradata.printf_drop_count:
-                deputy = self.sheriff.get_command_deputy (cmd)
-                self._add_text_to_buffer (extradata.tb, now_str() +
-                        "\nSHERIFF RATE LIMIT: Ignored %d bytes of output\n" %
-                        (extradata.printf_drop_count))
-                self._add_text_to_buffer (self.sheriff_tb, now_str() +
-                        "Ignored %d bytes of output from [%s] [%s]\n" % \
-                        (extradata.printf_drop_count, deputy.name, cmd.command_id))
-
-            extradata.printf_keep_count.pop (0)
-            extradata.printf_keep_count.append (0)
+    def _rate_limit_output (self, cmd, extradata, deputy_name, text):
+        now = time.time()
+        deputy_rate_limit = self._deputy_rate_limits.get(deputy_name)
+        if deputy_rate_limit is None:
+            deputy_rate_limit = TokenBucket (self.max_kb_per_sec_per_deputy,
+                    now)
+            self._deputy_rate_limits[deputy_name] = deputy_rate_limit
+        buckets = (extradata.rate_limit, deputy_rate_limit,
+                self._total_rate_limit)
+
+        tokeep = len (text)
+        for bucket in buckets:
+            tokeep = min (tokeep, bucket.available (now))
+        for bucket in buckets:
+            bucket.consume (tokeep)
+
+        if tokeep < len (text):
+            extradata.printf_drop_count += len (text) - tokeep
+            self._dropping_cmds[cmd] = extradata
+            if self._drop_report_source_id is None:
+                self._drop_report_source_id = gobject.timeout_add ( \
+                        RATE_LIMIT_REPORT_INTERVAL_MS,
+                        self._report_dropped_output)
+            return text[:tokeep]
+        return text
+
+    def _report_dropped_output (self):
+        self._drop_report_source_id = None
+        dropping_cmds = self._dropping_cmds
+        self._dropping_cmds = {}
+        for cmd, extradata in dropping_cmds.items():
+            deputy = self.sheriff.get_command_deputy (cmd)
+            self._append_command_output (cmd, extradata, now_str() +
+                    "\nSHERIFF RATE LIMIT: Ignored %d bytes of output\n" %
+                    (extradata.printf_drop_count))
+            self._queue_text (self.sheriff_tb, now_str() +
+                    "Ignored %d bytes of output from [%s] [%s]\n" % \
+                    (extradata.printf_drop_count, deputy.name, cmd.command_id))
             extradata.printf_drop_count = 0
-        return True
-
-    def _tag_from_seg(self, seg):
-        esc_seq, seg = seg.split("m", 1)
-        if not esc_seq:
-            esc_seq = "0"
-        key = esc_seq
-        codes = esc_seq.split(";")
-        if len(codes) > 0:
-            codes.sort()
-            key = ";".join(codes)
-        if key not in self.text_tags:
-            tag = gtk.TextTag(key)
-            for code in codes:
+        return False
+
+    def _tag_for_style(self, style):
+        if style is None:
+            return self.text_tags["normal"]
+        tag = self.text_tags.get(style)
+        if tag is None:
+            tag = gtk.TextTag(style)
+            for code in style.split(";"):
                 if code in ANSI_CODES_TO_TEXT_TAG_PROPERTIES:
                     propname, propval = ANSI_CODES_TO_TEXT_TAG_PROPERTIES[code]
                     tag.set_property(propname, propval)
             self.sheriff_tb.get_tag_table().add(tag)
-            self.text_tags[key] = tag
-        return self.text_tags[key], seg
+            self.text_tags[style] = tag
+        return tag
 
-    def _add_text_to_buffer (self, tb, text):
+    def _queue_text (self, tb, text):
         if not text:
             return
+        pending = self._pending_output.get(tb)
+        if pending is None:
+            self._pending_output[tb] = [ text ]
+        else:
+            pending.append(text)
+        self._schedule_flush()
+
+    def _append_command_output (self, cmd, extradata, text):
+        extradata.output.append(text)
+        if cmd is self.shown_cmd:
+            self._schedule_flush()
+
+    def _schedule_flush (self):
+        if self._flush_source_id is None:
+            self._flush_source_id = gobject.timeout_add( \
+                    OUTPUT_FLUSH_INTERVAL_MS, self._flush_pending_output)
+
+    def _flush_pending_output (self):
+        self._flush_source_id = None
+        pending_output = self._pending_output
+        self._pending_output = {}
+        for tb, texts in pending_output.items():
+            text = "".join(texts)
+            # don't bother inserting lines that would be trimmed right away
+            if text.count("\n") >= self.stdout_maxlines:
+                text = "\n".join(text.split("\n")[-self.stdout_maxlines:])
+            self._add_text_to_buffer (tb, text)
+        self._update_command_tb()
+        return False
+
+    def _update_command_tb (self):
+        if self.shown_cmd is None:
+            return
+        output = self._cmd_extradata[self.shown_cmd].output
+        if output.get_end_offset() == self.shown_cmd_offset:
+            return
+        if self.shown_cmd_offset < output.get_start_offset():
+            # the text buffer is missing output that has been dropped since,
+            # so start over.
+            self.command_tb.delete (self.command_tb.get_start_iter(),
+                    self.command_tb.get_end_iter())
+        self._insert_segments (self.command_tb,
+                output.get_segments_since(self.shown_cmd_offset))
+        self.shown_cmd_offset = output.get_end_offset()
 
+    def _add_text_to_buffer (self, tb, text):
+        if not text:
+            return
         # interpret text as ANSI escape sequences?  Try to format colors...
-        tag = self.text_tags["normal"]
-        for segnum, seg in enumerate(text.split("\x1b[")):
-            if not seg:
-                continue
-            if segnum > 0:
-                try:
-                    tag, seg = self._tag_from_seg(seg)
-                except ValueError:
-                    pass
+        segments, style = parse_ansi(text)
+        self._insert_segments (tb, segments)
+
+    def _insert_segments (self, tb, segments):
+        for style, seg in segments:
             end_iter = tb.get_end_iter()
-            tb.insert_with_tags(end_iter, seg, tag)
+            tb.insert_with_tags(end_iter, seg, self._tag_for_style(style))
 
         # toss out old text if the muffer is getting too big
         num_lines = tb.get_line_count ()
@@ -176,19 +301,22 @@ class SheriffCommandConsole(gtk.ScrolledWindow):
 
     # Sheriff event handlers
     def _on_sheriff_command_added (self, deputy, command):
-        extradata = CommandExtraData (self.sheriff_tb.get_tag_table())
+        extradata = CommandExtraData (self.max_kb_per_sec, time.time())
         self._cmd_extradata[command] = extradata
-        self._add_text_to_buffer (self.sheriff_tb, now_str() +
+        self._queue_text (self.sheriff_tb, now_str() +
                 "Added [%s] [%s] [%s]\n" % (deputy.name, command.command_id, command.exec_str))
 
     def _on_sheriff_command_removed (self, deputy, command):
         del self._cmd_extradata[command]
-        self._add_text_to_buffer (self.sheriff_tb, now_str() +
+        self._dropping_cmds.pop(command, None)
+        if command is self.shown_cmd:
+            self.show_sheriff_buffer()
+        self._queue_text (self.sheriff_tb, now_str() +
                 "[%s] removed [%s] [%s]\n" % (deputy.name, command.command_id, command.exec_str))
 
     def _on_sheriff_command_status_changed (self, cmd,
             old_status, new_status):
-        self._add_text_to_buffer (self.sheriff_tb, now_str() +
+        self._queue_text (self.sheriff_tb, now_str() +
                 "[%s] new status: %s\n" % (cmd.command_id, new_status))
 
     def on_tb_populate_menu(self,textview, menu):
@@ -202,21 +330,48 @@ class SheriffCommandConsole(gtk.ScrolledWindow):
 
     def _tb_clear(self,menu):
         tb = self.stdout_textview.get_buffer ()
+        self._pending_output.pop(tb, None)
+        if tb is self.command_tb:
+            output = self._cmd_extradata[self.shown_cmd].output
+            output.clear()
+            self.shown_cmd_offset = output.get_end_offset()
         start_iter = tb.get_start_iter ()
         end_iter = tb.get_end_iter ()
         tb.delete (start_iter, end_iter)
 
     def set_output_rate_limit(self, max_kb_per_sec):
         self.max_kb_per_sec = max_kb_per_sec
-        self.max_chars_per_2500_ms = int(max_kb_per_sec * 1000 * 2.5)
+        for extradata in self._cmd_extradata.values():
+            extradata.rate_limit.set_rate(max_kb_per_sec)
 
     def get_output_rate_limit(self):
         return self.max_kb_per_sec
 
+    def set_deputy_output_rate_limit(self, max_kb_per_sec):
+        self.max_kb_per_sec_per_deputy = max_kb_per_sec
+        for rate_limit in self._deputy_rate_limits.values():
+            rate_limit.set_rate(max_kb_per_sec)
+
+    def get_deputy_output_rate_limit(self):
+        return self.max_kb_per_sec_per_deputy
+
+    def set_total_output_rate_limit(self, max_kb_per_sec):
+        self.max_kb_per_sec_total = max_kb_per_sec
+        self._total_rate_limit.set_rate(max_kb_per_sec)
+
+    def get_total_output_rate_limit(self):
+        return self.max_kb_per_sec_total
+
     def load_settings(self, save_map):
         if "console_rate_limit" in save_map:
             self.set_output_rate_limit(save_map["console_rate_limit"])
 
+        if "console_deputy_rate_limit" in save_map:
+            self.set_deputy_output_rate_limit(save_map["console_deputy_rate_limit"])
+
+        if "console_total_rate_limit" in save_map:
+            self.set_total_output_rate_limit(save_map["console_total_rate_limit"])
+
         if "console_background_color" in save_map:
             self.set_background_color(gtk.gdk.Color(save_map["console_background_color"]))
 
@@ -228,6 +383,8 @@ class SheriffCommandConsole(gtk.ScrolledWindow):
 
     def save_settings(self, save_map):
         save_map["console_rate_limit"] = self.max_kb_per_sec
+        save_map["console_deputy_rate_limit"] = self.max_kb_per_sec_per_deputy
+        save_map["console_total_rate_limit"] = self.max_kb_per_sec_total
         save_map["console_background_color"] = self.base_color.to_string()
         save_map["console_text_color"] = self.text_color.to_string()
         save_map["console_font"] = self.font_str
@@ -240,7 +397,7 @@ class SheriffCommandConsole(gtk.ScrolledWindow):
         adj.set_data ("scrolled-to-end", adj.value == adj.upper-adj.page_size)
 
     def on_procman_printf (self, channel, data):
-        msg = printf_t.decode (data)
+        msg = fast_codec.decode (printf_t, data)
         if msg.sheriff_id:
             try:
                 cmd = self.sheriff.get_command_by_sheriff_id(msg.sheriff_id)
@@ -252,26 +409,26 @@ class SheriffCommandConsole(gtk.ScrolledWindow):
             if not extradata:
                 return
 
-            # rate limit
-            msg_count = sum (extradata.printf_keep_count)
-            if msg_count >= self.max_chars_per_2500_ms:
-                extradata.printf_drop_count += len (msg.text)
-                return
-
-            tokeep = min (self.max_chars_per_2500_ms - msg_count, len (msg.text))
-            extradata.printf_keep_count[-1] += tokeep
-
-            if len (msg.text) > tokeep:
-                toadd = msg.text[:tokeep]
-            else:
-                toadd = msg.text
-
-            self._add_text_to_buffer (extradata.tb, toadd)
+            toadd = self._rate_limit_output (cmd, extradata,
+                    msg.deputy_name, msg.text)
+            if toadd:
+                self._append_command_output (cmd, extradata, toadd)
 
     def show_command_buffer(self, cmd):
         extradata = self._cmd_extradata.get(cmd, None)
-        if extradata:
-            self.stdout_textview.set_buffer (extradata.tb)
+        if not extradata:
+            return
+        if cmd is not self.shown_cmd:
+            self.shown_cmd = cmd
+            self.command_tb.delete (self.command_tb.get_start_iter(),
+                    self.command_tb.get_end_iter())
+            self._insert_segments (self.command_tb,
+                    extradata.output.get_segments())
+            self.shown_cmd_offset = extradata.output.get_end_offset()
+        else:
+            self._update_command_tb()
+        self.stdout_textview.set_buffer (self.command_tb)
 
     def show_sheriff_buffer(self):
+        self.shown_cmd = None
         self.stdout_textview.set_buffer (self.sheriff_tb)
@@ -14,7 +14,74 @@ COL_CMDS_TV_MEM_VSIZE, \
 COL_CMDS_TV_AUTO_RESPAWN, \
 NUM_CMDS_ROWS = range(10)
 
+# How often changes in the CPU and memory usage of commands, and in the
+# aggregate values of groups, are shown.
+REFRESH_INTERVAL_MS = 500
+
+def _group_and_ancestors(group_name):
+    """Returns the full names of a group and of the groups that contain it,
+    innermost first."""
+    names = []
+    while group_name:
+        names.append(group_name)
+        group_name = group_name.rpartition("/")[0]
+    return names
+
+class GroupAggregate(object):
+    """Totals over all of the commands in a group and its subgroups.
+
+    Commands are added and removed with the values they had when they were
+    counted, so the totals can be kept up to date as commands change without
+    visiting the other commands of the group.
+    """
+    def __init__(self):
+        self.num_cmds = 0
+        self.status_counts = {}
+        self.host_counts = {}
+        self.cpu_usage = 0.0
+        self.mem_vsize_kb = 0
+
+    def add(self, status, host, cpu_usage, mem_vsize_kb):
+        self.num_cmds += 1
+        self.status_counts[status] = self.status_counts.get(status, 0) + 1
+        self.host_counts[host] = self.host_counts.get(host, 0) + 1
+        self.cpu_usage += cpu_usage
+        self.mem_vsize_kb += mem_vsize_kb
+
+    def remove(self, status, host, cpu_usage, mem_vsize_kb):
+        self.num_cmds -= 1
+        for counts, key in ((self.status_counts, status),
+                (self.host_counts, host)):
+            if counts[key] == 1:
+                del counts[key]
+            else:
+                counts[key] -= 1
+        self.cpu_usage -= cpu_usage
+        self.mem_vsize_kb -= mem_vsize_kb
+
+    def get_status(self):
+        """Returns the status shared by all of the commands, "Stopped
+        (Mixed)" if they are stopped with different statuses, or "Mixed"."""
+        if len(self.status_counts) == 1:
+            return self.status_counts.keys()[0]
+        stopped_statuses = [sheriff.STOPPED_OK, sheriff.STOPPED_ERROR]
+        if all([ s in stopped_statuses for s in self.status_counts ]):
+            return "Stopped (Mixed)"
+        return "Mixed"
+
+    def get_host(self):
+        if len(self.host_counts) == 1:
+            return self.host_counts.keys()[0]
+        return "Mixed"
+
 class SheriffCommandModel(gtk.TreeStore):
+    """Tree of the sheriff's commands, grouped by command group.
+
+    The model keeps itself up to date from the sheriff's signals, and only
+    touches the rows of commands that change.  Edits made through the
+    sheriff are shown right away, and resource usage reported by the
+    deputies is shown at most every REFRESH_INTERVAL_MS.
+    """
     def __init__(self, _sheriff):
         super(SheriffCommandModel, self).__init__( \
                 gobject.TYPE_PYOBJECT,
@@ -30,10 +97,30 @@ class SheriffCommandModel(gtk.TreeStore):
 
         self.sheriff = _sheriff
         self.group_row_references = {}
+        self.cmd_row_references = {}
         self.populate_exec_with_group_name = False
 
+        # a GroupAggregate for each group, and for each command, its group and
+        # the values that were added to the aggregates.
+        self.group_aggregates = {}
+        self._cmd_aggregate_values = {}
+
+        # rows to update on the next refresh
+        self._dirty_cmds = set()
+        self._dirty_groups = set()
+        self._refresh_source_id = None
+
         self.set_sort_column_id(COL_CMDS_TV_COMMAND_ID, gtk.SORT_ASCENDING)
 
+        self.sheriff.command_added.connect(self._on_command_added)
+        self.sheriff.command_removed.connect(self._on_command_removed)
+        self.sheriff.command_status_changed.connect(self._on_command_status_changed)
+        self.sheriff.command_group_changed.connect(self._on_command_group_changed)
+        self.sheriff.command_changed.connect(self._on_command_changed)
+        self.sheriff.deputy_info_received.connect(self._on_deputy_info_received)
+
+        self.repopulate()
+
     def _find_or_make_group_row_reference(self, group_name):
         if not group_name:
             return None
@@ -74,91 +161,88 @@ class SheriffCommandModel(gtk.TreeStore):
     def set_populate_exec_with_group_name(self, val):
         self.populate_exec_with_group_name = val
 
-    def _delete_group_row_reference(self, trr):
-        model_iter = self.get_iter(trr.get_path())
-        group_name = self.get_value(model_iter, COL_CMDS_TV_FULL_GROUP)
-        del self.group_row_references[group_name]
-        self.remove(model_iter)
-
-    def _is_group_row(self, model_iter):
-        return self.iter_to_command(model_iter) is None
-
-    def _update_cmd_row(self, model_rr, cmd_deps, to_reparent):
-        path = model_rr.get_path()
-        model_iter = self.get_iter(path)
-        cmd = self.iter_to_command(model_iter)
-        cpu_str = "%.2f" % (cmd.cpu_usage * 100)
-        mem_usage = int(cmd.mem_vsize_bytes / 1024)
-
+    def _set_changed(self, model_iter, values):
+        # only set the columns whose values are different, so that rows that
+        # haven't changed aren't redrawn or resorted.
+        changed = []
+        for col, val in values:
+            if self.get_value(model_iter, col) != val:
+                changed.extend((col, val))
+        if changed:
+            self.set(model_iter, *changed)
+        return bool(changed)
+
+    def _cmd_row_values(self, cmd, host):
         if cmd.command_id.strip():
             command_id = cmd.command_id
         else:
             command_id = "<unnamed>"
-
-        self.set(model_iter,
-                COL_CMDS_TV_EXEC, cmd.exec_str,
-                COL_CMDS_TV_COMMAND_ID, command_id,
-                COL_CMDS_TV_STATUS_ACTUAL, cmd.status (),
-                COL_CMDS_TV_HOST, cmd_deps[cmd].name,
-                COL_CMDS_TV_CPU_USAGE, cpu_str,
-                COL_CMDS_TV_MEM_VSIZE, mem_usage,
-                COL_CMDS_TV_AUTO_RESPAWN, cmd.auto_respawn)
-
-        # get a row reference to the model since
-        # adding a group may invalidate the iterators
-        model_rr = gtk.TreeRowReference(self, path)
-
-        # check that the command is in the correct group in the
-        # treemodel
-        correct_grr = self._find_or_make_group_row_reference(cmd.group)
-        correct_parent_iter = None
-        correct_parent_path = None
-        actual_parent_path = None
-        if correct_grr and correct_grr.get_path() is not None:
-            correct_parent_iter = self.get_iter(correct_grr.get_path())
-        actual_parent_iter = self.iter_parent(self.get_iter(model_rr.get_path())) # use the model_rr in case model_iter was invalidated
-
-        if correct_parent_iter:
-            correct_parent_path = self.get_path(correct_parent_iter)
-        if actual_parent_iter:
-            actual_parent_path = self.get_path(actual_parent_iter)
-
-        if correct_parent_path != actual_parent_path:
-            # schedule the command to be moved
-            to_reparent.append((model_rr, correct_grr))
-#                print "moving %s (%s) (%s)" % (cmd.name,
-#                        correct_parent_path, actual_parent_path)
-
-    def _update_group_row(self, group_rr, cmd_deps):
+        return ((COL_CMDS_TV_EXEC, cmd.exec_str),
+                (COL_CMDS_TV_COMMAND_ID, command_id),
+                (COL_CMDS_TV_STATUS_ACTUAL, cmd.status ()),
+                (COL_CMDS_TV_HOST, host),
+                (COL_CMDS_TV_CPU_USAGE, "%.2f" % (cmd.cpu_usage * 100)),
+                (COL_CMDS_TV_MEM_VSIZE, int(cmd.mem_vsize_bytes / 1024)),
+                (COL_CMDS_TV_AUTO_RESPAWN, cmd.auto_respawn))
+
+    def _get_cmd_host(self, cmd):
+        try:
+            return self.sheriff.get_command_deputy(cmd).name
+        except KeyError:
+            return ""
+
+    def _set_cmd_aggregate_values(self, cmd, values):
+        """Replaces what cmd counts for in the aggregates of its groups with
+        values, a tuple (group, status, host, cpu_usage, mem_vsize_kb), or
+        None to remove it."""
+        old_values = self._cmd_aggregate_values.pop(cmd, None)
+        if old_values == values:
+            if values is not None:
+                self._cmd_aggregate_values[cmd] = values
+            return
+        if old_values is not None:
+            for group_name in _group_and_ancestors(old_values[0]):
+                aggregate = self.group_aggregates[group_name]
+                aggregate.remove(*old_values[1:])
+                if not aggregate.num_cmds:
+                    del self.group_aggregates[group_name]
+                self._dirty_groups.add(group_name)
+        if values is not None:
+            self._cmd_aggregate_values[cmd] = values
+            for group_name in _group_and_ancestors(values[0]):
+                aggregate = self.group_aggregates.get(group_name)
+                if aggregate is None:
+                    aggregate = GroupAggregate()
+                    self.group_aggregates[group_name] = aggregate
+                aggregate.add(*values[1:])
+                self._dirty_groups.add(group_name)
+        self._schedule_refresh()
+
+    def _update_cmd_aggregate_values(self, cmd, host):
+        self._set_cmd_aggregate_values(cmd, (cmd.group, cmd.status(), host,
+            cmd.cpu_usage, int(cmd.mem_vsize_bytes / 1024)))
+
+    def _update_cmd_row(self, cmd):
+        trr = self.cmd_row_references[cmd]
+        model_iter = self.get_iter(trr.get_path())
+        host = self._get_cmd_host(cmd)
+        self._set_changed(model_iter, self._cmd_row_values(cmd, host))
+        # the aggregates are updated even if the displayed values aren't,
+        # e.g. when the CPU usage changes by less than the rounding of its
+        # column, so that they stay the sums of the commands' values
+        self._update_cmd_aggregate_values(cmd, host)
+
+    def _update_group_row(self, group_name, group_rr):
         model_iter = self.get_iter(group_rr.get_path())
         # row represents a procman group
-        children = self.get_group_row_child_commands_recursive(model_iter)
-        if not children:
+        aggregate = self.group_aggregates.get(group_name)
+        if aggregate is None:
             return
 
-        # aggregate command status
-        statuses = [ child.status () for child in children ]
-        stopped_statuses = [sheriff.STOPPED_OK, sheriff.STOPPED_ERROR]
-        if all ([s == statuses[0] for s in statuses]):
-            status_str = statuses[0]
-        elif all ([s in stopped_statuses for s in statuses]):
-            status_str = "Stopped (Mixed)"
-        else:
-            status_str = "Mixed"
-
-        # aggregate host information
-        child_deps = set([ cmd_deps[child] for child in children \
-                if child in cmd_deps ])
-        if len(child_deps) == 1:
-            dep_str = child_deps.pop().name
-        else:
-            dep_str = "Mixed"
-
-        # aggregate CPU and memory usage
-        cpu_total = sum ([cmd.cpu_usage for cmd in children])
-        mem_total = sum ([cmd.mem_vsize_bytes / 1024 \
-                for cmd in children])
-        cpu_str = "%.2f" % (cpu_total * 100)
+        status_str = aggregate.get_status()
+        dep_str = aggregate.get_host()
+        mem_total = aggregate.mem_vsize_kb
+        cpu_str = "%.2f" % (max(aggregate.cpu_usage, 0) * 100)
 
         # display group name in command column?
         if self.populate_exec_with_group_name:
@@ -166,97 +250,116 @@ class SheriffCommandModel(gtk.TreeStore):
         else:
             exec_val = ""
 
-        self.set (model_iter,
-                COL_CMDS_TV_STATUS_ACTUAL, status_str,
-                COL_CMDS_TV_EXEC, exec_val,
-                COL_CMDS_TV_HOST, dep_str,
-                COL_CMDS_TV_CPU_USAGE, cpu_str,
-                COL_CMDS_TV_MEM_VSIZE, mem_total)
-
-    def _dispatch_row_changes(self, model, path, model_iter, user_data):
-        cmds_to_add, cmd_rows_to_remove, cmds_rows_to_update, group_rows_to_update = user_data
-        cmd = self.iter_to_command(model_iter)
-        if cmd:
-            if cmd in cmds_to_add:
-                cmds_rows_to_update.append(gtk.TreeRowReference(model, path))
-                cmds_to_add.remove(cmd)
-            else:
-                cmd_rows_to_remove.append(gtk.TreeRowReference(model, path))
+        self._set_changed (model_iter,
+                ((COL_CMDS_TV_STATUS_ACTUAL, status_str),
+                (COL_CMDS_TV_EXEC, exec_val),
+                (COL_CMDS_TV_HOST, dep_str),
+                (COL_CMDS_TV_CPU_USAGE, cpu_str),
+                (COL_CMDS_TV_MEM_VSIZE, mem_total)))
+
+    def _schedule_refresh(self):
+        if self._refresh_source_id is None:
+            self._refresh_source_id = gobject.timeout_add( \
+                    REFRESH_INTERVAL_MS, self._on_refresh_timeout)
+
+    def _on_refresh_timeout(self):
+        self._refresh_source_id = None
+        self._refresh()
+        return False
+
+    def _refresh(self):
+        dirty_cmds = self._dirty_cmds
+        self._dirty_cmds = set()
+        for cmd in dirty_cmds:
+            if cmd in self.cmd_row_references:
+                self._update_cmd_row(cmd)
+        dirty_groups = self._dirty_groups
+        self._dirty_groups = set()
+        for group_name in dirty_groups:
+            trr = self.group_row_references.get(group_name)
+            if trr is not None:
+                self._update_group_row(group_name, trr)
+
+    def _add_cmd_row(self, cmd):
+        parent = self._find_or_make_group_row_reference(cmd.group)
+        if parent:
+            parent_iter = self.get_iter(parent.get_path())
         else:
-            group_rows_to_update.append(gtk.TreeRowReference(model, path))
+            parent_iter = None
+        new_row = [ None ] * NUM_CMDS_ROWS
+        new_row[COL_CMDS_TV_OBJ] = cmd
+        new_row[COL_CMDS_TV_FULL_GROUP] = ""
+        host = self._get_cmd_host(cmd)
+        for col, val in self._cmd_row_values(cmd, host):
+            new_row[col] = val
+        model_iter = self.append(parent_iter, new_row)
+        self.cmd_row_references[cmd] = gtk.TreeRowReference(self,
+                self.get_path(model_iter))
+        self._update_cmd_aggregate_values(cmd, host)
+
+    def _remove_cmd_row(self, cmd):
+        trr = self.cmd_row_references.pop(cmd)
+        self._set_cmd_aggregate_values(cmd, None)
+        model_iter = self.get_iter(trr.get_path())
+        parent_iter = self.iter_parent(model_iter)
+        self.remove(model_iter)
+
+        # remove group rows left with no children
+        while parent_iter is not None and \
+                not self.iter_has_child(parent_iter):
+            grandparent_iter = self.iter_parent(parent_iter)
+            group_name = self.get_value(parent_iter, COL_CMDS_TV_FULL_GROUP)
+            del self.group_row_references[group_name]
+            self.remove(parent_iter)
+            parent_iter = grandparent_iter
+
+    # Sheriff event handlers
+    def _on_command_added(self, deputy, cmd):
+        if cmd not in self.cmd_row_references:
+            self._add_cmd_row(cmd)
+
+    def _on_command_removed(self, deputy, cmd):
+        if cmd in self.cmd_row_references:
+            self._remove_cmd_row(cmd)
+
+    def _on_command_status_changed(self, cmd, old_status, new_status):
+        trr = self.cmd_row_references.get(cmd)
+        if trr is None:
+            return
+        model_iter = self.get_iter(trr.get_path())
+        self.set(model_iter, COL_CMDS_TV_STATUS_ACTUAL, new_status)
+        values = self._cmd_aggregate_values[cmd]
+        self._set_cmd_aggregate_values(cmd,
+                (values[0], new_status) + values[2:])
+
+    def _on_command_group_changed(self, cmd):
+        if cmd not in self.cmd_row_references:
+            return
+        self._remove_cmd_row(cmd)
+        self._add_cmd_row(cmd)
+
+    def _on_command_changed(self, cmd):
+        if cmd in self.cmd_row_references:
+            self._update_cmd_row(cmd)
+
+    def _on_deputy_info_received(self, deputy):
+        # CPU and memory usage change with every update from the deputy.
+        # Commands are updated together later, so that a deputy's updates
+        # don't cause the rows to be redrawn more often than that.
+        self._dirty_cmds.update(deputy.get_commands())
+        self._schedule_refresh()
 
     def repopulate(self):
-        cmds_to_add = set()
-        cmd_deps = {}
+        """Updates every row from scratch."""
+        if self._refresh_source_id is not None:
+            gobject.source_remove(self._refresh_source_id)
+            self._refresh_source_id = None
+        for cmd in self.cmd_row_references.keys():
+            self._remove_cmd_row(cmd)
         for deputy in self.sheriff.get_deputies ():
             for cmd in deputy.get_commands ():
-                cmd_deps [cmd] = deputy
-                cmds_to_add.add (cmd)
-        cmd_rows_to_remove = []
-        cmd_rows_to_reparent = []
-        cmds_rows_to_update = []
-        group_rows_to_update = []
-
-        # Figure out which rows should be added/updated/removed etc...
-        # On return, the cmds_to_add set will
-        # contain commands that were not updated (i.e., commands that need to
-        # be added into the model)
-        self.foreach(self._dispatch_row_changes,
-                (cmds_to_add, cmd_rows_to_remove, cmds_rows_to_update, group_rows_to_update))
-
-        # update the command rows that should be updated
-        for trr in cmds_rows_to_update:
-            self._update_cmd_row(trr, cmd_deps, cmd_rows_to_reparent)
-
-        # update the group rows that should be updated
-        for trr in group_rows_to_update:
-            self._update_group_row(trr, cmd_deps)
-
-
-        # reparent rows that are in the wrong group
-        for trr, newparent_rr in cmd_rows_to_reparent:
-            orig_iter = self.get_iter(trr.get_path ())
-            rowdata = self.get (orig_iter, *range(NUM_CMDS_ROWS))
-            self.remove (orig_iter)
-
-            newparent_iter = None
-            if newparent_rr:
-                newparent_iter = self.get_iter(newparent_rr.get_path())
-            self.append(newparent_iter, rowdata)
-
-        # remove rows that have been marked for deletion
-        for trr in cmd_rows_to_remove:
-            self.remove(self.get_iter(trr.get_path()))
-
-        # remove group rows with no children
-        groups_to_remove = []
-        def _check_for_lonely_groups(model, path, model_iter, user_data):
-            is_group = self._is_group_row(model_iter)
-            if is_group and not model.iter_has_child(model_iter):
-                groups_to_remove.append(gtk.TreeRowReference(model, path))
-        self.foreach(_check_for_lonely_groups, None)
-        for trr in groups_to_remove:
-            self._delete_group_row_reference(trr)
-
-        # create new rows for new commands
-        for cmd in cmds_to_add:
-            deputy = cmd_deps[cmd]
-            parent = self._find_or_make_group_row_reference(cmd.group)
-
-            new_row = (cmd,        # COL_CMDS_TV_OBJ
-                cmd.exec_str,      # COL_CMDS_TV_EXEC
-                "",                # COL_CMDS_TV_FULL_GROUP
-                cmd.command_id,    # COL_CMDS_TV_COMMAND_ID
-                deputy.name,       # COL_CMDS_TV_HOST
-                cmd.status (),     # COL_CMDS_TV_STATUS_ACTUAL
-                "0",               # COL_CMDS_TV_CPU_USAGE
-                0,                 # COL_CMDS_TV_MEM_VSIZE
-                cmd.auto_respawn,  # COL_CMDS_TV_AUTO_RESPAWN
-                )
-            if parent:
-                self.append(self.get_iter(parent.get_path()), new_row)
-            else:
-                self.append(None, new_row)
+                self._add_cmd_row(cmd)
+        self._refresh()
 
     def rows_to_commands(self, rows):
         col = COL_CMDS_TV_OBJ
@@ -271,6 +374,12 @@ class SheriffCommandModel(gtk.TreeStore):
                     selected.add(child)
         return selected
 
+    def get_group_aggregate(self, model_iter):
+        """Returns the GroupAggregate for a group row, or None if the group
+        has no commands."""
+        group_name = self.get_value(model_iter, COL_CMDS_TV_FULL_GROUP)
+        return self.group_aggregates.get(group_name)
+
     def iter_to_command(self, model_iter):
         return self.get_value(model_iter, COL_CMDS_TV_OBJ)
 
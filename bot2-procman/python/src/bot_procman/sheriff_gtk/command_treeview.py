@@ -427,23 +427,24 @@ class SheriffCommandTreeView(gtk.TreeView):
         cmd = self.cmds_ts.iter_to_command(model_iter)
         if not cmd:
             # group node
-            children = self.cmds_ts.get_group_row_child_commands_recursive(model_iter)
+            aggregate = self.cmds_ts.get_group_aggregate(model_iter)
 
-            if not children:
+            if aggregate is None:
                 cell.set_property ("cell-background-set", False)
             else:
-                statuses = [ cmd.status () for cmd in children ]
+                status_counts = aggregate.status_counts
 
-                if all ([s == statuses[0] for s in statuses]):
+                if len(status_counts) == 1:
                     # if all the commands in a group have the same status, then
                     # color them by that status
-                    if statuses[0] == sheriff.STOPPED_OK:
+                    status = status_counts.keys()[0]
+                    if status == sheriff.STOPPED_OK:
                         cell.set_property("cell-background-set", False)
                         cell.set_property("foreground-set", False)
                     else:
                         cell.set_property("cell-background-set", True)
                         cell.set_property("foreground-set", True)
-                        cell.set_property("cell-background", color_map[statuses[0]])
+                        cell.set_property("cell-background", color_map[status])
                         cell.set_property("foreground", "Black")
                 else:
                     # otherwise, color them yellow
@@ -156,32 +156,44 @@ class PreferencesDialog(gtk.Dialog):
                 gtk.DIALOG_MODAL | gtk.DIALOG_DESTROY_WITH_PARENT,
                 (gtk.STOCK_OK, gtk.RESPONSE_ACCEPT,
                  gtk.STOCK_CANCEL, gtk.RESPONSE_REJECT))
-        table = gtk.Table(4, 2)
-
-        # console rate limit
-        table.attach(gtk.Label("Console rate limit (kB/s)"), 0, 1, 0, 1, 0, 0)
-        self.rate_limit_sb = gtk.SpinButton()
-        self.rate_limit_sb.set_digits(0)
-        self.rate_limit_sb.set_increments(1, 1000)
-        self.rate_limit_sb.set_range(0, 999999)
-        self.rate_limit_sb.set_value(sheriff_gtk.cmd_console.get_output_rate_limit())
-
-        table.attach(self.rate_limit_sb, 1, 2, 0, 1)
+        table = gtk.Table(6, 2)
+
+        # console rate limits
+        def make_rate_limit_sb(row, label, value):
+            table.attach(gtk.Label(label), 0, 1, row, row + 1, 0, 0)
+            sb = gtk.SpinButton()
+            sb.set_digits(0)
+            sb.set_increments(1, 1000)
+            sb.set_range(0, 999999)
+            sb.set_value(value)
+            table.attach(sb, 1, 2, row, row + 1)
+            return sb
+
+        console = sheriff_gtk.cmd_console
+        self.rate_limit_sb = make_rate_limit_sb(0,
+                "Console rate limit per command (kB/s)",
+                console.get_output_rate_limit())
+        self.deputy_rate_limit_sb = make_rate_limit_sb(1,
+                "Console rate limit per deputy (kB/s)",
+                console.get_deputy_output_rate_limit())
+        self.total_rate_limit_sb = make_rate_limit_sb(2,
+                "Console rate limit for all output (kB/s)",
+                console.get_total_output_rate_limit())
 
         # background color
-        table.attach(gtk.Label("Console background color"), 0, 1, 1, 2, 0, 0)
+        table.attach(gtk.Label("Console background color"), 0, 1, 3, 4, 0, 0)
         self.bg_color_bt = gtk.ColorButton(sheriff_gtk.cmd_console.get_background_color())
-        table.attach(self.bg_color_bt, 1, 2, 1, 2)
+        table.attach(self.bg_color_bt, 1, 2, 3, 4)
 
         # foreground color
-        table.attach(gtk.Label("Console text color"), 0, 1, 2, 3, 0, 0)
+        table.attach(gtk.Label("Console text color"), 0, 1, 4, 5, 0, 0)
         self.text_color_bt = gtk.ColorButton(sheriff_gtk.cmd_console.get_text_color())
-        table.attach(self.text_color_bt, 1, 2, 2, 3)
+        table.attach(self.text_color_bt, 1, 2, 4, 5)
 
         # font
-        table.attach(gtk.Label("Console font"), 0, 1, 3, 4, 0, 0)
+        table.attach(gtk.Label("Console font"), 0, 1, 5, 6, 0, 0)
         self.font_bt = gtk.FontButton(sheriff_gtk.cmd_console.get_font())
-        table.attach(self.font_bt, 1, 2, 3, 4)
+        table.attach(self.font_bt, 1, 2, 5, 6)
 
         self.vbox.pack_start (table, False, False, 0)
         table.show_all ()
@@ -274,9 +286,14 @@ class AddModifyScriptDialog (gtk.Dialog):
         start cmd "client";
         stop cmd "server" wait "stopped";
         restart group "mygroup";
-        wait group "mygroup" status "running";
+        wait group "mygroup" status "running" timeout 5000;
         wait ms 500;
         run_script "other-script-name";
+        parallel {
+            start cmd "a" wait "running" as "a";
+            start cmd "b" wait "running" as "b";
+            start cmd "c" after "a" "b";
+        }
 """)
 
 #    Refer to commands and groups by what appears in the Name column.
@@ -376,6 +393,8 @@ def do_preferences_dialog(sheriff_gtk, window):
         sheriff_gtk.cmd_console.set_background_color(dlg.bg_color_bt.get_color())
         sheriff_gtk.cmd_console.set_text_color(dlg.text_color_bt.get_color())
         sheriff_gtk.cmd_console.set_output_rate_limit(dlg.rate_limit_sb.get_value_as_int())
+        sheriff_gtk.cmd_console.set_deputy_output_rate_limit(dlg.deputy_rate_limit_sb.get_value_as_int())
+        sheriff_gtk.cmd_console.set_total_output_rate_limit(dlg.total_rate_limit_sb.get_value_as_int())
         sheriff_gtk.cmd_console.set_font(dlg.font_bt.get_font_name())
 
 #        sheriff_gtk.cmds_tv.set_background_color(dlg.bg_color_bt.get_color())
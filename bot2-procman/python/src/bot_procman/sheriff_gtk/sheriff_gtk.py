@@ -19,6 +19,9 @@ from lcm import LCM
 from bot_procman.orders_t import orders_t
 import bot_procman.sheriff as sheriff
 import bot_procman.sheriff_config as sheriff_config
+from bot_procman.scheduler import make_scheduler, SCHEDULER_NAMES
+from bot_procman.sheriff_headless import SheriffHeadless, \
+        find_bot_procman_deputy_cmd, pop_delta_orders_option
 
 import bot_procman.sheriff_gtk.command_model as cm
 import bot_procman.sheriff_gtk.command_treeview as ctv
@@ -31,17 +34,6 @@ try:
 except ImportError:
     BUILD_PREFIX = None
 
-def find_bot_procman_deputy_cmd():
-    search_path = []
-    if BUILD_PREFIX is not None:
-        search_path.append("%s/bin" % BUILD_PREFIX)
-    search_path.extend(os.getenv("PATH").split(":"))
-    for dirname in search_path:
-        fname = "%s/bot-procman-deputy" % dirname
-        if os.path.exists(fname) and os.path.isfile(fname):
-            return fname
-    return None
-
 def find_bot_procman_glade():
     search_path = []
     if BUILD_PREFIX:
@@ -67,7 +59,6 @@ def split_script_name(name):
 class SheriffGtk(object):
     def __init__ (self, lc):
         self.lc = lc
-        self.cmds_update_scheduled = False
         self.config_filename = None
         self.script_done_action = None
 
@@ -76,24 +67,18 @@ class SheriffGtk(object):
 
         # create sheriff and subscribe to events
         self.sheriff = sheriff.Sheriff (self.lc)
-        self.sheriff.command_added.connect(self._schedule_cmds_update)
-        self.sheriff.command_removed.connect(self._schedule_cmds_update)
-        self.sheriff.command_status_changed.connect(self._schedule_cmds_update)
-        self.sheriff.command_group_changed.connect(self._schedule_cmds_update)
         self.sheriff.script_started.connect(self._on_script_started)
         self.sheriff.script_action_executing.connect(self._on_script_action_executing)
+        self.sheriff.script_action_timed_out.connect(self._on_script_action_timed_out)
         self.sheriff.script_finished.connect(self._on_script_finished)
         self.sheriff.script_added.connect(self._on_script_added)
         self.sheriff.script_removed.connect(self._on_script_removed)
 
         # update very soon
         gobject.timeout_add(100, lambda *s: self.hosts_ts.update() and False)
-        gobject.timeout_add(100, lambda *s: self._schedule_cmds_update() and False)
 
         # and then periodically
         gobject.timeout_add (1000, self._maybe_send_orders)
-        gobject.timeout_add (1000,
-                lambda *s: self._schedule_cmds_update () or True)
 
         self.lc.subscribe ("PMD_ORDERS", self.on_procman_orders)
 
@@ -195,6 +180,7 @@ class SheriffGtk(object):
         self.statusbar_context_script = self.statusbar.get_context_id("script")
         self.statusbar_context_main = self.statusbar.get_context_id("main")
         self.statusbar_context_script_msg = None
+        self.script_timed_out_action = None
 
         config_dir = os.path.join(glib.get_user_config_dir(), "procman-sheriff")
         if not os.path.exists(config_dir):
@@ -261,15 +247,6 @@ class SheriffGtk(object):
         except Exception, err:
             print err
 
-    def _do_repopulate(self):
-        self.cmds_ts.repopulate()
-        self.cmds_update_scheduled = False
-
-    def _schedule_cmds_update(self, *unused):
-        if not self.cmds_update_scheduled:
-            gobject.timeout_add(100, self._do_repopulate)
-        return True
-
     def _terminate_spawned_deputy(self):
         if self.spawned_deputy:
             try:
@@ -340,12 +317,20 @@ class SheriffGtk(object):
         msg = "Action: %s" % str(action)
         self.statusbar_context_script_msg = self.statusbar.push(cid, msg)
 
+    def _on_script_action_timed_out(self, script, action):
+        self.script_timed_out_action = action
+
     def _on_script_finished(self, script):
         self._update_menu_item_sensitivities()
         cid = self.statusbar_context_script
         self.statusbar.pop(cid)
-        self.statusbar_context_script_msg = self.statusbar.push(cid, \
-                "Script %s: finished" % script.name)
+        if self.script_timed_out_action is not None:
+            msg = "Script %s: timed out on %s" % (script.name,
+                    str(self.script_timed_out_action))
+            self.script_timed_out_action = None
+        else:
+            msg = "Script %s: finished" % script.name
+        self.statusbar_context_script_msg = self.statusbar.push(cid, msg)
         def _remove_msg_func(msg_id):
             return lambda *s: msg_id == self.statusbar_context_script_msg and self.statusbar.pop(cid)
         gobject.timeout_add(6000, _remove_msg_func(self.statusbar_context_script_msg))
@@ -573,118 +558,6 @@ class SheriffGtk(object):
             gobject.timeout_add (6000,
                     lambda *s: self.statusbar.pop (self.statusbar.get_context_id ("main")))
 
-class SheriffHeadless(object):
-    def __init__(self, lc, config, spawn_deputy, script_name, script_done_action):
-        self.sheriff = sheriff.Sheriff(lc)
-        self.spawn_deputy = spawn_deputy
-        self.spawned_deputy = None
-        self.config = config
-        self.script_name = script_name
-        self.script = None
-        self.mainloop = None
-        self.lc = lc
-        self.lc.subscribe ("PMD_ORDERS", self._on_procman_orders)
-        if script_done_action is None:
-            self.script_done_action = "exit"
-        else:
-            self.script_done_action = script_done_action
-
-    def _terminate_spawned_deputy(self):
-        if not self.spawned_deputy:
-            return
-
-        print("Terminating local deputy..")
-        try:
-            self.spawned_deputy.terminate()
-        except AttributeError: # python 2.4, 2.5 don't have Popen.terminate()
-            os.kill(self.spawned_deputy.pid, signal.SIGTERM)
-            self.spawned_deputy.wait()
-        self.spawned_deputy = None
-
-    def _start_script(self):
-        if not self.script:
-            return False
-        print("Running script %s" % self.script_name)
-        errors = self.sheriff.execute_script(self.script)
-        if errors:
-            print("Script failed to run.  Errors detected:\n" + "\n".join(errors))
-            self._terminate_spawned_deputy()
-            sys.exit(1)
-        return False
-
-    def _on_script_finished(self, *args):
-        if self.script_done_action == "exit":
-            print("Script \"%s\" finished.  Exiting" % self.script_name)
-            self.mainloop.quit()
-        elif self.script_done_action == "observe":
-            print("Script \"%s\" finished.  Self-demoting to observer" % self.script_name)
-            self.sheriff.set_observer(True)
-
-    def _maybe_send_orders(self):
-        if not self.sheriff.is_observer():
-            self.sheriff.send_orders()
-        return True
-
-    def _on_procman_orders(self, channel, data):
-        if self.sheriff.is_observer():
-            return
-
-        msg = orders_t.decode(data)
-        if self.sheriff.name != msg.sheriff_name:
-            # detected the presence of another sheriff that is not this one.
-            # self-demote to prevent command thrashing
-            self.sheriff.set_observer(True)
-
-    def run(self):
-        self.mainloop = glib.MainLoop()
-
-        # parse the config file
-        if self.config is not None:
-            self.sheriff.load_config(self.config, False)
-
-        # start a local deputy?
-        if self.spawn_deputy:
-            bot_procman_deputy_cmd = find_bot_procman_deputy_cmd()
-            args = [ bot_procman_deputy_cmd, "-n", "localhost" ]
-            if not bot_procman_deputy_cmd:
-                sys.stderr.write("Can't find bot-procman-deputy.")
-                sys.exit(1)
-            self.spawned_deputy = subprocess.Popen(args)
-        else:
-            self.spawned_deputy = None
-
-        # run a script
-        if self.script_name:
-            self.script = self.sheriff.get_script(self.script_name)
-            if not self.script:
-                print "No such script: %s" % self.script_name
-                self._terminate_spawned_deputy()
-                sys.exit(1)
-            errors = self.sheriff.check_script_for_errors(self.script)
-            if errors:
-                print "Unable to run script.  Errors were detected:\n\n"
-                print "\n    ".join(errors)
-                self._terminate_spawned_deputy()
-                sys.exit(1)
-
-            self.sheriff.script_finished.connect(self._on_script_finished)
-
-            # delay script execution by 200 ms.
-            gobject.timeout_add(200, self._start_script)
-
-        signal.signal(signal.SIGINT, lambda *s: mainloop.quit())
-        signal.signal(signal.SIGTERM, lambda *s: mainloop.quit())
-        signal.signal(signal.SIGHUP, lambda *s: mainloop.quit())
-        gobject.timeout_add(1000, self._maybe_send_orders)
-
-        try:
-            self.mainloop.run()
-        except KeyboardInterrupt:
-            pass
-        print("Sheriff terminating..")
-        self._terminate_spawned_deputy()
-        return 0
-
 def usage():
     sys.stdout.write(
 """usage: %s [options] [<procman_config_file> [<script_name>]]
@@ -709,6 +582,17 @@ Options:
                       If set to "observe", then the sheriff self-demotes to
                       observer mode.
 
+  --event-loop <%s>
+                      Only valid in headless mode.  The event loop to run on.
+                      The default is asyncio if it is available, and glib
+                      otherwise.
+
+  --delta-orders[=<keepalive_s>]
+                      Only send orders to a deputy when they have changed,
+                      when the deputy's reported state disagrees with them,
+                      or every keepalive_s seconds (default %g) otherwise.
+                      This reduces the network traffic of large configs.
+
   -h, --help          Shows this help text
 
 If <procman_config_file> is specified, then the sheriff tries to load
@@ -717,13 +601,20 @@ deputy commands from the file.
 If <script_name> is additionally specified, then the sheriff executes the
 named script once the config file is loaded.
 
-""" % os.path.basename(sys.argv[0]))
+""" % (os.path.basename(sys.argv[0]), "|".join(SCHEDULER_NAMES),
+        sheriff.DEFAULT_ORDERS_KEEPALIVE_INTERVAL))
     sys.exit(1)
 
 def main():
+    argv = sys.argv[1:]
+    try:
+        delta_orders_keepalive = pop_delta_orders_option(argv)
+    except ValueError:
+        usage()
     try:
-        opts, args = getopt.getopt( sys.argv[1:], 'hlon',
-                ['help','lone-ranger', 'on-script-complete=', 'no-gui', 'observer'] )
+        opts, args = getopt.getopt( argv, 'hlon',
+                ['help','lone-ranger', 'on-script-complete=', 'no-gui', 'observer',
+                    'event-loop='] )
     except getopt.GetoptError:
         usage()
         sys.exit(2)
@@ -732,6 +623,7 @@ def main():
     use_gui = True
     script_done_action = None
     observer = False
+    event_loop = None
 
     for optval, argval in opts:
         if optval in [ '-l', '--lone-ranger' ]:
@@ -744,9 +636,16 @@ def main():
             script_done_action = argval
             if argval not in [ "exit", "observe" ]:
                 usage()
+        elif optval in [ '--event-loop' ]:
+            event_loop = argval
+            if argval not in SCHEDULER_NAMES:
+                usage()
         elif optval in [ '-h', '--help' ]:
             usage()
 
+    if event_loop is not None and use_gui:
+        usage()
+
     cfg = None
     script_name = None
     if len(args) > 0:
@@ -771,16 +670,19 @@ def main():
             sys.exit(1)
 
     lc = LCM()
-    def handle(*a):
-        try:
-            lc.handle()
-        except Exception:
-            traceback.print_exc()
-        return True
-    gobject.io_add_watch(lc, gobject.IO_IN, handle)
 
     if use_gui:
+        def handle(*a):
+            try:
+                lc.handle()
+            except Exception:
+                traceback.print_exc()
+            return True
+        gobject.io_add_watch(lc, gobject.IO_IN, handle)
+
         gui = SheriffGtk(lc)
+        if delta_orders_keepalive is not None:
+            gui.sheriff.set_delta_orders(True, delta_orders_keepalive)
         if observer:
             gui.set_observer(True)
         if spawn_deputy:
@@ -815,7 +717,11 @@ def main():
         if not script_name:
             print("No script specified and running in headless mode.  Exiting")
             sys.exit(1)
-        SheriffHeadless(lc, cfg, spawn_deputy, script_name, script_done_action).run()
+        headless = SheriffHeadless(lc, cfg, spawn_deputy, script_name,
+            script_done_action, make_scheduler(event_loop))
+        if delta_orders_keepalive is not None:
+            headless.sheriff.set_delta_orders(True, delta_orders_keepalive)
+        sys.exit(headless.run())
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import traceback
+import getopt
+import subprocess
+import signal
+
+from lcm import LCM
+
+from bot_procman.orders_t import orders_t
+import bot_procman.sheriff as sheriff
+import bot_procman.sheriff_config as sheriff_config
+from bot_procman.scheduler import make_scheduler, SCHEDULER_NAMES
+
+try:
+    from bot_procman.build_prefix import BUILD_PREFIX
+except ImportError:
+    BUILD_PREFIX = None
+
+def find_bot_procman_deputy_cmd():
+    search_path = []
+    if BUILD_PREFIX is not None:
+        search_path.append("%s/bin" % BUILD_PREFIX)
+    search_path.extend(os.getenv("PATH").split(":"))
+    for dirname in search_path:
+        fname = "%s/bot-procman-deputy" % dirname
+        if os.path.exists(fname) and os.path.isfile(fname):
+            return fname
+    return None
+
+def pop_delta_orders_option(argv):
+    """Removes the --delta-orders[=<keepalive_s>] options from argv, as
+    getopt can't parse an option whose argument is optional.
+
+    Returns the keepalive interval (seconds) given by the last such option,
+    the default interval if it has no argument, or None if there is none.
+    Raises ValueError if the interval isn't a positive number.
+    """
+    keepalive = None
+    remaining = []
+    for i, arg in enumerate(argv):
+        if arg == "--":
+            remaining.extend(argv[i:])
+            break
+        if arg == "--delta-orders":
+            keepalive = sheriff.DEFAULT_ORDERS_KEEPALIVE_INTERVAL
+        elif arg.startswith("--delta-orders="):
+            keepalive = float(arg[len("--delta-orders="):])
+            if not keepalive > 0:
+                raise ValueError("invalid keepalive interval: %s" % arg)
+        else:
+            remaining.append(arg)
+    argv[:] = remaining
+    return keepalive
+
+class SheriffHeadless(object):
+    """Runs a script without a GUI.
+
+    The sheriff runs on scheduler, a bot_procman.scheduler.Scheduler.  If
+    scheduler is None, then one is made with make_scheduler(), which doesn't
+    need GLib if asyncio is available.
+    """
+    def __init__(self, lc, config, spawn_deputy, script_name,
+            script_done_action, scheduler=None):
+        if scheduler is None:
+            scheduler = make_scheduler()
+        self.scheduler = scheduler
+        self.sheriff = sheriff.Sheriff(lc, scheduler)
+        self.spawn_deputy = spawn_deputy
+        self.spawned_deputy = None
+        self.config = config
+        self.script_name = script_name
+        self.script = None
+        self.exit_code = 0
+        self.lc = lc
+        self.lc.subscribe ("PMD_ORDERS", self._on_procman_orders)
+        if script_done_action is None:
+            self.script_done_action = "exit"
+        else:
+            self.script_done_action = script_done_action
+
+    def _terminate_spawned_deputy(self):
+        if not self.spawned_deputy:
+            return
+
+        print("Terminating local deputy..")
+        try:
+            self.spawned_deputy.terminate()
+        except AttributeError: # python 2.4, 2.5 don't have Popen.terminate()
+            os.kill(self.spawned_deputy.pid, signal.SIGTERM)
+            self.spawned_deputy.wait()
+        self.spawned_deputy = None
+
+    def _start_script(self):
+        if not self.script:
+            return False
+        print("Running script %s" % self.script_name)
+        errors = self.sheriff.execute_script(self.script)
+        if errors:
+            print("Script failed to run.  Errors detected:\n" + "\n".join(errors))
+            self._terminate_spawned_deputy()
+            sys.exit(1)
+        return False
+
+    def _on_script_action_timed_out(self, script, action):
+        print("Script \"%s\" timed out on action: %s" % (self.script_name,
+            str(action)))
+        self.exit_code = 1
+
+    def _on_script_finished(self, *args):
+        if self.script_done_action == "exit":
+            print("Script \"%s\" finished.  Exiting" % self.script_name)
+            self.scheduler.stop()
+        elif self.script_done_action == "observe":
+            print("Script \"%s\" finished.  Self-demoting to observer" % self.script_name)
+            self.sheriff.set_observer(True)
+
+    def _maybe_send_orders(self):
+        if not self.sheriff.is_observer():
+            self.sheriff.send_orders()
+        return True
+
+    def _on_procman_orders(self, channel, data):
+        if self.sheriff.is_observer():
+            return
+
+        msg = orders_t.decode(data)
+        if self.sheriff.get_name() != msg.sheriff_name:
+            # detected the presence of another sheriff that is not this one.
+            # self-demote to prevent command thrashing
+            self.sheriff.set_observer(True)
+
+    def _handle_lcm(self):
+        try:
+            self.lc.handle()
+        except Exception:
+            traceback.print_exc()
+
+    def run(self):
+        # parse the config file
+        if self.config is not None:
+            self.sheriff.load_config(self.config, False)
+
+        # start a local deputy?
+        if self.spawn_deputy:
+            bot_procman_deputy_cmd = find_bot_procman_deputy_cmd()
+            args = [ bot_procman_deputy_cmd, "-n", "localhost" ]
+            if not bot_procman_deputy_cmd:
+                sys.stderr.write("Can't find bot-procman-deputy.")
+                sys.exit(1)
+            self.spawned_deputy = subprocess.Popen(args)
+        else:
+            self.spawned_deputy = None
+
+        # run a script
+        if self.script_name:
+            self.script = self.sheriff.get_script(self.script_name)
+            if not self.script:
+                print "No such script: %s" % self.script_name
+                self._terminate_spawned_deputy()
+                sys.exit(1)
+            errors = self.sheriff.check_script_for_errors(self.script)
+            if errors:
+                print "Unable to run script.  Errors were detected:\n\n"
+                print "\n    ".join(errors)
+                self._terminate_spawned_deputy()
+                sys.exit(1)
+
+            self.sheriff.script_action_timed_out.connect(
+                    self._on_script_action_timed_out)
+            self.sheriff.script_finished.connect(self._on_script_finished)
+
+            # delay script execution by 200 ms.
+            self.scheduler.call_later(200, self._start_script)
+
+        signal.signal(signal.SIGINT, lambda *s: self.scheduler.stop())
+        signal.signal(signal.SIGTERM, lambda *s: self.scheduler.stop())
+        signal.signal(signal.SIGHUP, lambda *s: self.scheduler.stop())
+        self.scheduler.add_reader(self.lc, self._handle_lcm)
+        self.scheduler.call_repeatedly(1000, self._maybe_send_orders)
+
+        try:
+            self.scheduler.run()
+        except KeyboardInterrupt:
+            pass
+        print("Sheriff terminating..")
+        self._terminate_spawned_deputy()
+        return self.exit_code
+
+def usage():
+    sys.stdout.write(
+"""usage: %s [options] <procman_config_file> <script_name>
+
+Runs a procman script without a GUI.
+
+Options:
+  -l, --lone-ranger   Automatically run a deputy within the sheriff process
+                      This deputy terminates with the sheriff, along with
+                      all the commands it hosts.
+
+  --on-script-complete <exit|observe>
+                      If set to "exit", then the sheriff exits when the script
+                      is done executing.  If set to "observe", then the
+                      sheriff self-demotes to observer mode.
+
+  --event-loop <%s>
+                      The event loop to run on.  The default is asyncio if it
+                      is available, and glib otherwise.
+
+  --delta-orders[=<keepalive_s>]
+                      Only send orders to a deputy when they have changed,
+                      when the deputy's reported state disagrees with them,
+                      or every keepalive_s seconds (default %g) otherwise.
+                      This reduces the network traffic of large configs.
+
+  -h, --help          Shows this help text
+
+""" % (os.path.basename(sys.argv[0]), "|".join(SCHEDULER_NAMES),
+        sheriff.DEFAULT_ORDERS_KEEPALIVE_INTERVAL))
+    sys.exit(1)
+
+def main():
+    argv = sys.argv[1:]
+    try:
+        delta_orders_keepalive = pop_delta_orders_option(argv)
+    except ValueError:
+        usage()
+    try:
+        opts, args = getopt.getopt( argv, 'hl',
+                ['help','lone-ranger', 'on-script-complete=', 'event-loop='] )
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    spawn_deputy = False
+    script_done_action = None
+    event_loop = None
+
+    for optval, argval in opts:
+        if optval in [ '-l', '--lone-ranger' ]:
+            spawn_deputy = True
+        elif optval in [ '--on-script-complete' ]:
+            script_done_action = argval
+            if argval not in [ "exit", "observe" ]:
+                usage()
+        elif optval in [ '--event-loop' ]:
+            event_loop = argval
+            if argval not in SCHEDULER_NAMES:
+                usage()
+        elif optval in [ '-h', '--help' ]:
+            usage()
+
+    if len(args) != 2:
+        usage()
+
+    try:
+        cfg = sheriff_config.config_from_filename(args[0])
+    except Exception, xcp:
+        print "Unable to load config file."
+        print xcp
+        sys.exit(1)
+    script_name = args[1]
+
+    lc = LCM()
+    scheduler = make_scheduler(event_loop)
+    headless = SheriffHeadless(lc, cfg, spawn_deputy, script_name,
+        script_done_action, scheduler)
+    if delta_orders_keepalive is not None:
+        headless.sheriff.set_delta_orders(True, delta_orders_keepalive)
+    sys.exit(headless.run())
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,9 @@
-from bot_procman.sheriff_config import ScriptNode, WaitStatusActionNode, WaitMsActionNode, StartStopRestartActionNode, RunScriptActionNode, escape_str
+from bot_procman.sheriff_config import ScriptNode, WaitStatusActionNode, WaitMsActionNode, StartStopRestartActionNode, RunScriptActionNode, ParallelActionNode, escape_str, action_dependency_str, wait_timeout_str
+
+def _copy_dependencies(src, dst):
+    dst.label = src.label
+    dst.after = list(src.after)
+    return dst
 
 class StartStopRestartAction(object):
     """Script action to start, stop, or restart a command or group.
@@ -6,12 +11,21 @@ class StartStopRestartAction(object):
     \ingroup python_api
 
     """
-    def __init__(self, action_type, ident_type, ident, wait_status):
+    def __init__(self, action_type, ident_type, ident, wait_status,
+            timeout_ms=None):
         assert action_type in ["start", "stop", "restart"]
         assert ident_type in [ "everything", "group", "cmd" ]
         self.action_type = action_type
         self.ident_type = ident_type
         self.wait_status = wait_status
+        ## If not None, how long to wait for wait_status before the script is
+        # aborted.
+        self.timeout_ms = timeout_ms
+        ## Name that other actions in the same parallel block can depend on.
+        self.label = None
+        ## Labels of the actions in the same parallel block that must finish
+        # before this action is executed.
+        self.after = []
         if self.ident_type == "everything":
             self.ident = None
         else:
@@ -19,8 +33,9 @@ class StartStopRestartAction(object):
             assert self.ident is not None
 
     def toScriptNode(self):
-        return StartStopRestartActionNode(self.action_type,
-                self.ident_type, self.ident, self.wait_status)
+        return _copy_dependencies(self, StartStopRestartActionNode(
+            self.action_type, self.ident_type, self.ident, self.wait_status,
+            self.timeout_ms))
 
     def __str__(self):
         if self.ident_type == "everything":
@@ -28,10 +43,12 @@ class StartStopRestartAction(object):
         else:
             ident_str = "%s \"%s\"" % (self.ident_type, escape_str(self.ident))
         if self.wait_status is not None:
-            return "%s %s wait \"%s\";" % (self.action_type,
-                    ident_str, self.wait_status)
+            return "%s %s wait \"%s\"%s%s;" % (self.action_type,
+                    ident_str, self.wait_status, wait_timeout_str(self),
+                    action_dependency_str(self))
         else:
-            return "%s %s;" % (self.action_type, ident_str)
+            return "%s %s%s;" % (self.action_type, ident_str,
+                    action_dependency_str(self))
 
 class WaitMsAction(object):
     """Script action to wait a fixed number of milliseconds.
@@ -42,12 +59,14 @@ class WaitMsAction(object):
     def __init__(self, delay_ms):
         self.delay_ms = delay_ms
         self.action_type = "wait_ms"
+        self.label = None
+        self.after = []
 
     def toScriptNode(self):
-        return WaitMsAction(self.delay_ms)
+        return _copy_dependencies(self, WaitMsActionNode(self.delay_ms))
 
     def __str__(self):
-        return "wait ms %d;" % self.delay_ms
+        return "wait ms %d%s;" % (self.delay_ms, action_dependency_str(self))
 
 class WaitStatusAction(object):
     """Script action to wait for a command or group to change status.
@@ -55,19 +74,23 @@ class WaitStatusAction(object):
     \ingroup python_api
 
     """
-    def __init__(self, ident_type, ident, wait_status):
+    def __init__(self, ident_type, ident, wait_status, timeout_ms=None):
         self.ident_type = ident_type
         self.ident = ident
         self.wait_status = wait_status
+        self.timeout_ms = timeout_ms
         self.action_type = "wait_status"
+        self.label = None
+        self.after = []
 
     def toScriptNode(self):
-        return WaitStatusActionNode(self.ident_type,
-                self.ident, self.wait_status)
+        return _copy_dependencies(self, WaitStatusActionNode(self.ident_type,
+                self.ident, self.wait_status, self.timeout_ms))
 
     def __str__(self):
-        return "wait %s \"%s\" status \"%s\";" % \
-                (self.ident_type, escape_str(self.ident), self.wait_status)
+        return "wait %s \"%s\" status \"%s\"%s%s;" % \
+                (self.ident_type, escape_str(self.ident), self.wait_status,
+                        wait_timeout_str(self), action_dependency_str(self))
 
 class RunScriptAction(object):
     """Script action to run a subscript.
@@ -78,12 +101,40 @@ class RunScriptAction(object):
     def __init__(self, script_name):
         self.script_name = script_name
         self.action_type = "run_script"
+        self.label = None
+        self.after = []
 
     def toScriptNode(self):
-        return RunScriptActionNode(self.script_name)
+        return _copy_dependencies(self, RunScriptActionNode(self.script_name))
 
     def __str__(self):
-        return "run_script \"%s\";" % escape_str(self.script_name)
+        return "run_script \"%s\"%s;" % (escape_str(self.script_name),
+                action_dependency_str(self))
+
+class ParallelAction(object):
+    """Script action that executes a block of actions concurrently.
+
+    \ingroup python_api
+
+    Each action in the block is executed as soon as the actions named in
+    its \c after list have finished, or right away if it has none.  The
+    block finishes when all of its actions have finished.
+    """
+    def __init__(self, actions):
+        self.actions = actions
+        self.action_type = "parallel"
+        self.label = None
+        self.after = []
+
+    def toScriptNode(self):
+        return _copy_dependencies(self, ParallelActionNode(
+            [ action.toScriptNode() for action in self.actions ]))
+
+    def __str__(self):
+        val = "parallel%s {" % action_dependency_str(self)
+        for action in self.actions:
+            val = val + "\n    " + str(action).replace("\n", "\n    ")
+        return val + "\n}"
 
 class SheriffScript(object):
     """A simple script that can be executed by the Sheriff.
@@ -107,29 +158,41 @@ class SheriffScript(object):
     def __str__(self):
         val = "script \"%s\" {" % escape_str(self.name)
         for action in self.actions:
-            val = val + "\n    " + str(action)
+            val = val + "\n    " + str(action).replace("\n", "\n    ")
         val = val + "\n}\n"
         return val
 
     @staticmethod
     def from_script_node(node):
         script = SheriffScript(node.name)
-        for action_node in node.actions:
+        for action in SheriffScript._actions_from_nodes(node.actions):
+            script.add_action(action)
+        return script
+
+    @staticmethod
+    def _actions_from_nodes(action_nodes):
+        actions = []
+        for action_node in action_nodes:
             if action_node.action_type in [ "start", "stop", "restart" ]:
                 action = StartStopRestartAction(action_node.action_type,
                         action_node.ident_type,
                         action_node.ident,
-                        action_node.wait_status)
+                        action_node.wait_status,
+                        action_node.timeout_ms)
             elif action_node.action_type == "wait_ms":
                 action = WaitMsAction(action_node.delay_ms)
             elif action_node.action_type == "wait_status":
                 action = WaitStatusAction(action_node.ident_type,
                         action_node.ident,
-                        action_node.wait_status)
+                        action_node.wait_status,
+                        action_node.timeout_ms)
             elif action_node.action_type == "run_script":
                 action = RunScriptAction(action_node.script_name)
+            elif action_node.action_type == "parallel":
+                action = ParallelAction(SheriffScript._actions_from_nodes(
+                    action_node.actions))
             else:
                 raise ValueError("unrecognized action %s" % \
                         action_node.action_type)
-            script.add_action(action)
-        return script
+            actions.append(_copy_dependencies(action_node, action))
+        return actions